@@ -0,0 +1,312 @@
+"""
+This file is used to measure the speed of the ImageModifications pipeline on synthetic images with black borders.
+
+Each public function is timed separately, in a new process for each benchmark so the peak RSS (resident memory) of
+one benchmark does not hide the others. The results are written as JSON to be compared between runs.
+
+Use this file in this way in command line:
+
+python "fullpath_of_this_file" -o "benchmark_results.json" [--quick]
+"""
+
+import sys, os, io, json, time, shutil, argparse, tempfile, platform, multiprocessing
+from contextlib import redirect_stdout
+from functools import partial
+
+sys.path.append(os.path.dirname(__file__))
+
+import numpy as np
+from PIL import Image, __version__ as pillow_version
+import ImageModifications
+from OutputSinks import DirectorySink, TarShardSink
+
+try:
+    import resource
+except ImportError:  # Not available in Windows
+    resource = None
+
+# Synthetic image cases, from small PNGs to 8K JPEGs. Each case is generated for every border width and color mode.
+IMAGE_CASES = {
+    "png_small": dict(size=(640, 360), format="PNG", extension=".png"),
+    "jpeg_hd": dict(size=(1280, 720), format="JPEG", extension=".jpg"),
+    "jpeg_4k": dict(size=(3840, 2160), format="JPEG", extension=".jpg"),
+    "jpeg_8k": dict(size=(7680, 4320), format="JPEG", extension=".jpg"),
+}
+QUICK_IMAGE_CASES = ("png_small", "jpeg_hd")
+# Black border width of each side, as a fraction of the image width and height
+BORDER_WIDTHS = (0.0, 0.05, 0.15)
+COLOR_MODES = ("RGB", "L")
+RESIZE_DIMENSIONS = (1280, 720)
+# Number of times each image is written by the output sink benchmarks, to have many small files
+SINK_BENCHMARK_COPIES = 50
+
+
+def create_synthetic_image(size, border_width, mode="RGB", seed=0):
+    """
+    Create an image with a smooth colored content, some noise (so it does not compress too well) and a black border.
+    The content has no black pixel, so the border is the only black area.
+
+    Args:
+        size: (width, height) of the image.
+        border_width: width of each black border, as a fraction of the image width (left and right borders) and
+        height (top and bottom borders).
+        mode: PIL mode of the image, e.g. "RGB" or "L".
+        seed: seed of the noise.
+
+    Returns: The PIL image.
+
+    """
+    width, height = size
+    rows = np.linspace(40, 215, height, dtype=np.float32)[:, None]
+    columns = np.linspace(215, 40, width, dtype=np.float32)[None, :]
+    noise = np.random.default_rng(seed).integers(0, 30, (height, width), dtype=np.uint8)
+    image_array = np.empty((height, width, 3), dtype=np.uint8)
+    image_array[:, :, 0] = rows + noise
+    image_array[:, :, 1] = columns + noise
+    image_array[:, :, 2] = (rows + columns) / 2
+    border_x, border_y = int(width * border_width), int(height * border_width)
+    image_array[:border_y] = 0
+    image_array[height - border_y:] = 0
+    image_array[:, :border_x] = 0
+    image_array[:, width - border_x:] = 0
+    return Image.fromarray(image_array).convert(mode)
+
+def generate_synthetic_images(folder, case, mode):
+    """
+    Save one synthetic image for each border width of BORDER_WIDTHS.
+
+    Args:
+        folder: folder where the images are saved.
+        case: name of IMAGE_CASES.
+        mode: PIL mode of the images.
+
+    Returns: The list of fullpaths of the images.
+
+    """
+    case_options = IMAGE_CASES[case]
+    fullpaths = []
+    for index, border_width in enumerate(BORDER_WIDTHS):
+        image = create_synthetic_image(size=case_options["size"], border_width=border_width, mode=mode, seed=index)
+        fullpath = os.path.join(folder, case + "_" + mode + "_" + str(index) + case_options["extension"])
+        image.save(fullpath, case_options["format"])
+        fullpaths.append(fullpath)
+    return fullpaths
+
+def get_peak_rss_kb():
+    """
+    Returns: The peak resident memory of the current process in KB, or None if it can not be measured.
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives KB and macOS bytes
+    return peak_rss // 1024 if sys.platform == "darwin" else peak_rss
+
+def benchmark_get_image_array(fullpaths):
+    start = time.perf_counter()
+    for fullpath in fullpaths:
+        ImageModifications.get_image_array(fullpath=fullpath)
+    return time.perf_counter() - start
+
+def benchmark_get_pixel_not_black_from_array(fullpaths):
+    image_arrays = [np.array(Image.open(fullpath).convert("RGB")) for fullpath in fullpaths]
+    start = time.perf_counter()
+    for image_array in image_arrays:
+        # The same four searches crop_image_from_image_array_by_black_pixels() does with the "scanline" engine
+        h, w, _ = image_array.shape
+        for line in (image_array[h // 2], image_array[:, w // 2]):
+            ImageModifications.get_pixel_not_black_from_array(line)
+            ImageModifications.get_pixel_not_black_from_array(line[::-1])
+    return time.perf_counter() - start
+
+def benchmark_crop_image_from_image_array_by_black_pixels(fullpaths):
+    images = [ImageModifications.get_image_array(fullpath=fullpath) for fullpath in fullpaths]
+    start = time.perf_counter()
+    for img, image_array in images:
+        ImageModifications.crop_image_from_image_array_by_black_pixels(image_array=image_array, image=img)
+    return time.perf_counter() - start
+
+def benchmark_change_image_resolution_from_PIL_image(fullpaths):
+    images = [Image.open(fullpath) for fullpath in fullpaths]
+    for img in images:
+        img.load()
+    start = time.perf_counter()
+    for img in images:
+        ImageModifications.change_image_resolution_from_PIL_image(img=img, resize_dimensions=RESIZE_DIMENSIONS)
+    return time.perf_counter() - start
+
+def benchmark_remove_black_pixels_of_image_path_v3(fullpaths):
+    with tempfile.TemporaryDirectory() as folder:
+        for fullpath in fullpaths:
+            shutil.copy(fullpath, folder)
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            failures = ImageModifications.remove_black_pixels_of_image_path_v3(path=folder,
+                                                                               resize_dimensions=RESIZE_DIMENSIONS,
+                                                                               force_dimensions=True,
+                                                                               resume=False)
+        seconds = time.perf_counter() - start
+    if failures:
+        raise RuntimeError(str(failures))
+    return seconds
+
+def benchmark_output_sink(fullpaths, output_sink, copies=SINK_BENCHMARK_COPIES):
+    """
+    Write each image copies times through output_sink, as remove_black_pixels_of_image_path_v3() does, and flush the
+    page cache writes with os.sync() if available so the files are really written.
+    """
+    images = [Image.open(fullpath).convert("RGB") for fullpath in fullpaths]
+    start = time.perf_counter()
+    for copy in range(copies):
+        for index, image in enumerate(images):
+            file = os.path.join(str(copy), str(index) + ".jpg")
+            output = output_sink.prepare(file)
+            _, payload = output_sink.write(output, image)
+            output_sink.record(file, output, payload)
+    output_sink.close()
+    if hasattr(os, "sync"):
+        os.sync()
+    return time.perf_counter() - start
+
+def benchmark_directory_sink(fullpaths):
+    with tempfile.TemporaryDirectory() as folder:
+        return benchmark_output_sink(fullpaths, DirectorySink(folder=folder + os.sep))
+
+def benchmark_tar_shard_sink(fullpaths):
+    with tempfile.TemporaryDirectory() as folder:
+        return benchmark_output_sink(fullpaths, TarShardSink(folder=folder, max_shard_bytes=256 * 1024 ** 2))
+
+def get_psnr(images, references):
+    """
+    Returns: The peak signal to noise ratio in dB of the images compared with the references, PIL images with the
+    same sizes and modes, from the mean squared error of all their pixels. Infinite if they are equal.
+    """
+    squared_errors = [(np.asarray(image, dtype=np.float64) - np.asarray(reference, dtype=np.float64)) ** 2
+                      for image, reference in zip(images, references)]
+    mse = np.sum([errors.sum() for errors in squared_errors]) / np.sum([errors.size for errors in squared_errors])
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+def get_cropped_images(fullpaths, resampling):
+    # With a detection tolerance the crop box is known before decoding, so the draft presets can decode JPEG files
+    # at a reduced scale
+    return [ImageModifications.get_cropped_image_from_file(
+        fullpath=fullpath, resize_dimensions=RESIZE_DIMENSIONS, force_dimensions=True,
+        detection_tolerance=ImageModifications.DEFAULT_DETECTION_TOLERANCE, resampling=resampling)[1]
+            for fullpath in fullpaths]
+
+def benchmark_resampling(fullpaths, resampling):
+    # Decoding is timed too, since the fast presets decode JPEG files at a reduced scale
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        get_cropped_images(fullpaths, resampling=resampling)
+    return time.perf_counter() - start
+
+def get_resampling_psnr(fullpaths, resampling):
+    """
+    Returns: The PSNR of the images cropped and resized with the resampling preset, compared with the default
+    preset.
+    """
+    with redirect_stdout(io.StringIO()):
+        images = get_cropped_images(fullpaths, resampling=resampling)
+        references = get_cropped_images(fullpaths, resampling=ImageModifications.DEFAULT_RESAMPLING)
+    return get_psnr(images, references)
+
+# Each benchmark receives the fullpaths of the images and returns the seconds spent in the code measured
+BENCHMARKS = {
+    "get_image_array": benchmark_get_image_array,
+    "get_pixel_not_black_from_array": benchmark_get_pixel_not_black_from_array,
+    "crop_image_from_image_array_by_black_pixels": benchmark_crop_image_from_image_array_by_black_pixels,
+    "change_image_resolution_from_PIL_image": benchmark_change_image_resolution_from_PIL_image,
+    "remove_black_pixels_of_image_path_v3": benchmark_remove_black_pixels_of_image_path_v3,
+    "directory_sink": benchmark_directory_sink,
+    "tar_shard_sink": benchmark_tar_shard_sink,
+}
+BENCHMARKS.update({"resampling_" + resampling: partial(benchmark_resampling, resampling=resampling)
+                   for resampling in ImageModifications.RESAMPLING_PRESETS})
+# Benchmarks that write each image SINK_BENCHMARK_COPIES times
+SINK_BENCHMARKS = ("directory_sink", "tar_shard_sink")
+# Benchmarks whose output quality is measured too. Each function receives the fullpaths and returns the PSNR.
+QUALITY_CHECKS = {"resampling_" + resampling: partial(get_resampling_psnr, resampling=resampling)
+                  for resampling in ImageModifications.RESAMPLING_PRESETS}
+
+def run_benchmark(benchmark, fullpaths, repeat=1):
+    """
+    Run a benchmark of BENCHMARKS. It is called in a new process for each benchmark.
+
+    Args:
+        benchmark: name of BENCHMARKS.
+        fullpaths: fullpaths of the images.
+        repeat: Number of times the benchmark is run. The fastest time is kept.
+
+    Returns: A dict with the results.
+
+    """
+    images = len(fullpaths) * (SINK_BENCHMARK_COPIES if benchmark in SINK_BENCHMARKS else 1)
+    result = dict(benchmark=benchmark, images=images)
+    try:
+        seconds = min(BENCHMARKS[benchmark](fullpaths) for _ in range(repeat))
+    except Exception as e:
+        result["error"] = type(e).__name__ + ": " + str(e)
+    # Read before the quality check, which decodes and keeps the reference images too
+    result["peak_rss_kb"] = get_peak_rss_kb()
+    if "error" not in result:
+        result["seconds"] = seconds
+        result["images_per_second"] = images / seconds if seconds else None
+        if benchmark in QUALITY_CHECKS:
+            result["psnr"] = QUALITY_CHECKS[benchmark](fullpaths)
+    return result
+
+def run_benchmarks(cases=tuple(IMAGE_CASES), modes=COLOR_MODES, benchmarks=tuple(BENCHMARKS), repeat=1):
+    """
+    Generate the synthetic images and run every benchmark for every case and color mode.
+
+    Args:
+        cases: names of IMAGE_CASES.
+        modes: PIL modes of the images.
+        benchmarks: names of BENCHMARKS.
+        repeat: Number of times each benchmark is run. The fastest time is kept.
+
+    Returns: A dict with the run "metadata" and the list of "results".
+
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for case in cases:
+            for mode in modes:
+                fullpaths = generate_synthetic_images(folder=folder, case=case, mode=mode)
+                for benchmark in benchmarks:
+                    print("Running", benchmark, case, mode)
+                    with multiprocessing.Pool(processes=1) as pool:
+                        result = pool.apply(run_benchmark, (benchmark, fullpaths, repeat))
+                    result.update(case=case, size=IMAGE_CASES[case]["size"], format=IMAGE_CASES[case]["format"],
+                                  mode=mode)
+                    results.append(result)
+    metadata = dict(date=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                    numpy=np.__version__, pillow=pillow_version, platform=platform.platform(),
+                    cpu_count=os.cpu_count(), repeat=repeat)
+    return dict(metadata=metadata, results=results)
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-o", "--output", default="benchmark_results.json",
+                    help="Path of the JSON file with the results")
+    ap.add_argument("-q", "--quick", action="store_true",
+                    help="Only run the small image cases")
+    ap.add_argument("-b", "--benchmarks", nargs="+", choices=tuple(BENCHMARKS), default=tuple(BENCHMARKS),
+                    help="Benchmarks to run")
+    ap.add_argument("-r", "--repeat", type=int, default=1,
+                    help="Number of times each benchmark is run. The fastest time is kept")
+
+    args = vars(ap.parse_args())
+    cases_ = QUICK_IMAGE_CASES if args["quick"] else tuple(IMAGE_CASES)
+
+    benchmark_results = run_benchmarks(cases=cases_, benchmarks=args["benchmarks"], repeat=args["repeat"])
+    with open(args["output"], "w") as output_file:
+        json.dump(benchmark_results, output_file, indent=2)
+
+    for result_ in benchmark_results["results"]:
+        print(result_["benchmark"], result_["case"], result_["mode"],
+              result_.get("images_per_second", result_.get("error")), "images/sec", result_["peak_rss_kb"], "KB",
+              *(("PSNR", result_["psnr"], "dB") if "psnr" in result_ else ()))
+    print("Results written to", args["output"])
@@ -4,6 +4,19 @@ import os
 import errno
 import shutil
 import ntpath
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Errors of os.copy_file_range() meaning the kernel or the filesystems can not do it, so a normal copy is done instead
+COPY_FILE_RANGE_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                                      errno.EBADF}
+DEFAULT_COPY_THREADS = 8
+# Ways to decide that a destination file is already up to date. See is_unchanged().
+UNCHANGED_CHECKS = ("size_mtime", "hash")
+# What sync_file() does with each file
+COPY_ACTIONS = ("copied", "linked", "skipped")
+HASH_CHUNK_SIZE = 1 << 20
 
 def path_split(path):
     """
@@ -18,7 +31,7 @@ def path_split(path):
     head, tail = ntpath.split(path)
     return tail or ntpath.basename(head)
 
-def create_path_for_filepath(path, filepath):
+def create_path_for_filepath(path, filepath, skip_unchanged=None, hardlink=False, dry_run=False):
     """
     From a path, create all necessaries folders and copy a file from filepath to the path destination.
     Return True if the process was executed successfully or False otherwise.
@@ -26,10 +39,25 @@ def create_path_for_filepath(path, filepath):
     Args:
         path: A path to be created.
         filepath: A filepath that will be copied to the "path" destination.
+        skip_unchanged: See sync_file().
+        hardlink: See sync_file().
+        dry_run: True to only print what would be done with the file (copied, linked, skipped or missing), like
+        print_copy_report(), without creating the folders nor copying it.
 
-    Returns: True if the process is successful and False otherwise.
+    Returns: True if the process is successful (or would be, with dry_run) and False otherwise.
 
     """
+    if dry_run:
+        destination = path + os.sep + path_split(filepath)
+        try:
+            action, _ = sync_file(source=filepath, destination=destination, skip_unchanged=skip_unchanged,
+                                  hardlink=hardlink, dry_run=True)
+        except FileNotFoundError:
+            print("missing: " + filepath + " -> " + destination)
+            return False
+        print(action + ": " + filepath + " -> " + destination)
+        return True
+
     if float(python_version()[:2]) < 3.:
         if not os.path.exists(path):
             try:
@@ -40,7 +68,11 @@ def create_path_for_filepath(path, filepath):
     else:
         pathlib.Path(path).mkdir(parents=True, exist_ok=True)
 
-    shutil.copy2(filepath, path)
+    if skip_unchanged or hardlink:
+        sync_file(source=filepath, destination=path + os.sep + path_split(filepath), skip_unchanged=skip_unchanged,
+                  hardlink=hardlink)
+    else:
+        shutil.copy2(filepath, path)
 
     file = pathlib.Path(path + os.sep + path_split(filepath))
     try:
@@ -50,5 +82,225 @@ def create_path_for_filepath(path, filepath):
     else:
         return True
 
+def _copy_file_range(source, destination):
+    """
+    Copy the content of source to destination with os.copy_file_range(), without passing the data through user space.
+    Some filesystems (Btrfs, XFS, NFS 4.2...) even share the blocks or copy them in the server.
+
+    Returns: The number of bytes copied.
+    """
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        size = os.fstat(source_file.fileno()).st_size
+        copied = 0
+        while True:
+            # Big requests are split by the kernel, so it is called until the end of the file
+            count = os.copy_file_range(source_file.fileno(), destination_file.fileno(), max(size - copied, 1 << 20))
+            if count == 0:
+                break
+            copied += count
+    return copied
+
+def copy_file_fast(source, destination):
+    """
+    Copy the content and metadata of a file, like shutil.copy2(), using the fastest way the system has:
+    os.copy_file_range() where available (Linux), or shutil.copyfile(), which uses sendfile() in Linux and fcopyfile()
+    in macOS.
+
+    Args:
+        source: filepath of the file to copy.
+        destination: filepath of the copy. Its folder has to exist.
+
+    Returns: The number of bytes copied.
+
+    """
+    copied = None
+    if hasattr(os, "copy_file_range"):
+        try:
+            copied = _copy_file_range(source, destination)
+        except OSError as error:
+            if error.errno not in COPY_FILE_RANGE_UNSUPPORTED_ERRORS:
+                raise
+    if copied is None:
+        shutil.copyfile(source, destination)
+        copied = os.path.getsize(destination)
+    shutil.copystat(source, destination)
+    return copied
+
+def get_file_hash(filepath):
+    """
+    Returns: The SHA-256 hex digest of the content of a file, read in chunks.
+    """
+    file_hash = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def is_unchanged(source, destination, source_stat, destination_stat, check="size_mtime"):
+    """
+    Decide if a destination file is already an up to date copy of source.
+
+    Args:
+        source: filepath of the source file.
+        destination: filepath of the destination file.
+        source_stat: os.stat() of source.
+        destination_stat: os.stat() of destination.
+        check: One of UNCHANGED_CHECKS:
+                - "size_mtime": same size and same modification time, to the second like rsync, since some
+                filesystems do not keep more precision. Nothing is read.
+                - "hash": same size and same SHA-256 of the content. Both files are read, but it works when the
+                modification times are not kept.
+
+    Returns: True if destination does not need to be copied again.
+
+    """
+    if check not in UNCHANGED_CHECKS:
+        raise ValueError("'check' has to be one of " + str(UNCHANGED_CHECKS) + ".")
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+    if check == "size_mtime":
+        return int(source_stat.st_mtime) == int(destination_stat.st_mtime)
+    return get_file_hash(source) == get_file_hash(destination)
+
+def _get_device(path):
+    """
+    Returns: The device of path, or of its first existing parent folder if it does not exist yet.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+def sync_file(source, destination, skip_unchanged=None, hardlink=False, dry_run=False):
+    """
+    Make destination a copy of source, doing as little I/O as possible. The folder of destination has to exist,
+    unless dry_run is True.
+
+    Args:
+        source: filepath of the file to copy.
+        destination: filepath of the copy.
+        skip_unchanged: (Optional) One of UNCHANGED_CHECKS to skip the copy if destination is already up to date. See
+        is_unchanged(). A destination that is the same file as source (e.g. a hard link) is always skipped.
+        hardlink: True to create a hard link to source instead of copying it when both are in the same filesystem.
+        Then source and destination share their content, so a change in one of them changes the other one too.
+        dry_run: True to only return what would be done, without changing anything.
+
+    Returns: action, bytes. action is one of COPY_ACTIONS and bytes the number of bytes copied, or that would be copied
+    if dry_run.
+
+    """
+    source_stat = os.stat(source)
+    try:
+        destination_stat = os.stat(destination)
+    except FileNotFoundError:
+        destination_stat = None
+    if destination_stat is not None:
+        if os.path.samestat(source_stat, destination_stat):
+            return "skipped", 0
+        if skip_unchanged and is_unchanged(source=source, destination=destination, source_stat=source_stat,
+                                           destination_stat=destination_stat, check=skip_unchanged):
+            return "skipped", 0
+    if hardlink and _get_device(os.path.dirname(destination)) == source_stat.st_dev:
+        if dry_run:
+            return "linked", 0
+        # The link is created with a temporary name and renamed, so an existing destination is replaced atomically
+        temporary_destination = destination + ".link-tmp"
+        try:
+            os.link(source, temporary_destination)
+        except OSError:
+            pass  # E.g. the filesystem does not support hard links: it is copied
+        else:
+            os.replace(temporary_destination, destination)
+            return "linked", 0
+    if dry_run:
+        return "copied", source_stat.st_size
+    return "copied", copy_file_fast(source, destination)
 
+def _copy_pair(source, destination, sync_kwargs):
+    """
+    Copy one pair of copy_files() with sync_file(), catching any error.
+
+    Returns: A result dict of copy_files().
+    """
+    try:
+        action, copied = sync_file(source=source, destination=destination, **sync_kwargs)
+    except Exception as error:
+        return dict(source=source, destination=destination, action=None, bytes=0,
+                    error=type(error).__name__ + ": " + str(error))
+    return dict(source=source, destination=destination, action=action, bytes=copied, error=None)
 
+def copy_files(pairs, threads=DEFAULT_COPY_THREADS, max_queued=None, skip_unchanged=None, hardlink=False,
+               dry_run=False):
+    """
+    Copy many files concurrently. Unlike calling create_path_for_filepath() for each file, each destination folder is
+    created only once, the copies are done by a pool of threads (the copies release the GIL, so the disk or network
+    storage gets several requests at the same time) and each copy uses copy_file_fast().
+
+    Args:
+        pairs: iterable of tuples (source, destination) with the filepath to copy and the filepath of its copy. It is
+        consumed as the copies are done, so it can be a generator of millions of files.
+        threads: Number of copies done at the same time.
+        max_queued: Maximum number of copies waiting in the pool. By default, 4 times threads.
+        skip_unchanged: See sync_file(). Incremental syncs of destinations mostly up to date only stat the files.
+        hardlink: See sync_file().
+        dry_run: True to get the results of what would be done, without creating folders nor copying. See
+        print_copy_report().
+
+    Returns: results, a list with a dict for each pair, in the same order, with its "source", "destination", "action"
+    (one of COPY_ACTIONS), "bytes" copied and "error" (None if the copy was successful, or the error message).
+
+    """
+    if skip_unchanged is not None and skip_unchanged not in UNCHANGED_CHECKS:
+        raise ValueError("'skip_unchanged' has to be one of " + str(UNCHANGED_CHECKS) + ".")
+    sync_kwargs = dict(skip_unchanged=skip_unchanged, hardlink=hardlink, dry_run=dry_run)
+    if threads < 1:
+        raise ValueError("'threads' has to be > 0.")
+    max_queued = max_queued or 4 * threads
+    created_folders = set()
+    results = []
+    copies = deque()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="copy") as executor:
+        for source, destination in pairs:
+            folder = os.path.dirname(destination)
+            if folder not in created_folders and not dry_run:
+                try:
+                    pathlib.Path(folder or os.curdir).mkdir(parents=True, exist_ok=True)
+                except OSError as error:
+                    copies.append(dict(source=source, destination=destination, action=None, bytes=0,
+                                       error=type(error).__name__ + ": " + str(error)))
+                    continue
+                created_folders.add(folder)
+            copies.append(executor.submit(_copy_pair, source, destination, sync_kwargs))
+            while len(copies) > max_queued:
+                copy = copies.popleft()
+                results.append(copy if isinstance(copy, dict) else copy.result())
+        while copies:
+            copy = copies.popleft()
+            results.append(copy if isinstance(copy, dict) else copy.result())
+    return results
+
+def print_copy_report(results, dry_run=False, verbose=False):
+    """
+    Print how many files were copied, linked, skipped and failed, and the bytes copied.
+
+    Args:
+        results: The results returned by copy_files().
+        dry_run: True if the results are from a dry run, to print what would be done.
+        verbose: True to print the action of each file too.
+
+    Returns: summary, a dict with the number of files of each action of COPY_ACTIONS, of "failed" files and the
+    "bytes" copied.
+
+    """
+    summary = dict.fromkeys(COPY_ACTIONS + ("failed",), 0)
+    summary["bytes"] = 0
+    for result in results:
+        summary[result["action"] or "failed"] += 1
+        summary["bytes"] += result["bytes"]
+        if verbose or result["error"] is not None:
+            print((result["action"] or "failed") + ": " + result["source"] + " -> " + result["destination"] +
+                  ("" if result["error"] is None else " (" + result["error"] + ")"))
+    print(("Dry run, nothing was changed. " if dry_run else "") +
+          ", ".join(str(summary[action]) + " " + action for action in COPY_ACTIONS + ("failed",)) + ". " +
+          str(summary["bytes"]) + " bytes " + ("would be copied." if dry_run else "copied."))
+    return summary
@@ -0,0 +1,159 @@
+import os
+import csv
+
+
+class CropBoxIndex:
+    """
+    A CSV index with the crop box and the metadata of each source image of a folder, keyed by its path, size and
+    modification time. It is written by ImageModifications.analyze_black_pixels_of_image_path() and read by
+    ImageModifications.remove_black_pixels_of_image_path_v3() to crop, resize and write the images again (e.g. with
+    other resize settings or output mode) without searching their black border again.
+
+    Like Manifest.ProcessingManifest, each analyzed file appends one row, so an analysis that dies halfway keeps
+    everything analyzed until then. If a file appears more than once, its last row is the valid one.
+    """
+    FILE_NAME = "crop_boxes.csv"
+    FIELDS = ("file", "size", "mtime_ns", "width", "height", "mode", "format", "left", "top", "right", "bottom")
+
+    def __init__(self, fullpath, reset=False):
+        """
+        Load the index, if it exists.
+
+        Args:
+            fullpath: fullpath of the CSV file.
+            reset: True to drop the entries of the existing index.
+        """
+        self.fullpath = fullpath
+        self.__entries = {}
+        self.__file = None
+        self.__writer = None
+        rows = 0
+        if reset and os.path.exists(fullpath):
+            os.remove(fullpath)
+        if os.path.exists(fullpath):
+            rows = self.__load()
+        self.__compact_on_close = rows > len(self.__entries)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, file):
+        return file in self.__entries
+
+    def __iter__(self):
+        return iter(sorted(self.__entries))
+
+    def __load(self):
+        """
+        Read the entries of the index, ignoring a last row cut by a crash.
+
+        Returns: The number of rows read.
+
+        """
+        rows = 0
+        with open(self.fullpath, newline="", encoding="utf-8") as index_file:
+            for row in csv.DictReader(index_file):
+                rows += 1
+                try:
+                    entry = dict(row, size=int(row["size"]), mtime_ns=int(row["mtime_ns"]), width=int(row["width"]),
+                                 height=int(row["height"]))
+                    entry["area"] = tuple(int(row[side]) for side in ("left", "top", "right", "bottom")) \
+                        if row["left"] else None
+                except (TypeError, ValueError):
+                    continue
+                self.__entries[row["file"]] = entry
+        return rows
+
+    def get(self, file):
+        """
+        Returns: The entry of file, a dict with the FIELDS and its "area" (None if no border was found), or None if
+        the file is not in the index.
+        """
+        return self.__entries.get(file)
+
+    def is_up_to_date(self, file, fullpath):
+        """
+        Check if the entry of a file was made from its current content.
+
+        Args:
+            file: The source file path relative to the images path. It is the key of the index.
+            fullpath: The fullpath of the source file.
+
+        Returns: True if the file is in the index and its size and mtime did not change.
+
+        """
+        entry = self.__entries.get(file)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(fullpath)
+        except OSError:
+            return False
+        return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+    def add(self, file, size, mtime_ns, width, height, mode, image_format, area):
+        """
+        Append the entry of an analyzed file.
+
+        Args:
+            file: The source file path relative to the images path.
+            size: Size in bytes of the source file when it was analyzed.
+            mtime_ns: Modification time of the source file when it was analyzed.
+            width: Width of the full resolution image.
+            height: Height of the full resolution image.
+            mode: PIL mode of the image.
+            image_format: PIL format of the image.
+            area: The crop box (left, top, right, bottom) in full resolution coordinates, or None.
+        """
+        if self.__writer is None:
+            write_header = not os.path.exists(self.fullpath) or os.path.getsize(self.fullpath) == 0
+            cut_row = False
+            if not write_header:
+                with open(self.fullpath, "rb") as index_file:
+                    index_file.seek(-1, os.SEEK_END)
+                    cut_row = index_file.read(1) not in (b"\n", b"\r")
+            self.__file = open(self.fullpath, "a", newline="", encoding="utf-8")
+            self.__writer = csv.writer(self.__file)
+            if write_header:
+                self.__writer.writerow(self.FIELDS)
+            elif cut_row:
+                # The row cut by a crash is ended, so the new rows are not appended to it
+                self.__file.write("\r\n")
+        if file in self.__entries:
+            self.__compact_on_close = True
+        entry = dict(file=file, size=size, mtime_ns=mtime_ns, width=width, height=height, mode=mode,
+                     format=image_format, area=tuple(area) if area is not None else None)
+        self.__entries[file] = entry
+        self.__writer.writerow(self.__get_row(entry))
+        self.__file.flush()
+
+    @staticmethod
+    def __get_row(entry):
+        area = entry["area"] if entry["area"] is not None else ("", "", "", "")
+        return (entry["file"], entry["size"], entry["mtime_ns"], entry["width"], entry["height"], entry["mode"],
+                entry["format"]) + tuple(area)
+
+    def close(self):
+        """
+        Close the index, rewriting it sorted by file with only the valid row of each file if some file was added more
+        than once.
+        """
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            self.__writer = None
+        if self.__compact_on_close:
+            temporal_fullpath = self.fullpath + ".tmp"
+            with open(temporal_fullpath, "w", newline="", encoding="utf-8") as index_file:
+                writer = csv.writer(index_file)
+                writer.writerow(self.FIELDS)
+                for file in self:
+                    writer.writerow(self.__get_row(self.__entries[file]))
+            os.replace(temporal_fullpath, self.fullpath)
+            self.__compact_on_close = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,236 @@
+import os
+import time
+import fnmatch
+import hashlib
+
+
+def has_extension(name, extensions):
+    """
+    Check, ignoring the case, if a file name ends with one of the given extensions.
+
+    Args:
+        name: file name or path
+        extensions: iterable of suffixes, e.g. (".jpg", ".png"). If None, every name is accepted.
+
+    Returns: True if name ends with one of the extensions.
+
+    """
+    if extensions is None:
+        return True
+    return name.lower().endswith(tuple(extension.lower() for extension in extensions))
+
+def match_patterns(name, patterns):
+    """
+    Check, ignoring the case, if a file name matches one of the given glob patterns.
+
+    Args:
+        name: file name
+        patterns: iterable of glob patterns, e.g. ("frame_*", "*_left.*"). If None, every name is accepted.
+
+    Returns: True if name matches one of the patterns.
+
+    """
+    if patterns is None:
+        return True
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, pattern.lower()) for pattern in patterns)
+
+def get_shard_index(relative_path, shard_count):
+    """
+    Assign a file to one of shard_count shards by a hash of its relative path, so several processes or machines can
+    each process a disjoint part of a folder without coordinating. The hash does not depend on the process, the
+    machine or the OS path separator.
+
+    Args:
+        relative_path: path of the file relative to the scanned directory.
+        shard_count: Number of shards.
+
+    Returns: The shard index of the file, from 0 to shard_count - 1.
+
+    """
+    digest = hashlib.md5(relative_path.replace(os.sep, "/").encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+def get_shard_name(shard_index, shard_count):
+    """
+    Returns: The name that tells apart the outputs of a shard, e.g. "part-00002-of-00008".
+    """
+    return "part-{0:05d}-of-{1:05d}".format(shard_index, shard_count)
+
+def check_shard(shard_index, shard_count):
+    """
+    Raise a ValueError if shard_index is not None and is not a valid shard of shard_count shards.
+    """
+    if shard_count < 1:
+        raise ValueError("'shard_count' has to be > 0.")
+    if shard_index is not None and not 0 <= shard_index < shard_count:
+        raise ValueError("'shard_index' has to be >= 0 and < 'shard_count'.")
+
+def scan_files(path, extensions=None, patterns=None, recursive=False, exclude_paths=(), shard_index=None,
+               shard_count=1):
+    """
+    Generator over the files of a directory built on os.scandir(). Entries are yielded as soon as they are read, so
+    the memory used does not depend on the number of files in the directory. Like os.walk(), symbolic links to
+    directories are not followed and subdirectories that can not be read are skipped.
+
+    Args:
+        path: directory to scan
+        extensions: (Optional) suffixes accepted, ignoring the case. See has_extension().
+        patterns: (Optional) glob patterns accepted, ignoring the case. See match_patterns().
+        recursive: True to descend into subdirectories.
+        exclude_paths: directories that are never scanned, e.g. an output directory nested inside path.
+        shard_index: (Optional) Only yield the files of this shard. See get_shard_index().
+        shard_count: Number of shards the files are split into when shard_index is given.
+
+    Returns: Yield relative_path, the path of each file relative to path, using os.sep.
+
+    """
+    check_shard(shard_index, shard_count)
+    exclude_paths = {os.path.abspath(exclude_path) for exclude_path in exclude_paths}
+    # Stack of relative directories still to be scanned
+    pending_directories = [""]
+    while pending_directories:
+        relative_directory = pending_directories.pop()
+        try:
+            with os.scandir(os.path.join(path, relative_directory)) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_directory, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and os.path.abspath(entry.path) not in exclude_paths:
+                            pending_directories.append(relative_path)
+                    elif entry.is_file() and has_extension(entry.name, extensions) \
+                            and match_patterns(entry.name, patterns) \
+                            and (shard_index is None or get_shard_index(relative_path, shard_count) == shard_index):
+                        yield relative_path
+        except OSError:
+            # Only the errors of subdirectories are skipped, a path that can not be read is still an error
+            if not relative_directory:
+                raise
+
+def count_files(path, extensions=None, patterns=None, recursive=False, exclude_paths=(), shard_index=None,
+                shard_count=1):
+    """
+    Count the files scan_files() would yield with the same arguments, without keeping them in memory.
+
+    Returns: The number of files.
+
+    """
+    return sum(1 for _ in scan_files(path=path, extensions=extensions, patterns=patterns, recursive=recursive,
+                                     exclude_paths=exclude_paths, shard_index=shard_index,
+                                     shard_count=shard_count))
+
+class FolderWatcher:
+    """
+    Find the files added to a directory since the last call to poll(), for a long running process that keeps
+    processing a folder that receives new files.
+
+    Only the directories whose modification time changed are listed again, so a poll does not rescan the whole
+    tree. A new file is only returned once its size and modification time have not changed for settle_time seconds,
+    so files still being written or copied are not returned until they are complete. Each file is returned once.
+    """
+    # Directories modified less than this number of seconds before being listed are listed again in the next poll,
+    # because a file added in the same tick of the file system clock would not change their modification time
+    MTIME_GRANULARITY = 2.0
+
+    def __init__(self, path, extensions=None, patterns=None, recursive=False, exclude_paths=(), settle_time=5.0):
+        """
+        Args:
+            path: directory to watch
+            extensions: See scan_files().
+            patterns: See scan_files().
+            recursive: True to watch the subdirectories too, including the new ones. Like scan_files(), symbolic
+            links to directories are not followed.
+            exclude_paths: See scan_files().
+            settle_time: Seconds the size and the modification time of a new file have to stay the same before it is
+            returned.
+        """
+        self.path = path
+        self.extensions = extensions
+        self.patterns = patterns
+        self.recursive = recursive
+        self.exclude_paths = {os.path.abspath(exclude_path) for exclude_path in exclude_paths}
+        self.settle_time = settle_time
+        # For each relative directory: (modification time when it was listed, time it was listed)
+        self.__directories = {}
+        self.__subdirectories = {}  # relative directory -> relative subdirectories
+        self.__known_files = {}  # relative directory -> names of the files already found in it
+        self.__pending = {}  # relative path -> (size, mtime_ns, time of the last change)
+
+    def __list_directory(self, relative_directory, now):
+        """
+        List a directory if it changed since the last poll, adding its new files to the pending files.
+        """
+        fullpath = os.path.join(self.path, relative_directory)
+        try:
+            mtime = os.stat(fullpath).st_mtime
+            listed = self.__directories.get(relative_directory)
+            if listed is not None and listed[0] == mtime and listed[1] - mtime > self.MTIME_GRANULARITY:
+                return
+            subdirectories = []
+            known_files = self.__known_files.setdefault(relative_directory, set())
+            with os.scandir(fullpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive and os.path.abspath(entry.path) not in self.exclude_paths:
+                            subdirectories.append(os.path.join(relative_directory, entry.name))
+                    elif entry.name not in known_files and entry.is_file() \
+                            and has_extension(entry.name, self.extensions) \
+                            and match_patterns(entry.name, self.patterns):
+                        known_files.add(entry.name)
+                        self.__pending[os.path.join(relative_directory, entry.name)] = (None, None, now)
+        except FileNotFoundError:
+            # Removed since its parent was listed
+            self.__forget_directory(relative_directory)
+            return
+        except OSError:
+            # E.g. not readable: it is listed again in the next poll, and its known subdirectories are still polled
+            self.__directories.pop(relative_directory, None)
+            return
+        self.__directories[relative_directory] = (mtime, now)
+        for removed_directory in set(self.__subdirectories.get(relative_directory, ())) - set(subdirectories):
+            self.__forget_directory(removed_directory)
+        self.__subdirectories[relative_directory] = subdirectories
+
+    def __forget_directory(self, relative_directory):
+        self.__directories.pop(relative_directory, None)
+        self.__known_files.pop(relative_directory, None)
+        for subdirectory in self.__subdirectories.pop(relative_directory, ()):
+            self.__forget_directory(subdirectory)
+
+    def poll(self):
+        """
+        Look for new files and check the pending ones.
+
+        Returns: The relative paths (using os.sep) of the new files that have settled, sorted.
+
+        """
+        now = time.time()
+        pending_directories = [""]
+        while pending_directories:
+            relative_directory = pending_directories.pop()
+            self.__list_directory(relative_directory, now)
+            pending_directories.extend(self.__subdirectories.get(relative_directory, ()))
+
+        settled_files = []
+        for relative_path, (size, mtime_ns, changed) in list(self.__pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.path, relative_path))
+            except OSError:
+                # Removed (or renamed) before it settled
+                del self.__pending[relative_path]
+                directory, name = os.path.split(relative_path)
+                self.__known_files.get(directory, set()).discard(name)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.__pending[relative_path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - changed >= self.settle_time:
+                del self.__pending[relative_path]
+                settled_files.append(relative_path)
+        return sorted(settled_files)
+
+    @property
+    def pending(self):
+        """
+        Number of new files that have not settled yet.
+        """
+        return len(self.__pending)
@@ -0,0 +1,131 @@
+import os
+import re
+import numpy as np
+
+# Ways to group the files that share the same crop box. See get_sequence_key().
+SEQUENCE_GROUPS = ("folder", "prefix")
+# Ways to join the boxes of the sample frames into one box. See estimate_sequence_crop_box().
+SEQUENCE_METHODS = ("median", "union")
+
+
+def get_sequence_key(file, group_by="folder"):
+    """
+    Get the name of the sequence a file belongs to.
+
+    Args:
+        file: file path relative to the images path, e.g. "video1/frame_000123.jpg"
+        group_by: "folder" if all the files of a folder are one sequence, or "prefix" if the sequences are the files
+        of a folder whose names only differ in the frame number, e.g. "video1/cam_a_000123.jpg" -> "video1/cam_a".
+
+    Returns: The sequence key.
+
+    """
+    if group_by not in SEQUENCE_GROUPS:
+        raise ValueError("'group_by' has to be one of " + str(SEQUENCE_GROUPS) + ".")
+    folder, name = os.path.split(file)
+    if group_by == "folder":
+        return folder
+    stem = os.path.splitext(name)[0]
+    # Remove only the last number and the separators before it, so e.g. "cam1_000123" and "cam2_000123" or
+    # "shot10_0001" and "shot11_0001" stay in different sequences
+    return os.path.join(folder, re.sub(r"[_\-. ]*\d+$", "", stem))
+
+def estimate_sequence_crop_box(areas, method="median"):
+    """
+    Join the crop boxes of some frames of a sequence into one box for the whole sequence.
+
+    Args:
+        areas: list of tuples (left, top, right, bottom). None values (frames without border found) are ignored.
+        method: "median" to take the median of each side, robust to a few wrong frames, or "union" to take the
+        smallest box that contains every box, so no frame loses content.
+
+    Returns: The sequence area or None if there is no valid area.
+
+    """
+    if method not in SEQUENCE_METHODS:
+        raise ValueError("'method' has to be one of " + str(SEQUENCE_METHODS) + ".")
+    areas = np.array([area for area in areas if area is not None])
+    if len(areas) == 0:
+        return None
+    if method == "median":
+        return tuple(int(side) for side in np.median(areas, axis=0))
+    return int(areas[:, 0].min()), int(areas[:, 1].min()), int(areas[:, 2].max()), int(areas[:, 3].max())
+
+class SequenceCropBoxCache:
+    """
+    Crop boxes shared by the frames of each sequence (see get_sequence_key()), so the black border is only searched in
+    a few frames of each sequence instead of in all of them.
+
+    For each sequence, the first sample_size frames are searched and their boxes are joined with
+    estimate_sequence_crop_box(). After that, the sequence box is given without any search, and every
+    revalidate_every frames one frame is searched again. If its box differs more than tolerance pixels from the
+    sequence box, the letterbox has changed and the sequence box is estimated again.
+    """
+
+    def __init__(self, detect_function, sample_size=5, revalidate_every=250, tolerance=2, method="median",
+                 group_by="folder"):
+        """
+        Args:
+            detect_function: function that receives the fullpath of an image and returns its crop box in full
+            resolution coordinates, or None.
+            sample_size: Number of frames searched to estimate the box of a sequence.
+            revalidate_every: Number of frames between two checks of the sequence box. 0 to never check it.
+            tolerance: Maximum difference in pixels of a side of a checked frame box with the sequence box.
+            method: One of SEQUENCE_METHODS. See estimate_sequence_crop_box().
+            group_by: One of SEQUENCE_GROUPS. See get_sequence_key().
+        """
+        if sample_size < 1:
+            raise ValueError("'sample_size' has to be > 0.")
+        self.detect_function = detect_function
+        self.sample_size = sample_size
+        self.revalidate_every = revalidate_every
+        self.tolerance = tolerance
+        self.method = method
+        self.group_by = group_by
+        # For each sequence key: a dict with the "area", the sample "areas" and the frames "since_validation"
+        self.__sequences = {}
+        self.detections = 0  # Number of times detect_function has been called
+
+    def __detect(self, fullpath):
+        self.detections += 1
+        return self.detect_function(fullpath)
+
+    def get_area(self, file, fullpath):
+        """
+        Get the crop box of a frame, searching it only if the sequence box is not known or has to be checked.
+
+        Args:
+            file: file path relative to the images path, used to find its sequence.
+            fullpath: fullpath of the file.
+
+        Returns: The crop box (left, top, right, bottom) or None.
+
+        """
+        key = get_sequence_key(file=file, group_by=self.group_by)
+        sequence = self.__sequences.setdefault(key, dict(area=None, areas=[], since_validation=0))
+
+        if len(sequence["areas"]) < self.sample_size:
+            # The sequence box is still being estimated: the frame uses its own box
+            area = self.__detect(fullpath)
+            sequence["areas"].append(area)
+            if len(sequence["areas"]) == self.sample_size:
+                sequence["area"] = estimate_sequence_crop_box(areas=sequence["areas"], method=self.method)
+            return area
+
+        sequence["since_validation"] += 1
+        if self.revalidate_every and sequence["since_validation"] >= self.revalidate_every:
+            sequence["since_validation"] = 0
+            area = self.__detect(fullpath)
+            if not self.__is_same_area(area, sequence["area"]):
+                # The letterbox changed: estimate the sequence box again starting with this frame
+                sequence["area"] = None
+                sequence["areas"] = [area]
+                if self.sample_size == 1:
+                    sequence["area"] = area
+                return area
+        return sequence["area"]
+
+    def __is_same_area(self, area, other_area):
+        if area is None or other_area is None:
+            return area is other_area
+        return all(abs(side - other_side) <= self.tolerance for side, other_side in zip(area, other_area))
@@ -1,8 +1,55 @@
+import io
 import os
+import csv
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 import numpy as np
 from PIL import Image, ImageOps
-from Prints import show_percent_by_total
+from Prints import ProgressReporter
+from Multiprocesing import WorkerPool
+from DirectoryScanner import scan_files, count_files, check_shard, get_shard_index, get_shard_name, FolderWatcher
+from Manifest import ProcessingManifest
+from FrameSequences import SequenceCropBoxCache
+from Metrics import FileMetrics, measure_stage
+from CropBoxIndex import CropBoxIndex
+from LargeImages import get_decoded_bytes, get_budget_scale, budget_image_pixels, open_image, read_png_header, \
+    read_png_palette, iter_png_strips
+from OutputSinks import OUTPUT_MODES, DEFAULT_SHARD_MAX_BYTES, SHARD_INDEX_NAME, DirectorySink, NpyMemmapSink, \
+    TarShardSink, get_image_format, get_savable_image
+
+# Ways to find the black border of an image. See get_crop_box_from_image_array().
+DETECTION_ENGINES = ("scanline", "vectorized", "bounding_box")
+DEFAULT_DETECTION_ENGINE = "vectorized"
+# Suffixes of the files processed by remove_black_pixels_of_image_path_v3()
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+# Reduction factors used to find the black border in a smaller image. JPEG draft mode supports 1/2, 1/4 and 1/8.
+DRAFT_SCALES = (1, 2, 4, 8)
+DEFAULT_DETECTION_TOLERANCE = 4
+# PIL modes whose numpy arrays are read without conversion by the black border detection: one value per pixel or
+# color channels with an optional alpha channel (see get_color_channels())
+DETECTION_MODES = ("1", "L", "LA", "I", "I;16", "F", "RGB", "RGBA")
+# Area of an image whose black border is already known not to exist: the border is not searched and it is not cropped
+NO_CROP_BOX = ()
+# Quality/speed presets of the resize. See change_image_resolution_from_PIL_image().
+# - filter: resampling filter, and aspect_ratio_filter the one used when the aspect ratio is kept.
+# - reducing_gap: if not None, the image is first reduced by an integer factor with Image.reduce() while it stays at
+# least reducing_gap times bigger than the new size, and the filter is applied to the reduced image.
+# - draft: True to decode JPEG files directly at a reduced scale, still bigger than the new size. See get_draft_size().
+RESAMPLING_PRESETS = {
+    # The filters used before the presets existed (LANCZOS was named ANTIALIAS)
+    "quality": dict(filter=Image.LANCZOS, aspect_ratio_filter=Image.BICUBIC, reducing_gap=None, draft=False),
+    "balanced": dict(filter=Image.LANCZOS, aspect_ratio_filter=Image.LANCZOS, reducing_gap=3.0, draft=False),
+    "fast": dict(filter=Image.BICUBIC, aspect_ratio_filter=Image.BICUBIC, reducing_gap=2.0, draft=True),
+    "fastest": dict(filter=Image.BILINEAR, aspect_ratio_filter=Image.BILINEAR, reducing_gap=1.0, draft=True),
+}
+DEFAULT_RESAMPLING = "quality"
+# Approximate maximum bytes of each strip of rows read at once by decode_large_image_file(). Each strip is copied a
+# few times while it is decoded, so it is also limited to a fraction of the memory budget.
+LARGE_IMAGE_STRIP_BYTES = 16 * 1024 ** 2
+LARGE_IMAGE_STRIP_BUDGET_FRACTION = 1 / 16
 
 def create_nested_directory_from_path_v1(path):
     """
@@ -18,7 +65,8 @@ def create_nested_directory_from_path_v1(path):
     Path(new_folder_name).mkdir(exist_ok=True)
     return new_folder_name
 
-def get_image_array(fullpath, resize_dimensions=None, keep_aspect_ratio=False):
+def get_image_array(fullpath, resize_dimensions=None, keep_aspect_ratio=False, metrics=None, as_array=True,
+                    resampling=DEFAULT_RESAMPLING):
     """
     Get image from fullpath.
     (Optional) Resize the image to the given resize dimensions.
@@ -30,43 +78,393 @@ def get_image_array(fullpath, resize_dimensions=None, keep_aspect_ratio=False):
         of the images.
         If none, then the image will be the same.
         keep_aspect_ratio: True if we want to keep aspect ratio of new images.
+        metrics: (Optional) Metrics.FileMetrics where the decode and resize timings and the image dimensions are
+        recorded.
+        as_array: True to convert the image to a numpy array. If False, the decoded image is the only buffer and None
+        is returned instead of the array.
+        resampling: One of RESAMPLING_PRESETS, used if the image is resized.
 
 
     Returns: Image.img , array image
 
     """
 
-    img = Image.open(fullpath) # Imgur's naming scheme
+    with measure_stage(metrics, "decode"):
+        img = Image.open(fullpath) # Imgur's naming scheme
+        img.load()
+    if metrics is not None:
+        metrics.width, metrics.height = img.size
 
     if resize_dimensions or keep_aspect_ratio:
-        img, image_array = change_image_resolution_from_PIL_image(img=img,
-                                                                  resize_dimensions=resize_dimensions,
-                                                                  keep_aspect_ratio=keep_aspect_ratio)
+        with measure_stage(metrics, "resize"):
+            img, image_array = change_image_resolution_from_PIL_image(img=img,
+                                                                      resize_dimensions=resize_dimensions,
+                                                                      keep_aspect_ratio=keep_aspect_ratio,
+                                                                      as_array=as_array,
+                                                                      resampling=resampling)
     else:
-        image_array = np.array(img)
+        with measure_stage(metrics, "decode"):
+            image_array = np.array(img) if as_array else None
 
     return img, image_array
 
+def get_color_channels(channels):
+    """
+    Get the number of color channels of the pixels of an image array: the alpha channel of LA and RGBA images (2 and
+    4 channels) is not a color channel, so a transparent pixel is black or not by its color.
+
+    Args:
+        channels: Number of channels of the image array. 1 for single channel images, e.g. "L" images.
+
+    Returns: The number of first channels that have to be different from 0 for a pixel not to be black.
+
+    """
+    return channels - 1 if channels in (2, 4) else channels
+
 def get_pixel_not_black_from_array(row_or_column_array):
     """
     Iterate over a row or column array until a non black pixel is found.
 
     Args:
-        row_or_column_array: row or column we want to iterate over until we found a not black pixel
+        row_or_column_array: row or column we want to iterate over until we found a not black pixel. Its pixels can
+        be values (single channel images) or have several channels (see get_color_channels()).
 
     Returns: index_to_return, the column or row where the non black pixel is found
 
     """
     index_to_return = None
+    if np.ndim(row_or_column_array) == 1:
+        for index, pixel in enumerate(row_or_column_array):
+            if pixel != 0:  # If not black
+                index_to_return = index
+                break
+        return index_to_return
+    color_channels = get_color_channels(np.shape(row_or_column_array)[1])
     for index, pixel in enumerate(row_or_column_array):
-        if pixel[0] != 0 and pixel[1] != 0 and pixel[2] != 0:  # If not black
+        if all(pixel[channel] != 0 for channel in range(color_channels)):  # If not black
             index_to_return = index
             break
     return index_to_return
 
-def crop_image_from_image_array_by_black_pixels(image_array, image):
+def get_pixel_not_black_from_array_vectorized(row_or_column_array):
+    """
+    Same as get_pixel_not_black_from_array() but with a boolean mask and an argmax reduction instead of a Python loop.
+    A pixel is considered not black with the same rule: all its color channels are different from 0.
+
+    Args:
+        row_or_column_array: row or column numpy array (or view) we want to search for a not black pixel
+
+    Returns: index_to_return, the column or row where the first non black pixel is found, None if all are black
+
+    """
+    row_or_column_array = np.asarray(row_or_column_array)
+    if row_or_column_array.ndim == 1:
+        row_or_column_array = row_or_column_array[:, np.newaxis]
+    not_black_mask = get_not_black_mask(row_or_column_array)
+    index_to_return = int(np.argmax(not_black_mask))
+    if not not_black_mask[index_to_return]:
+        # argmax returns 0 when there is no True value at all
+        return None
+    return index_to_return
+
+def get_crop_box_from_image_array(image_array, detection_engine=DEFAULT_DETECTION_ENGINE):
+    """
+    Find the area of the image that is not black border.
+
+    Engines:
+        - "scanline": iterate pixel by pixel with get_pixel_not_black_from_array() over the middle row and column.
+        - "vectorized": same middle row and column semantics as "scanline", but with numpy masks and reductions.
+        - "bounding_box": bounding box of every non black pixel of the full image.
+
+    Args:
+        image_array: Numpy array image with the format: (height, width, channels), or (height, width) for single
+        channel images, e.g. "L" images, which are not converted to RGB.
+        detection_engine: One of DETECTION_ENGINES.
+
+    Returns: area, a tuple (left, top, right, bottom) to be used with Image.crop(), or None if no non black pixel
+    is found.
+
+    """
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+
+    if image_array.ndim == 2:
+        image_array = image_array[:, :, np.newaxis]  # A view, to read single channel images as one channel images
+    h, w, _ = image_array.shape
+
+    if detection_engine != "bounding_box":
+        # the middle row and column, as views of the image array
+        return get_crop_box_from_middle_lines(middle_row=image_array[int(h / 2)],
+                                              middle_column=image_array[:, int(w / 2)],
+                                              detection_engine=detection_engine)
+
+    not_black_mask = get_not_black_mask(image_array)
+    rows_with_pixels = not_black_mask.any(axis=1)
+    columns_with_pixels = not_black_mask.any(axis=0)
+    if not rows_with_pixels.any():
+        return None
+    top_row_to_crop = int(np.argmax(rows_with_pixels))
+    bottom_row_to_crop = int(np.argmax(rows_with_pixels[::-1]))
+    left_column_to_crop = int(np.argmax(columns_with_pixels))
+    right_column_to_crop = int(np.argmax(columns_with_pixels[::-1]))
+
+    return left_column_to_crop, top_row_to_crop, w - right_column_to_crop, h - bottom_row_to_crop
+
+def get_crop_box_from_middle_lines(middle_row, middle_column, detection_engine=DEFAULT_DETECTION_ENGINE):
+    """
+    Find the area of the image that is not black border from its middle row and column only, the way the "scanline"
+    and "vectorized" engines do.
+
+    Args:
+        middle_row: the row int(height / 2) of the image, with the format: (width, channels)
+        middle_column: the column int(width / 2) of the image, with the format: (height, channels)
+        detection_engine: "scanline" or "vectorized".
+
+    Returns: area, a tuple (left, top, right, bottom) to be used with Image.crop(), or None if no non black pixel
+    is found.
+
+    """
+    if detection_engine == "scanline":
+        get_pixel_not_black = get_pixel_not_black_from_array
+    else:
+        get_pixel_not_black = get_pixel_not_black_from_array_vectorized
+
+    w, h = len(middle_row), len(middle_column)
+
+    # Get the column to cut from the left
+    left_column_to_crop = get_pixel_not_black(middle_row)
+    # Get the column to cut from the right
+    right_column_to_crop = get_pixel_not_black(middle_row[::-1])
+    # Get the row to cut from the top
+    top_row_to_crop = get_pixel_not_black(middle_column)
+    # Get the row to cut from the bottom
+    bottom_row_to_crop = get_pixel_not_black(middle_column[::-1])
+
+    if None in (left_column_to_crop, right_column_to_crop, top_row_to_crop, bottom_row_to_crop):
+        return None
+
+    return left_column_to_crop, top_row_to_crop, w - right_column_to_crop, h - bottom_row_to_crop
+
+def get_crop_box_from_image(img, detection_engine=DEFAULT_DETECTION_ENGINE):
+    """
+    Find the area of a PIL image that is not black border, like get_crop_box_from_image_array(), without converting
+    the whole image to a numpy array when the engine only needs the middle row and column.
+
+    Args:
+        img: PIL image
+        detection_engine: One of DETECTION_ENGINES.
+
+    Returns: area, a tuple (left, top, right, bottom) to be used with Image.crop(), or None if no non black pixel
+    is found.
+
+    """
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+    if detection_engine == "bounding_box":
+        if img.mode == "P":
+            # The palette indexes are looked up instead of converting the whole image to RGB
+            not_black_mask = get_palette_not_black_table(img)[np.asarray(img)]
+            return get_crop_boxes_from_masks(rows_with_pixels=np.any(not_black_mask, axis=1)[np.newaxis],
+                                             columns_with_pixels=np.any(not_black_mask, axis=0)[np.newaxis])[0]
+        return get_crop_box_from_image_array(image_array=np.asarray(get_detection_image(img)),
+                                             detection_engine=detection_engine)
+    w, h = img.size
+    # Only the two lines are copied out of the PIL image, and converted if its mode is not read natively
+    middle_row = np.asarray(get_detection_image(img.crop((0, int(h / 2), w, int(h / 2) + 1))))[0]
+    middle_column = np.asarray(get_detection_image(img.crop((int(w / 2), 0, int(w / 2) + 1, h))))[:, 0]
+    return get_crop_box_from_middle_lines(middle_row=middle_row, middle_column=middle_column,
+                                          detection_engine=detection_engine)
+
+def get_detection_image(img):
+    """
+    Get an image whose numpy array can be read by the black border detection.
+
+    Args:
+        img: PIL image
+
+    Returns: img itself if its mode is one of DETECTION_MODES, otherwise img converted to RGB, e.g. palette images,
+    so only convert small parts of them, e.g. lines. The alpha channel is not needed to find the border.
+
+    """
+    if img.mode in DETECTION_MODES:
+        return img
+    return img.convert("RGB")
+
+def get_palette_not_black_table(img):
+    """
+    Args:
+        img: PIL image with "P" mode.
+
+    Returns: Boolean numpy array with 256 values: True for the palette indexes whose color is not black. Indexes out
+    of the palette are black.
+
+    """
+    palette = np.asarray(img.getpalette("RGB") or (), dtype=np.uint8).reshape(-1, 3)[:256]
+    table = np.zeros(256, dtype=bool)
+    table[:len(palette)] = get_not_black_mask(palette)
+    return table
+
+def get_not_black_mask(pixels):
+    """
+    Args:
+        pixels: numpy array (or view) of pixels with the format: (..., channels).
+
+    Returns: Boolean mask with the shape of pixels without the channels: True where all the color channels are
+    different from 0, the rule of get_pixel_not_black_from_array().
+
+    """
+    return np.all(pixels[..., :get_color_channels(pixels.shape[-1])] != 0, axis=-1)
+
+def get_crop_boxes_from_masks(rows_with_pixels, columns_with_pixels):
+    """
+    Get the crop box of several images at once from which of their rows and columns have non black pixels.
+
+    Args:
+        rows_with_pixels: Boolean array with the format: (images, height).
+        columns_with_pixels: Boolean array with the format: (images, width).
+
+    Returns: areas, a list with a tuple (left, top, right, bottom) for each image, or None if it has no non black
+    pixel.
+
+    """
+    h, w = rows_with_pixels.shape[1], columns_with_pixels.shape[1]
+    # argmax returns 0 when there is no True value at all, so found is checked apart
+    found = rows_with_pixels.any(axis=1) & columns_with_pixels.any(axis=1)
+    left = np.argmax(columns_with_pixels, axis=1)
+    right = w - np.argmax(columns_with_pixels[:, ::-1], axis=1)
+    top = np.argmax(rows_with_pixels, axis=1)
+    bottom = h - np.argmax(rows_with_pixels[:, ::-1], axis=1)
+    return [(int(left[i]), int(top[i]), int(right[i]), int(bottom[i])) if found[i] else None
+            for i in range(len(found))]
+
+def get_crop_boxes_from_batch(batch, detection_engine=DEFAULT_DETECTION_ENGINE):
+    """
+    Find the crop box of every image of a batch of images with the same shape, with numpy reductions over the whole
+    batch at once instead of one get_crop_box_from_image_array() call per image. The boxes are the same.
+
+    Args:
+        batch: Numpy array with the format: (images, height, width, channels), or (images, height, width) for
+        grayscale images.
+        detection_engine: One of DETECTION_ENGINES. "scanline" and "vectorized" both read the middle row and column
+        of each image.
+
+    Returns: areas, a list with a tuple (left, top, right, bottom) for each image, or None if no non black pixel is
+    found in it.
+
+    """
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+    if batch.ndim == 3:
+        batch = batch[..., np.newaxis]  # A view, to read grayscale images as one channel images
+    if batch.ndim != 4:
+        raise ValueError("'batch' has to have the format (images, height, width[, channels]).")
+    _, h, w, _ = batch.shape
+    if detection_engine != "bounding_box":
+        # The middle column of each image tells the rows with pixels, and its middle row the columns
+        return get_crop_boxes_from_masks(rows_with_pixels=get_not_black_mask(batch[:, :, int(w / 2)]),
+                                         columns_with_pixels=get_not_black_mask(batch[:, int(h / 2)]))
+    not_black_mask = get_not_black_mask(batch)
+    return get_crop_boxes_from_masks(rows_with_pixels=not_black_mask.any(axis=2),
+                                     columns_with_pixels=not_black_mask.any(axis=1))
+
+def get_crop_boxes_from_image_arrays(image_arrays, detection_engine=DEFAULT_DETECTION_ENGINE):
+    """
+    Find the crop box of each image of a list of image arrays of any shapes. The images with the same shape are
+    detected together with get_crop_boxes_from_batch(): only their middle rows and columns are stacked, or the whole
+    images with the "bounding_box" engine.
+
+    Args:
+        image_arrays: list of numpy arrays with the format: (height, width[, channels]).
+        detection_engine: One of DETECTION_ENGINES.
+
+    Returns: areas, a list with a tuple (left, top, right, bottom) for each image, or None if no non black pixel is
+    found in it.
+
+    """
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+    groups = {}
+    for index, image_array in enumerate(image_arrays):
+        groups.setdefault(image_array.shape, []).append(index)
+    areas = [None] * len(image_arrays)
+    for shape, indexes in groups.items():
+        if detection_engine != "bounding_box":
+            h, w = shape[0], shape[1]
+            middle_columns = np.stack([image_arrays[i][:, int(w / 2)] for i in indexes])
+            middle_rows = np.stack([image_arrays[i][int(h / 2)] for i in indexes])
+            if len(shape) == 2:
+                middle_columns, middle_rows = middle_columns[..., np.newaxis], middle_rows[..., np.newaxis]
+            group_areas = get_crop_boxes_from_masks(rows_with_pixels=get_not_black_mask(middle_columns),
+                                                    columns_with_pixels=get_not_black_mask(middle_rows))
+        else:
+            group_areas = get_crop_boxes_from_batch(np.stack([image_arrays[i] for i in indexes]),
+                                                    detection_engine=detection_engine)
+        for index, area in zip(indexes, group_areas):
+            areas[index] = area
+    return areas
+
+def get_image_array_from_bytes(data):
+    """
+    Decode an encoded image to a numpy array in its own mode, e.g. (height, width) for L images, except palette
+    images, whose indexes are not colors: they are converted to RGB (RGBA if they have transparency).
+    """
+    img = Image.open(io.BytesIO(data))
+    if img.mode in ("P", "PA"):
+        img = img.convert("RGBA" if img.mode == "PA" or "transparency" in img.info else "RGB")
+    return np.asarray(img)
+
+def crop_image_batch(images, resize_dimensions=None, keep_aspect_ratio=False,
+                     detection_engine=DEFAULT_DETECTION_ENGINE, resampling=DEFAULT_RESAMPLING, stack=False):
+    """
+    Crop the black border of images already in memory, e.g. inside an inference service, without writing them to
+    disk. The crop boxes of the whole batch are found at once (see get_crop_boxes_from_batch()) and, if no resize is
+    asked, the cropped images are numpy views of the input arrays: nothing is copied or converted to PIL.
+
+    Args:
+        images: A numpy array with the format: (images, height, width[, channels]), or a list of numpy arrays
+        (height, width[, channels]) and/or encoded images (bytes), which are decoded with PIL.
+        resize_dimensions: (Optional) (width, height) each cropped image is resized to, with PIL, like
+        get_cropped_image_from_file() with force_dimensions.
+        keep_aspect_ratio: See change_image_resolution_from_PIL_image().
+        detection_engine: One of DETECTION_ENGINES.
+        resampling: One of RESAMPLING_PRESETS, used if the images are resized.
+        stack: True to return the cropped images as one (images, height, width[, channels]) array. They have to have
+        the same shape, e.g. resized to resize_dimensions without keep_aspect_ratio.
+
+    Returns: areas, cropped_images. A list with the crop box (left, top, right, bottom) of each image, or None if no
+    non black pixel is found in it (then its cropped image is the whole image), and the list (or array if stack) of
+    cropped images as numpy arrays.
+
+    """
+    if resampling not in RESAMPLING_PRESETS:
+        raise ValueError("'resampling' has to be one of " + str(tuple(RESAMPLING_PRESETS)) + ".")
+    if isinstance(images, np.ndarray):
+        image_arrays = images
+        areas = get_crop_boxes_from_batch(images, detection_engine=detection_engine)
+    else:
+        image_arrays = [get_image_array_from_bytes(image) if isinstance(image, (bytes, bytearray, memoryview))
+                        else np.asarray(image) for image in images]
+        areas = get_crop_boxes_from_image_arrays(image_arrays, detection_engine=detection_engine)
+
+    cropped_images = []
+    for image_array, area in zip(image_arrays, areas):
+        if area is not None:
+            left, top, right, bottom = area
+            image_array = image_array[top:bottom, left:right]
+        if resize_dimensions or keep_aspect_ratio:
+            _, image_array = change_image_resolution_from_PIL_image(img=Image.fromarray(image_array),
+                                                                    resize_dimensions=resize_dimensions,
+                                                                    keep_aspect_ratio=keep_aspect_ratio,
+                                                                    resampling=resampling)
+        cropped_images.append(image_array)
+    if stack:
+        cropped_images = np.stack(cropped_images)
+    return areas, cropped_images
+
+def crop_image_from_image_array_by_black_pixels(image_array, image, detection_engine=DEFAULT_DETECTION_ENGINE,
+                                                area=None, metrics=None):
     """
-    With the data collected with get_pixel_not_black_from_array() function, the image black border is cropped.
+    With the data collected with get_crop_box_from_image_array() function, the image black border is cropped.
     The non black pixels found iterating over from the middle row and column of the image to the center, we get the
     area to be cropped.
 
@@ -75,43 +473,252 @@ def crop_image_from_image_array_by_black_pixels(image_array, image):
 
         image: Original image
 
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found. See
+        get_crop_box_from_image_array().
+
+        area: (Optional) A tuple (left, top, right, bottom) already found for this image. If given, the black border
+        is not searched again.
+
+        metrics: (Optional) Metrics.FileMetrics where the detect and crop timings are recorded.
+
     Returns: Image cropped array
 
     """
     try:
-        h, w, _ = image_array.shape
-
-        # the middle row and column
-        half_of_rows_resolution = int(h / 2)
-        half_of_column_resolution = int(w / 2)
-
-        # Get the column to cut from the left
-        left_column_to_crop = get_pixel_not_black_from_array(row_or_column_array=
-                                                             image_array[half_of_rows_resolution])
-        # Get the column to cut from the right
-        right_column_to_crop = get_pixel_not_black_from_array(row_or_column_array=
-                                                              reversed(image_array[half_of_rows_resolution]))
-        # Get the row to cut from the top
-        top_row_to_crop = get_pixel_not_black_from_array(row_or_column_array=
-                                                         image_array[:,half_of_column_resolution])
-        # Get the row to cut from the bottom
-        bottom_row_to_crop = get_pixel_not_black_from_array(row_or_column_array=
-                                                            reversed(image_array[:,half_of_column_resolution]))
-
-        # The rectangle of the image to be cropped, based on non black pixels found with get_pixel_not_black_from_array()
-        area = (left_column_to_crop, top_row_to_crop, w - right_column_to_crop, h - bottom_row_to_crop)
-        image =  Image.fromarray(np.uint8(image_array))
-        cropped_img = image.crop(area)
+        # The rectangle of the image to be cropped, based on non black pixels found
+        if area is None:
+            with measure_stage(metrics, "detect"):
+                area = get_crop_box_from_image_array(image_array=image_array, detection_engine=detection_engine)
+        if area is None:
+            raise ValueError("No non black pixel found to crop the image.")
+        with measure_stage(metrics, "crop"):
+            if image.size != (image_array.shape[1], image_array.shape[0]):
+                # The image is not the one the array was made from, e.g. it was resized
+                image =  Image.fromarray(np.uint8(image_array))
+            cropped_img = image.crop(area)
         return cropped_img
     except Exception as e:
         # If error, it returns the original image.
         print(str(e))
         return image
 
-def change_image_resolution_from_PIL_image(img, resize_dimensions=None, keep_aspect_ratio=False):
+def crop_image_by_black_pixels(img, detection_engine=DEFAULT_DETECTION_ENGINE, area=None, metrics=None,
+                               memory_budget=None):
+    """
+    Same as crop_image_from_image_array_by_black_pixels() but working directly on a PIL image: the border is found
+    with get_crop_box_from_image() and the image is cropped without any numpy array of the full image.
+
+    Args:
+        img: PIL image
+
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+
+        area: (Optional) A tuple (left, top, right, bottom) already found for this image, or NO_CROP_BOX. If given,
+        the black border is not searched again.
+
+        metrics: (Optional) Metrics.FileMetrics where the detect and crop timings are recorded.
+
+        memory_budget: (Optional) The memory budget the image was decoded with. See LargeImages.budget_image_pixels().
+
+    Returns: Image cropped, or the original image if the cropping fails.
+
+    """
+    try:
+        # The rectangle of the image to be cropped, based on non black pixels found
+        if area is None:
+            with measure_stage(metrics, "detect"):
+                area = get_crop_box_from_image(img=img, detection_engine=detection_engine)
+        if not area:
+            raise ValueError("No non black pixel found to crop the image.")
+        with measure_stage(metrics, "crop"), budget_image_pixels(memory_budget):
+            cropped_img = img.crop(area)
+        return cropped_img
+    except Exception as e:
+        # If error, it returns the original image.
+        print(str(e))
+        return img
+
+def get_draft_scale(detection_tolerance):
+    """
+    Get the biggest reduction factor of DRAFT_SCALES whose error, in pixels of the full resolution image, is not
+    bigger than detection_tolerance.
+
+    Args:
+        detection_tolerance: Maximum error allowed, in pixels of the full resolution image, for each side of the box.
+
+    Returns: draft_scale, the factor the image will be reduced by to find its black border.
+
+    """
+    draft_scale = 1
+    for scale in DRAFT_SCALES:
+        if scale <= max(detection_tolerance, 1):
+            draft_scale = scale
+    return draft_scale
+
+def scale_crop_box(area, from_size, to_size, exact=False):
+    """
+    Convert a crop box found in an image of size from_size to the coordinates of the same image with size to_size.
+
+    Args:
+        area: A tuple (left, top, right, bottom).
+        from_size: (width, height) of the image where the area was found.
+        to_size: (width, height) of the image where the area will be applied.
+        exact: True to return float coordinates instead of rounding them, e.g. to be used as the box of
+        Image.resize().
+
+    Returns: The scaled area, or area itself if it is None or NO_CROP_BOX.
+
+    """
+    if not area or tuple(from_size) == tuple(to_size):
+        return area
+    width_scale = to_size[0] / from_size[0]
+    height_scale = to_size[1] / from_size[1]
+    left, top, right, bottom = area
+    if exact:
+        return (min(left * width_scale, to_size[0]), min(top * height_scale, to_size[1]),
+                min(right * width_scale, to_size[0]), min(bottom * height_scale, to_size[1]))
+    return (min(int(round(left * width_scale)), to_size[0]), min(int(round(top * height_scale)), to_size[1]),
+            min(int(round(right * width_scale)), to_size[0]), min(int(round(bottom * height_scale)), to_size[1]))
+
+def get_reduced_image(img, scale):
+    """
+    Reduce an image by an integer factor, e.g. to find its black border faster. Pillow can not reduce every mode, so
+    bilevel, 16 bit and palette images are converted first (to L, I and RGB, RGBA if they have transparency).
+
+    Returns: The reduced image, or img if scale is 1.
+
+    """
+    if scale == 1:
+        return img
+    if img.mode not in ("L", "LA", "I", "F", "RGB", "RGBA"):
+        img = img.convert({"1": "L", "I;16": "I"}.get(img.mode, "RGBA" if img.mode == "PA" or "transparency" in img.info
+                                                      else "RGB"))
+    return img.reduce(scale)
+
+def get_crop_box_from_file_by_draft(fullpath, detection_tolerance=DEFAULT_DETECTION_TOLERANCE,
+                                    detection_engine=DEFAULT_DETECTION_ENGINE, memory_budget=None):
+    """
+    Find the black border of an image file without decoding it at full resolution.
+    JPEG files are decoded directly at a reduced scale with the Pillow draft mode. Other formats are decoded and then
+    reduced by an integer factor before the detection.
+
+    Args:
+        fullpath: fullpath of image
+        detection_tolerance: Maximum error allowed, in pixels of the full resolution image, for each side of the box.
+        The bigger it is, the smaller the image used to find the border. See get_draft_scale().
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+        memory_budget: (Optional) See LargeImages.open_image().
+
+    Returns: area, full_size. The area in full resolution coordinates (None if no non black pixel is found) and the
+    (width, height) of the full resolution image.
+
+    """
+    img = open_image(fullpath, memory_budget=memory_budget)
+    full_size = img.size
+    draft_scale = get_draft_scale(detection_tolerance)
+    if draft_scale > 1:
+        width, height = full_size
+        if img.format == "JPEG":
+            # The decoder chooses the smallest scale that is still bigger than the requested size
+            img.draft(img.mode, (width // draft_scale, height // draft_scale))
+        else:
+            img = get_reduced_image(img, draft_scale)
+    area = get_crop_box_from_image(img=img, detection_engine=detection_engine)
+    return scale_crop_box(area, img.size, full_size), full_size
+
+def get_crop_box_from_file(fullpath, detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0):
+    """
+    Find the black border of an image file.
+
+    Args:
+        fullpath: fullpath of image
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+        detection_tolerance: If > 0, the border is found in a reduced image. See get_crop_box_from_file_by_draft().
+
+    Returns: area, a tuple (left, top, right, bottom) in full resolution coordinates, or None if no non black pixel
+    is found.
+
+    """
+    if detection_tolerance:
+        area, _ = get_crop_box_from_file_by_draft(fullpath=fullpath, detection_tolerance=detection_tolerance,
+                                                  detection_engine=detection_engine)
+        if area is not None:
+            return area
+    return get_crop_box_from_image(img=Image.open(fullpath), detection_engine=detection_engine)
+
+def get_draft_size(full_size, resize_dimensions=None, force_dimensions=False, area=None,
+                   resampling=DEFAULT_RESAMPLING):
+    """
+    Get the smallest size a JPEG image can be decoded to (with the Pillow draft mode) without losing resolution in the
+    resized image.
+
+    Args:
+        full_size: (width, height) of the full resolution image.
+        resize_dimensions: See get_cropped_image_from_file().
+        force_dimensions: See get_cropped_image_from_file().
+        area: The crop box in full resolution coordinates, or None if it is not known yet.
+        resampling: One of RESAMPLING_PRESETS.
+
+    Returns: The (width, height) to pass to img.draft(), or None if the image has to be decoded at full resolution.
+
+    """
+    if not RESAMPLING_PRESETS[resampling]["draft"] or not resize_dimensions:
+        return None
+    width, height = resize_dimensions[0], resize_dimensions[1]
+    if force_dimensions and area != NO_CROP_BOX:
+        if area is None:
+            # The image is resized after cropping, and the size of the crop is not known before decoding it
+            return None
+        left, top, right, bottom = area
+        # The cropped area, not the whole image, has to be at least as big as resize_dimensions
+        width = -(-width * full_size[0] // max(right - left, 1))
+        height = -(-height * full_size[1] // max(bottom - top, 1))
+    if width >= full_size[0] or height >= full_size[1]:
+        return None
+    return width, height
+
+def get_crop_preview(fullpath, thumbnail_size=(256, 256), detection_engine=DEFAULT_DETECTION_ENGINE,
+                     detection_tolerance=DEFAULT_DETECTION_TOLERANCE):
+    """
+    Create a thumbnail of an image and of the image cropped by its black border, to check the crop boxes before
+    processing a folder. The border is found as in get_crop_box_from_file() and JPEG files are decoded at the
+    smallest scale still bigger than the thumbnail, so no full resolution JPEG image is decoded. The other formats
+    can only be decoded at full resolution, so they are decoded once for both the border and the thumbnails.
+
+    Args:
+        fullpath: fullpath of image
+        thumbnail_size: Maximum (width, height) of the thumbnails. The aspect ratio is kept.
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+        detection_tolerance: See get_crop_box_from_file().
+
+    Returns: thumbnail, cropped_thumbnail, area. The two PIL thumbnails and the crop box in full resolution
+    coordinates, or None if no non black pixel is found (then cropped_thumbnail is the whole image).
+
+    """
+    img = Image.open(fullpath)
+    full_size = img.size
+    if img.format == "JPEG":
+        area = get_crop_box_from_file(fullpath=fullpath, detection_engine=detection_engine,
+                                      detection_tolerance=detection_tolerance)
+        img.draft(img.mode, thumbnail_size)
+        img.load()
+    else:
+        # The same reduction as get_crop_box_from_file_by_draft(), from the image decoded for the thumbnails
+        img.load()
+        detection_img = get_reduced_image(img, get_draft_scale(detection_tolerance))
+        area = scale_crop_box(get_crop_box_from_image(img=detection_img, detection_engine=detection_engine),
+                              detection_img.size, full_size)
+    # Each thumbnail is reduced from the decoded image, so the cropped one keeps all the resolution it can
+    cropped_thumbnail = img.crop(scale_crop_box(area, full_size, img.size)) if area is not None else img.copy()
+    img.thumbnail(thumbnail_size, reducing_gap=2.0)
+    cropped_thumbnail.thumbnail(thumbnail_size, reducing_gap=2.0)
+    return img, cropped_thumbnail, area
+
+def change_image_resolution_from_PIL_image(img, resize_dimensions=None, keep_aspect_ratio=False, as_array=True,
+                                           resampling=DEFAULT_RESAMPLING, box=None):
     """
     Resize the image to the given resize dimensions.
-    Convert it to numpy array.
+    (Optional) Convert it to numpy array.
 
     Args:
         img: PIL image opened
@@ -119,11 +726,23 @@ def change_image_resolution_from_PIL_image(img, resize_dimensions=None, keep_asp
         of the images.
         If none, then the image will be the same.
         keep_aspect_ratio: True if we want to keep aspect ratio of new images.
+        as_array: True to convert the image to a numpy array. If False, no copy of the image is made and None is
+        returned instead of the array.
+        resampling: One of RESAMPLING_PRESETS, from "quality" (the slowest) to "fastest". The fast presets reduce
+        the image by an integer factor before applying a simpler filter.
+        box: (Optional) A crop box (left, top, right, bottom), maybe with float coordinates, of the region of img
+        that is resized, when keep_aspect_ratio is False. Cropping and resizing at once keeps the subpixel position
+        of the box.
 
-
-    Returns: Image.img , array image
+    Returns: Image.img , array image. Palette and bilevel images are resized as RGB (RGBA if they have transparency)
+    and L images, because Pillow only resizes them with the nearest neighbour filter.
 
     """
+    if resampling not in RESAMPLING_PRESETS:
+        raise ValueError("'resampling' has to be one of " + str(tuple(RESAMPLING_PRESETS)) + ".")
+    preset = RESAMPLING_PRESETS[resampling]
+    if resize_dimensions and img.mode in ("1", "P"):
+        img = img.convert("L" if img.mode == "1" else "RGBA" if "transparency" in img.info else "RGB")
     if resize_dimensions:
         w = list(resize_dimensions)[0]
         h = list(resize_dimensions)[1]
@@ -133,26 +752,583 @@ def change_image_resolution_from_PIL_image(img, resize_dimensions=None, keep_asp
             aspect_ratio = int((width / high) * h)
             if w == aspect_ratio:
                 # If the aspect ratio of the original image is the same as the resize dimensions
-                image_array = np.array(img.resize(size), Image.BICUBIC) # Resize image
+                img = img.resize(size, preset["aspect_ratio_filter"], reducing_gap=preset["reducing_gap"])
             else:
                 # To keep it the same, if the aspect ratio of the original image is different of the resize dimensions
-                image_array = np.array(img.resize((aspect_ratio, h), Image.BICUBIC))  # Resize image
+                img = img.resize((aspect_ratio, h), preset["aspect_ratio_filter"],
+                                 reducing_gap=preset["reducing_gap"])  # Resize image
         else:
             #img = ImageOps.fit(img, size, Image.ANTIALIAS)
-            img = img.resize(size, Image.ANTIALIAS)
-            image_array = np.array(img) # Convert to array
-    else:
-        image_array = np.array(img) # Convert to array
+            img = img.resize(size, preset["filter"], box=box, reducing_gap=preset["reducing_gap"])
+
+    image_array = np.array(img) if as_array else None # Convert to array
 
     return  img, image_array
 
 
+def get_cropped_image_from_file(fullpath, resize_dimensions=None, keep_aspect_ratio=False, force_dimensions=False,
+                                detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0, area=None,
+                                metrics=None, resampling=DEFAULT_RESAMPLING, memory_budget=None):
+    """
+    Open an image file, crop its black border and resize it if resize arguments are given.
+
+    Args:
+        fullpath: fullpath of image
+        resize_dimensions: is a tuple with the format: (height, width). Ths will be the new dimension of the images.
+        If none, then the image will be the same.
+
+        keep_aspect_ratio: True if we want to keep aspect ratio of new images.
+
+        force_dimensions: True if the resize has to be done after cropping, so the saved image has exactly the given
+        resolution.
+
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+
+        detection_tolerance: If 0, the black border is found in the full resolution image. Otherwise, when the box
+        lets a JPEG file be decoded at a reduced scale (with force_dimensions and a resampling preset with draft,
+        see get_draft_size()), it is found in a reduced version of the image (see get_crop_box_from_file_by_draft())
+        with this maximum error in pixels, and the box is scaled up to the full resolution image. In the other cases
+        the image is decoded at full resolution anyway, so the border is found in it.
+
+        area: (Optional) The crop box (left, top, right, bottom) in full resolution coordinates, already known, e.g.
+        shared by all the frames of a sequence, or NO_CROP_BOX if the image is known to have no border. If given, the
+        black border is not searched.
+
+        metrics: (Optional) Metrics.FileMetrics where the timings of each stage are recorded.
+
+        resampling: One of RESAMPLING_PRESETS, the quality/speed of the resize. The presets with draft decode JPEG
+        files at a reduced scale when the new size allows it (see get_draft_size()).
+
+        memory_budget: (Optional) Maximum bytes of the decoded image. Images that need more are decoded reduced to
+        fit, in the large image mode of decode_large_image_file(), and images bigger than Image.MAX_IMAGE_PIXELS are
+        accepted.
+
+    Returns: img, image_cropped. The original (or resized) image and the cropped image.
+
+    """
+    img, area = decode_image_file(fullpath=fullpath, resize_dimensions=resize_dimensions,
+                                  force_dimensions=force_dimensions, detection_engine=detection_engine,
+                                  detection_tolerance=detection_tolerance, area=area, metrics=metrics,
+                                  resampling=resampling, memory_budget=memory_budget)
+    return crop_and_resize_image(img=img, resize_dimensions=resize_dimensions, keep_aspect_ratio=keep_aspect_ratio,
+                                 force_dimensions=force_dimensions, detection_engine=detection_engine, area=area,
+                                 metrics=metrics, resampling=resampling, memory_budget=memory_budget)
+
+def decode_image_file(fullpath, resize_dimensions=None, force_dimensions=False,
+                      detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0, area=None, metrics=None,
+                      resampling=DEFAULT_RESAMPLING, memory_budget=None):
+    """
+    First stage of get_cropped_image_from_file(): find the crop box in a reduced decoding if detection_tolerance is
+    given, and decode the image, at a reduced scale if the resampling preset allows it. This is the stage that reads
+    the disk.
+    If the decoded image would use more than memory_budget bytes, it is decoded with decode_large_image_file()
+    instead.
+
+    Args:
+        fullpath: fullpath of image
+        resize_dimensions: See get_cropped_image_from_file().
+        force_dimensions: See get_cropped_image_from_file().
+        detection_engine: See get_cropped_image_from_file().
+        detection_tolerance: See get_cropped_image_from_file().
+        area: See get_cropped_image_from_file().
+        metrics: (Optional) Metrics.FileMetrics where the timings of each stage are recorded.
+        resampling: See get_cropped_image_from_file().
+        memory_budget: See get_cropped_image_from_file().
+
+    Returns: img, area. The decoded PIL image and the crop box in its coordinates, or None if it has to be searched.
+
+    """
+    # With a budget, it replaces the decompression bomb check of PIL: bigger images are decoded reduced
+    with measure_stage(metrics, "decode"):
+        img = open_image(fullpath, memory_budget=memory_budget)
+    if memory_budget is not None and get_decoded_bytes(img.size, img.mode) > memory_budget:
+        return decode_large_image_file(img=img, fullpath=fullpath, resize_dimensions=resize_dimensions,
+                                       force_dimensions=force_dimensions, detection_engine=detection_engine,
+                                       detection_tolerance=detection_tolerance, area=area, metrics=metrics,
+                                       resampling=resampling, memory_budget=memory_budget)
+
+    # The reduced detection is an extra decoding, only worth it if its box lets the image be decoded reduced. The
+    # whole image is the box that allows the smallest draft size.
+    if area is None and detection_tolerance and force_dimensions and img.format == "JPEG" \
+            and get_draft_size(full_size=img.size, resize_dimensions=resize_dimensions, force_dimensions=True,
+                               area=(0, 0) + img.size, resampling=resampling) is not None:
+        with measure_stage(metrics, "detect"):
+            area, _ = get_crop_box_from_file_by_draft(fullpath=fullpath,
+                                                      detection_tolerance=detection_tolerance,
+                                                      detection_engine=detection_engine,
+                                                      memory_budget=memory_budget)
+        # If no border is found in the reduced image, area is None and it is searched again at full resolution
+
+    # The decoded PIL image is the only full size buffer: the border is searched on its middle lines, and it is
+    # cropped and resized without converting it to numpy arrays
+    with measure_stage(metrics, "decode"):
+        full_size = img.size
+        draft_size = get_draft_size(full_size=full_size, resize_dimensions=resize_dimensions,
+                                    force_dimensions=force_dimensions, area=area, resampling=resampling)
+        if draft_size is not None and img.format == "JPEG":
+            img.draft(img.mode, draft_size)
+        img.load()
+    if metrics is not None:
+        metrics.width, metrics.height = full_size
+    # The area was found in the full resolution image, not in the draft one
+    return img, scale_crop_box(area, full_size, img.size)
+
+def decode_large_image_file(img, fullpath, resize_dimensions=None, force_dimensions=False,
+                            detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0, area=None, metrics=None,
+                            resampling=DEFAULT_RESAMPLING, memory_budget=None):
+    """
+    Large image mode of decode_image_file(), for images too big to be decoded at full resolution (e.g. 20000x20000
+    scans). The image is decoded reduced by the smallest integer factor that makes it fit in memory_budget, or by a
+    bigger one if the resampling preset and the new size allow it (see get_draft_size()), so the peak memory is
+    bounded:
+        - JPEG files are decoded directly at a reduced scale with the Pillow draft mode, and the crop box is found
+        in a draft decoding too (see get_crop_box_from_file_by_draft()), with at least the error of the factor. The
+        decoder reduces 1/8 at most.
+        - PNG files (see LargeImages.read_png_header()) are decoded a strip of rows at a time, and each strip is
+        reduced before the next one is decoded. The crop box is found exactly in the same pass, from the full
+        resolution strips. Palette images are reduced as RGB (RGBA if they have transparency). The PNG files that
+        can not be read in strips (interlaced, 16 bit...) are decoded whole and then reduced, so only the image kept
+        is bounded, not the peak memory.
+    Other formats raise a ValueError.
+
+    The reduced image is cropped and resized by crop_and_resize_image() like any other. The crop box is returned
+    with float coordinates, so with force_dimensions the crop keeps its subpixel position in the reduced image.
+
+    Args:
+        img: The image opened (not loaded) by decode_image_file().
+        fullpath: fullpath of image
+        resize_dimensions: See get_cropped_image_from_file().
+        force_dimensions: See get_cropped_image_from_file().
+        detection_engine: See get_cropped_image_from_file().
+        detection_tolerance: See get_cropped_image_from_file().
+        area: See get_cropped_image_from_file().
+        metrics: (Optional) Metrics.FileMetrics where the timings of each stage are recorded.
+        resampling: See get_cropped_image_from_file().
+        memory_budget: Maximum bytes of the decoded image.
+
+    Returns: img, area. The same as decode_image_file().
+
+    """
+    full_size, mode = img.size, img.mode
+    scale = get_budget_scale(full_size, mode, memory_budget)
+    if img.format == "JPEG":
+        if area is None:
+            with measure_stage(metrics, "detect"):
+                area, _ = get_crop_box_from_file_by_draft(fullpath=fullpath,
+                                                          detection_tolerance=max(detection_tolerance, scale),
+                                                          detection_engine=detection_engine,
+                                                          memory_budget=memory_budget)
+        draft_size = get_draft_size(full_size=full_size, resize_dimensions=resize_dimensions,
+                                    force_dimensions=force_dimensions, area=area, resampling=resampling)
+        budget_size = (-(-full_size[0] // scale), -(-full_size[1] // scale))
+        if draft_size is not None:
+            budget_size = (min(budget_size[0], draft_size[0]), min(budget_size[1], draft_size[1]))
+        with measure_stage(metrics, "decode"):
+            img.draft(mode, budget_size)
+            img.load()
+        if metrics is not None:
+            metrics.width, metrics.height = full_size
+        # The size of the draft image is rounded up, so the area is scaled by the exact factor of the decoder
+        draft_scale = round(full_size[0] / img.size[0])
+        return img, scale_crop_box(area, full_size, (full_size[0] / draft_scale, full_size[1] / draft_scale),
+                                   exact=True)
+
+    if img.format != "PNG":
+        raise ValueError("The image needs " + str(get_decoded_bytes(full_size, mode)) + " bytes, more than the "
+                         "memory budget, and only JPEG and PNG files can be decoded reduced.")
+    draft_size = get_draft_size(full_size=full_size, resize_dimensions=resize_dimensions,
+                                force_dimensions=force_dimensions, area=area, resampling=resampling)
+    if draft_size is not None:
+        scale = max(scale, min(full_size[0] // draft_size[0], full_size[1] // draft_size[1]))
+    try:
+        width, height, mode = read_png_header(fullpath)
+    except ValueError:
+        with measure_stage(metrics, "decode"):
+            img.load()
+        if area is None:
+            with measure_stage(metrics, "detect"):
+                area = get_crop_box_from_image(img=img, detection_engine=detection_engine) or NO_CROP_BOX
+        with measure_stage(metrics, "decode"):
+            reduced_img = get_reduced_image(img, scale)
+        if metrics is not None:
+            metrics.width, metrics.height = full_size
+        return reduced_img, scale_crop_box(area, full_size, (full_size[0] / scale, full_size[1] / scale), exact=True)
+    img.close()
+    if mode == "P":
+        # Reduced as RGB (RGBA), like get_reduced_image(), and the border is searched in the colors, not the indexes
+        mode = "RGBA" if read_png_palette(fullpath)[1] is not None else "RGB"
+    # The strips have a multiple of scale rows, so reducing each strip is the same as reducing the whole image
+    strip_bytes = min(LARGE_IMAGE_STRIP_BYTES, int(memory_budget * LARGE_IMAGE_STRIP_BUDGET_FRACTION))
+    strip_rows = scale * max(strip_bytes // (scale * width * Image.getmodebands(mode)), 1)
+    reduced_img = Image.new(mode, (-(-width // scale), -(-height // scale)))
+    search_area = area is None
+    middle_row, middle_column = None, []
+    rows_with_pixels, columns_with_pixels = [], np.zeros(width, dtype=bool)
+    with measure_stage(metrics, "decode"):
+        for top, strip in iter_png_strips(fullpath=fullpath, strip_rows=strip_rows):
+            if strip.mode != mode:
+                strip = strip.convert(mode)
+            if search_area:
+                strip_array = np.asarray(strip).reshape(strip.height, width, -1)
+                if detection_engine != "bounding_box":
+                    # Copies, so the strips are not kept alive by views of them
+                    middle_column.append(strip_array[:, int(width / 2)].copy())
+                    if top <= int(height / 2) < top + strip.height:
+                        middle_row = strip_array[int(height / 2) - top].copy()
+                else:
+                    not_black_mask = get_not_black_mask(strip_array)
+                    rows_with_pixels.append(not_black_mask.any(axis=1))
+                    columns_with_pixels |= not_black_mask.any(axis=0)
+            reduced_img.paste(strip.reduce(scale) if scale > 1 else strip, (0, top // scale))
+    if search_area:
+        with measure_stage(metrics, "detect"):
+            if detection_engine != "bounding_box":
+                area = get_crop_box_from_middle_lines(middle_row=middle_row,
+                                                      middle_column=np.concatenate(middle_column),
+                                                      detection_engine=detection_engine)
+            else:
+                area = get_crop_boxes_from_masks(rows_with_pixels=np.concatenate(rows_with_pixels)[np.newaxis],
+                                                 columns_with_pixels=columns_with_pixels[np.newaxis])[0]
+        if area is None:
+            # No border to crop, and it is not searched again in the reduced image
+            area = NO_CROP_BOX
+    if metrics is not None:
+        metrics.width, metrics.height = full_size
+    return reduced_img, scale_crop_box(area, full_size, (width / scale, height / scale), exact=True)
+
+def crop_and_resize_image(img, resize_dimensions=None, keep_aspect_ratio=False, force_dimensions=False,
+                          detection_engine=DEFAULT_DETECTION_ENGINE, area=None, metrics=None,
+                          resampling=DEFAULT_RESAMPLING, memory_budget=None):
+    """
+    Second stage of get_cropped_image_from_file(): crop the black border of a decoded image and resize it.
+
+    Args:
+        img: PIL image returned by decode_image_file().
+        resize_dimensions: See get_cropped_image_from_file().
+        keep_aspect_ratio: See get_cropped_image_from_file().
+        force_dimensions: See get_cropped_image_from_file().
+        detection_engine: See get_cropped_image_from_file().
+        area: The crop box returned by decode_image_file().
+        metrics: (Optional) Metrics.FileMetrics where the timings of each stage are recorded.
+        resampling: See get_cropped_image_from_file().
+        memory_budget: See get_cropped_image_from_file().
+
+    Returns: img, image_cropped. The original (or resized) image and the cropped image.
+
+    """
+    full_size = img.size
+    if not force_dimensions:
+        # Resizing if arguments given, keeping the original aspect ratio
+        if resize_dimensions or keep_aspect_ratio:
+            with measure_stage(metrics, "resize"):
+                img, _ = change_image_resolution_from_PIL_image(img=img,
+                                                                resize_dimensions=resize_dimensions,
+                                                                keep_aspect_ratio=keep_aspect_ratio,
+                                                                as_array=False,
+                                                                resampling=resampling)
+        # The area was found in the original image, not in the resized one
+        area = scale_crop_box(area, full_size, img.size)
+        # Cropping the image, catching exeptions if the image cropping fail
+        image_cropped = crop_image_by_black_pixels(img=img, detection_engine=detection_engine, area=area,
+                                                   metrics=metrics, memory_budget=memory_budget)
+    elif area and resize_dimensions and not keep_aspect_ratio and any(isinstance(side, float) for side in area):
+        # A crop box with float coordinates, from a reduced decoding (see decode_large_image_file()): cropping and
+        # resizing at once keeps it aligned with the box of the full resolution image
+        with measure_stage(metrics, "resize"):
+            image_cropped, _ = change_image_resolution_from_PIL_image(img=img,
+                                                                      resize_dimensions=resize_dimensions,
+                                                                      as_array=False,
+                                                                      resampling=resampling,
+                                                                      box=area)
+    else:
+        image_cropped = crop_image_by_black_pixels(img=img, detection_engine=detection_engine, area=area,
+                                                   metrics=metrics, memory_budget=memory_budget)
+        with measure_stage(metrics, "resize"):
+            image_cropped, _ = change_image_resolution_from_PIL_image(img=image_cropped,
+                                                                      resize_dimensions=resize_dimensions,
+                                                                      keep_aspect_ratio=keep_aspect_ratio,
+                                                                      as_array=False,
+                                                                      resampling=resampling)
+    return img, image_cropped
+
+def process_image_file(fullpath, new_fullpath, resize_dimensions=None, keep_aspect_ratio=False,
+                       force_dimensions=False, detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0,
+                       area=None, metrics=None, output_sink=None, resampling=DEFAULT_RESAMPLING, memory_budget=None):
+    """
+    Crop (and resize) one image file with get_cropped_image_from_file() and save it to new_fullpath.
+    This is the work done for each file by remove_black_pixels_of_image_path_v3(), in serial or parallel mode.
+
+    Args:
+        fullpath: fullpath of the original image
+        new_fullpath: fullpath where the cropped image is saved
+        resize_dimensions: See get_cropped_image_from_file().
+        keep_aspect_ratio: See get_cropped_image_from_file().
+        force_dimensions: See get_cropped_image_from_file().
+        detection_engine: See get_cropped_image_from_file().
+        detection_tolerance: See get_cropped_image_from_file().
+        area: See get_cropped_image_from_file().
+        metrics: (Optional) Metrics.FileMetrics where the timings of each stage, the bytes read and written and the
+        dimensions are recorded.
+        output_sink: (Optional) A sink of OutputSinks that writes the image instead of saving it as a file. Then
+        new_fullpath is the output returned by its prepare() method.
+        resampling: See get_cropped_image_from_file().
+        memory_budget: See get_cropped_image_from_file().
+
+    Returns: new_fullpath, or the payload returned by output_sink.write() if output_sink is given.
+
+    """
+    img, image_cropped = get_cropped_image_from_file(fullpath=fullpath,
+                                                     resize_dimensions=resize_dimensions,
+                                                     keep_aspect_ratio=keep_aspect_ratio,
+                                                     force_dimensions=force_dimensions,
+                                                     detection_engine=detection_engine,
+                                                     detection_tolerance=detection_tolerance,
+                                                     area=area,
+                                                     metrics=metrics,
+                                                     resampling=resampling,
+                                                     memory_budget=memory_budget)
+    return save_processed_image(img=img, image_cropped=image_cropped, fullpath=fullpath, new_fullpath=new_fullpath,
+                                metrics=metrics, output_sink=output_sink)
+
+def save_processed_image(img, image_cropped, fullpath, new_fullpath, metrics=None, output_sink=None):
+    """
+    Last stage of process_image_file(): encode the cropped image, or the original one if the crop failed, and write
+    it to new_fullpath or through output_sink.
+
+    Args:
+        img: The original (or resized) image returned by crop_and_resize_image().
+        image_cropped: The cropped image returned by crop_and_resize_image().
+        fullpath: fullpath of the original image, to record the bytes read in metrics.
+        new_fullpath: See process_image_file().
+        metrics: See process_image_file().
+        output_sink: See process_image_file().
+
+    Returns: new_fullpath, or the payload returned by output_sink.write() if output_sink is given.
+
+    """
+    # If crop fail save the original image
+    saved_image = image_cropped if image_cropped else img
+    # Save the cropped images
+    with measure_stage(metrics, "encode"):
+        if output_sink is None:
+            image_format = get_image_format(new_fullpath)
+            get_savable_image(saved_image, image_format).save(new_fullpath, image_format)
+        else:
+            bytes_written, payload = output_sink.write(new_fullpath, saved_image)
+    if metrics is not None:
+        metrics.output_width, metrics.output_height = saved_image.size
+        metrics.bytes_read = os.path.getsize(fullpath)
+        metrics.bytes_written = os.path.getsize(new_fullpath) if output_sink is None else bytes_written
+    return new_fullpath if output_sink is None else payload
+
+def _process_image_file_catching_errors(task):
+    """
+    Call process_image_file() with the task arguments and catch any error, so one broken file does not stop the
+    batch. Defined at module level to be picklable by the process pool.
+
+    Args:
+        task: a tuple (file, fullpath, output, process_kwargs, collect_metrics, output_sink)
+
+    Returns: file, output, error, file_metrics, payload. error is None if the file was processed successfully, or the
+    error message otherwise. file_metrics is the dict of Metrics.FileMetrics.to_dict() if collect_metrics, or None.
+    payload is the value returned by output_sink.write().
+
+    """
+    file, fullpath, output, process_kwargs, collect_metrics, output_sink = task
+    metrics = FileMetrics(file=file) if collect_metrics else None
+    try:
+        payload = process_image_file(fullpath=fullpath, new_fullpath=output, metrics=metrics,
+                                     output_sink=output_sink, **process_kwargs)
+    except Exception as e:
+        return file, output, type(e).__name__ + ": " + str(e), None, None
+    return file, output, None, metrics.to_dict() if collect_metrics else None, payload
+
+def get_image_tasks(path, image_files, process_kwargs, output_sink, manifest=None, crop_box_cache=None,
+                    collect_metrics=False, crop_box_index=None, on_error=None):
+    """
+    Generator of the tasks for _process_image_file_catching_errors(). The output of each file is prepared by the
+    output_sink, e.g. DirectorySink creates the subfolders needed to mirror the input tree.
+    If a manifest is given, the files already up to date in it are skipped.
+    If a crop_box_cache or a crop_box_index is given, the crop box of each file is taken from it and sent with the
+    task.
+
+    Args:
+        path: images path
+        image_files: iterable of image paths relative to path
+        process_kwargs: keyword arguments for process_image_file()
+        output_sink: A sink of OutputSinks.
+        manifest: (Optional) ProcessingManifest of new_folder_name.
+        crop_box_cache: (Optional) FrameSequences.SequenceCropBoxCache.
+        collect_metrics: True to record the Metrics.FileMetrics of each file.
+        crop_box_index: (Optional) CropBoxIndex.CropBoxIndex with an entry for every file of image_files.
+        on_error: (Optional) Function called with (file, error) for each file that can not even be turned into a
+        task, e.g. removed after the scan. Those files are not yielded. If None, the error is raised.
+
+    Returns: Yield a tuple (file, fullpath, output, process_kwargs, collect_metrics, output_sink) for each file.
+
+    """
+    for file in image_files:
+        # Fullpath of each file in directory and its output, e.g. its new fullpath
+        fullpath = path + os.sep + file
+        try:
+            if manifest is not None and not manifest.should_process(file=file, fullpath=fullpath):
+                continue
+            output = output_sink.prepare(file)
+        except OSError as e:
+            if on_error is None:
+                raise
+            if manifest is not None:
+                manifest.discard(file=file)
+            on_error(file, type(e).__name__ + ": " + str(e))
+            continue
+        if crop_box_cache is not None:
+            try:
+                area = crop_box_cache.get_area(file=file, fullpath=fullpath)
+            except Exception:
+                # The file is sent without area, so its error is reported by the worker as any other failure
+                area = None
+            yield file, fullpath, output, dict(process_kwargs, area=area), collect_metrics, output_sink
+        elif crop_box_index is not None:
+            # An image whose border was not found is not searched again
+            area = crop_box_index.get(file)["area"] or NO_CROP_BOX
+            yield file, fullpath, output, dict(process_kwargs, area=area), collect_metrics, output_sink
+        else:
+            yield file, fullpath, output, process_kwargs, collect_metrics, output_sink
+
+def _read_image_task(task):
+    """
+    Read-ahead stage of process_image_files_pipelined(): decode the image of a task, catching any error.
+
+    Returns: task, file_metrics, img, area, error. file_metrics is a Metrics.FileMetrics if the task collects metrics.
+    """
+    file, fullpath, output, process_kwargs, collect_metrics, output_sink = task
+    metrics = FileMetrics(file=file) if collect_metrics else None
+    try:
+        decode_kwargs = {key: value for key, value in process_kwargs.items() if key != "keep_aspect_ratio"}
+        img, area = decode_image_file(fullpath=fullpath, metrics=metrics, **decode_kwargs)
+    except Exception as e:
+        return task, metrics, None, None, type(e).__name__ + ": " + str(e)
+    return task, metrics, img, area, None
+
+def _write_image_task(task, metrics, img, image_cropped):
+    """
+    Write-behind stage of process_image_files_pipelined(): encode and write a processed image, catching any error.
+
+    Returns: The same tuple as _process_image_file_catching_errors().
+    """
+    file, fullpath, output, process_kwargs, collect_metrics, output_sink = task
+    try:
+        payload = save_processed_image(img=img, image_cropped=image_cropped, fullpath=fullpath, new_fullpath=output,
+                                       metrics=metrics, output_sink=output_sink)
+    except Exception as e:
+        return file, output, type(e).__name__ + ": " + str(e), None, None
+    return file, output, None, metrics.to_dict() if collect_metrics else None, payload
+
+def process_image_files_pipelined(tasks, io_threads=2, max_queued_images=8):
+    """
+    Process the tasks of get_image_tasks() in three overlapped stages instead of one after another: a pool of
+    io_threads threads reads and decodes the next files ahead, the current thread crops and resizes them, and another
+    pool of io_threads threads encodes and writes the results behind. Pillow releases the GIL while decoding,
+    resizing and encoding, so the disk (or network storage) and the CPU are used at the same time in one process.
+
+    At most max_queued_images decoded images wait to be cropped and at most max_queued_images processed images wait
+    to be written, so the memory used is bounded when one stage is slower than the others.
+
+    Args:
+        tasks: iterable of tasks of get_image_tasks(). It is only consumed by the current thread.
+        io_threads: Number of threads of the read-ahead pool and of the write-behind pool.
+        max_queued_images: Maximum number of images waiting in each stage.
+
+    Returns: Yield the same tuples as _process_image_file_catching_errors(), in the order of the tasks.
+
+    """
+    if io_threads < 1 or max_queued_images < 1:
+        raise ValueError("'io_threads' and 'max_queued_images' have to be > 0.")
+    tasks = iter(tasks)
+    read_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="read")
+    write_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="write")
+    reads, writes = deque(), deque()
+    try:
+        for task in tasks:
+            reads.append(read_executor.submit(_read_image_task, task))
+            if len(reads) >= max_queued_images:
+                break
+        while reads:
+            task, metrics, img, area, error = reads.popleft().result()
+            # A file is read ahead for each one taken from the queue
+            next_task = next(tasks, None)
+            if next_task is not None:
+                reads.append(read_executor.submit(_read_image_task, next_task))
+            if error is not None:
+                yield task[0], task[2], error, None, None
+                continue
+            # The area of the task is replaced by the one returned by decode_image_file()
+            crop_kwargs = {key: value for key, value in task[3].items()
+                           if key not in ("detection_tolerance", "area")}
+            try:
+                img, image_cropped = crop_and_resize_image(img=img, area=area, metrics=metrics, **crop_kwargs)
+            except Exception as e:
+                yield task[0], task[2], type(e).__name__ + ": " + str(e), None, None
+                continue
+            writes.append(write_executor.submit(_write_image_task, task, metrics, img, image_cropped))
+            while len(writes) > max_queued_images or (writes and writes[0].done()):
+                yield writes.popleft().result()
+        while writes:
+            yield writes.popleft().result()
+    finally:
+        # If the loop is interrupted, the queued reads are cancelled but the running writes are finished
+        read_executor.shutdown(wait=True, cancel_futures=True)
+        write_executor.shutdown(wait=True)
+
+def update_progress_total(progress, count_future):
+    """
+    Set the total of a Prints.ProgressReporter once the files counted in the background are counted.
+
+    Args:
+        progress: Prints.ProgressReporter.
+        count_future: (Optional) concurrent.futures.Future of the count_files() call.
+
+    Returns: count_future if the count has not finished yet, else None. A count that failed leaves no total.
+
+    """
+    if count_future is None or not count_future.done():
+        return count_future
+    if count_future.exception() is None:
+        progress.total = count_future.result()
+    return None
+
+def get_image_results(tasks, pool=None, chunksize=1, io_threads=0, max_queued_images=8):
+    """
+    Process the tasks of get_image_tasks() in the mode chosen by remove_black_pixels_of_image_path_v3(): in a
+    WorkerPool if pool is given, else pipelined if io_threads > 0 (see process_image_files_pipelined()), else serially.
+
+    Returns: Yield the same tuples as _process_image_file_catching_errors(). With a pool, in the order they finish.
+
+    """
+    if pool is None and io_threads:
+        return process_image_files_pipelined(tasks=tasks, io_threads=io_threads, max_queued_images=max_queued_images)
+    if pool is None:
+        return map(_process_image_file_catching_errors, tasks)
+    # The errors of the files are caught by _process_image_file_catching_errors(), so the pool only reports the tasks
+    # that timed out or killed their worker
+    return (result if error is None else (task[0], task[2], error, None, None)
+            for task, result, error in pool.imap(_process_image_file_catching_errors, tasks, chunksize=chunksize,
+                                                 ordered=False))
+
 def remove_black_pixels_of_image_path_v3(path, resize_dimensions=None, keep_aspect_ratio=False, force_dimensions=False,
+                                         detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0, workers=1,
+                                         chunksize=1, recursive=False, patterns=None, count_total=True, resume=True,
+                                         sequence_mode=None, sequence_sample_size=5, sequence_revalidate_every=250,
+                                         metrics=None, output_mode="files", shard_max_bytes=DEFAULT_SHARD_MAX_BYTES,
+                                         io_threads=0, max_queued_images=8, resampling=DEFAULT_RESAMPLING,
+                                         task_timeout=None, task_retries=0, progress_callback=None, stop_event=None,
+                                         use_crop_box_index=False, shard_index=None, shard_count=1, memory_budget=None,
                                          **kwargs):
     """
     From the path to the image folder, create a new nested folder with the same name as the image
     folder + '_removed_pixels'.
     Iterate over the image folder to process only the image files and do nothing if a non image file is found.
+    The folder is read as a stream (see DirectoryScanner.scan_files()), so the work starts with the first file found.
     Convert the images to numpy arrays and found the black border area to be cropped.
     Save the cropped images to the new folder created, without modifying the original images.
 
@@ -165,54 +1341,576 @@ def remove_black_pixels_of_image_path_v3(path, resize_dimensions=None, keep_aspe
 
         force_dimensions: True if we want save the image with a specific resolution.
 
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+
+        detection_tolerance: If > 0, the black border is found in a reduced decoding of each image, with this maximum
+        error in pixels. See get_cropped_image_from_file().
+
+        workers: Number of processes used to process the images. If 1, images are processed serially in the current
+        process. If None, the number of CPUs is used.
+
+        chunksize: Number of files sent to a worker process at once when workers != 1.
+
+        task_timeout: (Optional) When workers != 1, maximum seconds the processing of one file can take. The worker
+        process of a file that takes longer (e.g. a hung decoder) is killed and the file is reported as a failure.
+
+        task_retries: When workers != 1, number of times a file whose worker timed out or died is tried again.
+
+        recursive: True to process the subfolders too. The output folder mirrors the input tree.
+
+        patterns: (Optional) glob patterns, ignoring the case, the file names have to match, e.g. ("frame_*",).
+
+        count_total: True to count the image files, to show the progress percent and ETA. They are counted in a
+        background thread while the first files are processed (except for the "npy" output mode, which needs the
+        count before starting), so the total is shown once the count finishes. If False, only the number of
+        processed files is shown, which avoids a full extra scan of huge folders.
+
+        resume: True to keep a manifest (see Manifest.ProcessingManifest) inside the new folder and skip the files
+        already processed with the same parameters whose size and modification time did not change. If False,
+        every file is processed and the manifest is not used.
+
+        sequence_mode: (Optional) "folder" or "prefix" when the images are frames of videos whose black border does
+        not change. The crop box is estimated once for each sequence of frames (each folder or each file name prefix
+        in a folder) and applied to all its frames. See FrameSequences.SequenceCropBoxCache.
+
+        sequence_sample_size: Number of frames of each sequence used to estimate its crop box.
+
+        sequence_revalidate_every: Number of frames between two checks of the crop box of a sequence.
+
+        metrics: (Optional) A Metrics.PipelineMetrics where the stage timings, bytes and dimensions of every processed
+        file are added. Use it to print or export the percentiles after the run.
+
+        output_mode: One of OutputSinks.OUTPUT_MODES, how the images are written inside the new folder:
+                - "files": each image is saved as a file with its original name, in the format of its extension.
+                - "npy": every image is written as one row of a memory mapped <folder name>.npy array with the shape
+                (N, height, width, 3) and a <folder name>_index.csv index that maps each row to its source file.
+                Every image must have the same size, so it needs resize_dimensions and force_dimensions=True. The
+                array is created again in each run, so resume is not used.
+                - "tar": the images are appended to size capped tar shards (shard-000000.tar, ...) with a
+                shards_index.csv index, instead of one file per image. Read them with OutputSinks.iter_tar_shards().
+                The shards are written again in each run, replacing the previous ones, so resume is not used.
+
+        shard_max_bytes: Maximum size of each tar shard when output_mode is "tar".
+
+        io_threads: If > 0 and workers is 1, the images are processed in pipelined mode (see
+        process_image_files_pipelined()): this number of threads read the next files ahead and the same number write
+        the results behind, while the current process crops and resizes. Useful when the images are in slow or network
+        storage.
+
+        max_queued_images: Maximum number of images waiting to be processed or written in pipelined mode.
+
+        resampling: One of RESAMPLING_PRESETS, the quality/speed of the resize. See
+        change_image_resolution_from_PIL_image().
+
+        progress_callback: (Optional) function called as progress_callback(count, total) after each file, with the
+        number of files done (processed, failed or skipped) and the total (None until it is counted). E.g. to
+        show the progress in a UI.
+
+        stop_event: (Optional) A threading.Event. If it is set, the batch stops after the current file, keeping
+        everything written until then (and the manifest, so it can be resumed).
+
+        use_crop_box_index: True to process the files of the crop box index written inside the new folder by
+        analyze_black_pixels_of_image_path() with their crop boxes, instead of scanning the folder and searching the
+        borders again. The files changed or removed since the analysis are reported as failures, and the files added
+        since then, patterns and recursive are ignored. detection_engine and detection_tolerance are not used.
+
+        shard_index: (Optional) Only process the files of this shard, from 0 to shard_count - 1, so shard_count
+        processes or machines sharing the storage can each process a disjoint part of the folder without
+        coordinating. Files are assigned by a hash of their relative path (see DirectoryScanner.get_shard_index()).
+        Each shard writes its own manifest, and with the "npy" and "tar" output modes its own array or shards and
+        index, named after DirectoryScanner.get_shard_name(). Once every shard has finished, check the outputs with
+        merge_shard_outputs().
+
+        shard_count: Number of shards the folder is split into when shard_index is given.
+
+        memory_budget: (Optional) Maximum bytes of each decoded image. Bigger images (e.g. huge scans) switch to the
+        large image mode of decode_large_image_file(), which decodes them reduced to fit. Each worker process or
+        read-ahead thread decodes one image at a time, so the peak memory is about workers (or io_threads +
+        max_queued_images) times the budget.
+
         kwargs: kwargs can contain:
-                - "DEBUG": means if the current status is Debugging
+                - "DEBUG": means if the current status is Debugging. It always runs serially.
+
+    Returns: failures, a list of tuples (file, error message) with the files that could not be processed. file is the
+    path relative to the images path.
     """
 
     DEBUG = True if "DEBUG" in kwargs else False
+    # Checked before any work: crop_image_by_black_pixels() would catch the error and save every image uncropped
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError("'output_mode' has to be one of " + str(OUTPUT_MODES) + ".")
+    if output_mode == "npy" and not (resize_dimensions and force_dimensions):
+        raise ValueError("'output_mode' npy needs 'resize_dimensions' and 'force_dimensions' to be set.")
+    if use_crop_box_index and sequence_mode:
+        raise ValueError("'use_crop_box_index' and 'sequence_mode' can not be used together.")
+    check_shard(shard_index, shard_count)
+    shard_name = get_shard_name(shard_index, shard_count) if shard_index is not None else None
     print("Creating folder...")
     # Step 1: Creating the new nested folder
     new_folder_name = create_nested_directory_from_path_v1(path=path)
     print("Folder created!")
     print("Executing...")
-    # Step 2: Iterating over all the files in the image folder and processing it
-
-    all_files = os.listdir(path)
-    total_files = len(all_files)
-    for count_number, file in enumerate(all_files):
-        show_percent_by_total(total=total_files, count_number=count_number)
-        new_fullpath = new_folder_name + file # Fullpath of each file in directory
-        # Processing only those with the given suffixes
-        if file.endswith((".jpeg", ".jpg", ".png")):
-            image_cropped = None
-            if not force_dimensions:
-                # Converting the image to numpy array and resizing if arguments given, keeping the original aspect ratio
-                img, image_array = get_image_array(fullpath=path + os.sep + file,
-                                                   resize_dimensions=resize_dimensions,
-                                                   keep_aspect_ratio=keep_aspect_ratio)
-                # Cropping the image, catching exeptions if the image cropping fail
-                image_cropped = crop_image_from_image_array_by_black_pixels(image=img, image_array=image_array)
+    # Step 2: Iterating over all the image files in the image folder and processing it
+    # Processing only those with the given suffixes
+    scan_kwargs = dict(path=path, extensions=IMAGE_EXTENSIONS, patterns=patterns, recursive=recursive,
+                       exclude_paths=(new_folder_name,), shard_index=shard_index, shard_count=shard_count)
+    failures = []
+    crop_box_index = None
+    if use_crop_box_index:
+        crop_box_index = CropBoxIndex(fullpath=new_folder_name + CropBoxIndex.FILE_NAME)
+        if not len(crop_box_index):
+            raise ValueError("No crop box index found in " + new_folder_name + ". Run "
+                             "analyze_black_pixels_of_image_path() first.")
+        image_files = []
+        for file in crop_box_index:
+            if shard_index is not None and get_shard_index(file, shard_count) != shard_index:
+                continue
+            if crop_box_index.is_up_to_date(file=file, fullpath=path + os.sep + file):
+                image_files.append(file)
             else:
-                img, image_array = get_image_array(fullpath=path + os.sep + file)
-                image_cropped = crop_image_from_image_array_by_black_pixels(image=img, image_array=image_array)
-                image_cropped, image_array = change_image_resolution_from_PIL_image(img=image_cropped,
-                                                                                   resize_dimensions=resize_dimensions,
-                                                                                   keep_aspect_ratio=keep_aspect_ratio)
-            if DEBUG:
-                print("img.size", image_cropped.size)
-                image_cropped.show()
-                input("Click for next iteration")
-                # return image_cropped
-
+                failures.append((file, "ValueError: the file changed or was removed since it was analyzed"))
+        total_files = len(image_files)
+    else:
+        image_files = scan_files(**scan_kwargs)
+        # The npy array has one row per file, so it needs the count before starting
+        total_files = count_files(**scan_kwargs) if output_mode == "npy" else None
+    count_executor = ThreadPoolExecutor(max_workers=1) if count_total and total_files is None else None
+    count_future = count_executor.submit(count_files, **scan_kwargs) if count_executor is not None else None
+    process_kwargs = dict(resize_dimensions=resize_dimensions,
+                          keep_aspect_ratio=keep_aspect_ratio,
+                          force_dimensions=force_dimensions,
+                          detection_engine=detection_engine,
+                          detection_tolerance=detection_tolerance,
+                          resampling=resampling,
+                          memory_budget=memory_budget)
 
+    if DEBUG:
+        for file in image_files:
+            img, image_cropped = get_cropped_image_from_file(fullpath=path + os.sep + file, **process_kwargs)
+            print("img.size", image_cropped.size)
+            image_cropped.show()
+            input("Click for next iteration")
+    else:
+        # Step 3: Save the cropped images
+        if output_mode == "npy":
+            npy_name = Path(path).name + ("." + shard_name if shard_name else "")
+            output_sink = NpyMemmapSink(fullpath=new_folder_name + npy_name + ".npy", count=total_files,
+                                        size=resize_dimensions)
+            resume = False
+        elif output_mode == "tar":
+            if shard_name:
+                output_sink = TarShardSink(folder=new_folder_name, max_shard_bytes=shard_max_bytes, prefix=shard_name,
+                                           index_name=shard_name + "_" + SHARD_INDEX_NAME)
             else:
-                # Step 3: Save the cropped images
-                if image_cropped:
-                    image_cropped.save(new_fullpath, "JPEG")
-                else:
-                    # If crop fail save the original image
-                    img.save(new_folder_name + file, "JPEG")
+                output_sink = TarShardSink(folder=new_folder_name, max_shard_bytes=shard_max_bytes)
+            resume = False
         else:
-            continue
+            output_sink = DirectorySink(folder=new_folder_name)
+        manifest = None
+        if resume:
+            manifest_parameters = dict(process_kwargs)
+            if resampling == DEFAULT_RESAMPLING:
+                # Manifests written before the resampling presets existed stay valid
+                del manifest_parameters["resampling"]
+            if memory_budget is None:
+                del manifest_parameters["memory_budget"]
+            if sequence_mode:
+                manifest_parameters["sequence_mode"] = sequence_mode
+            if use_crop_box_index:
+                manifest_parameters["crop_box_index"] = True
+            manifest = ProcessingManifest(folder=new_folder_name, parameters=manifest_parameters,
+                                          file_name=".manifest." + shard_name + ".jsonl" if shard_name else None)
+        crop_box_cache = None
+        if sequence_mode:
+            crop_box_cache = SequenceCropBoxCache(detect_function=partial(get_crop_box_from_file,
+                                                                          detection_engine=detection_engine,
+                                                                          detection_tolerance=detection_tolerance),
+                                                  sample_size=sequence_sample_size,
+                                                  revalidate_every=sequence_revalidate_every,
+                                                  group_by=sequence_mode)
+        progress = ProgressReporter(total=total_files)
+
+        def add_task_failure(file, error):
+            # E.g. a file removed between the scan and its task
+            failures.append((file, error))
+            progress.update(1)
+
+        tasks = get_image_tasks(path=path, image_files=image_files, process_kwargs=process_kwargs,
+                                output_sink=output_sink, manifest=manifest, crop_box_cache=crop_box_cache,
+                                collect_metrics=metrics is not None, crop_box_index=crop_box_index,
+                                on_error=add_task_failure)
+        pool = WorkerPool(processes=workers, timeout=task_timeout, retries=task_retries) if workers != 1 else None
+        results = get_image_results(tasks=tasks, pool=pool, chunksize=chunksize, io_threads=io_threads,
+                                    max_queued_images=max_queued_images)
+        skipped = 0  # Files skipped by the manifest already added to the progress
+        try:
+            for file, output, error, file_metrics, payload in results:
+                if file_metrics is not None:
+                    metrics.add(file_metrics)
+                if error is None:
+                    output_sink.record(file=file, output=output, payload=payload)
+                done = 1
+                if manifest is not None:
+                    if error is None:
+                        manifest.mark_processed(file=file, output=output)
+                    else:
+                        manifest.discard(file=file)
+                    done += manifest.skipped - skipped
+                    skipped = manifest.skipped
+                count_future = update_progress_total(progress, count_future)
+                progress.update(done)
+                if error is not None:
+                    failures.append((file, error))
+                if progress_callback is not None:
+                    progress_callback(progress.count, progress.total)
+                if stop_event is not None and stop_event.is_set():
+                    print("Stopped.")
+                    break
+        finally:
+            if workers == 1 and io_threads:
+                # Stop the pipelined mode threads if the loop was interrupted
+                results.close()
+            if pool is not None:
+                # Every result has been consumed at this point unless the loop was interrupted
+                pool.terminate()
+            output_sink.close()
+            if count_executor is not None:
+                update_progress_total(progress, count_future)
+                count_executor.shutdown(wait=False, cancel_futures=True)
+            if manifest is not None:
+                manifest.close()
+                progress.update(manifest.skipped - skipped)
+            progress.close()
+            if manifest is not None:
+                print(str(manifest.skipped) + " files already up to date were skipped.")
+            if metrics is not None:
+                metrics.finish()
+
+    if failures:
+        print(str(len(failures)) + " files could not be processed:")
+        for file, error in failures:
+            print(file + " -> " + error)
     print("Finish!")
+    return failures
+
+def watch_black_pixels_of_image_path(path, resize_dimensions=None, keep_aspect_ratio=False, force_dimensions=False,
+                                     detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0, workers=1,
+                                     chunksize=1, recursive=False, patterns=None, poll_interval=2.0, settle_time=5.0,
+                                     io_threads=0, max_queued_images=8, resampling=DEFAULT_RESAMPLING,
+                                     task_timeout=None, task_retries=0, memory_budget=None, metrics=None,
+                                     stop_event=None):
+    """
+    Long running version of remove_black_pixels_of_image_path_v3() for a folder that keeps receiving new images,
+    instead of running it again and again (e.g. from cron), which starts the interpreter and the worker processes
+    and scans the whole folder each time.
+
+    The folder is polled every poll_interval seconds with a DirectoryScanner.FolderWatcher, which only lists again
+    the folders that changed and returns the new files once they have not changed for settle_time seconds (so files
+    still being copied are not read). Each group of new files is processed with the same pipeline and outputs
+    ("files" output mode) as remove_black_pixels_of_image_path_v3(), by a WorkerPool that stays alive between
+    groups. The files already processed (in the manifest of the new folder) are skipped, so the images found in the
+    first poll that were processed by previous runs are not processed again.
+
+    It runs until Ctrl-C or until stop_event is set.
+
+    Args:
+        path: images path
+        resize_dimensions: See remove_black_pixels_of_image_path_v3().
+        keep_aspect_ratio: See remove_black_pixels_of_image_path_v3().
+        force_dimensions: See remove_black_pixels_of_image_path_v3().
+        detection_engine: See remove_black_pixels_of_image_path_v3().
+        detection_tolerance: See remove_black_pixels_of_image_path_v3().
+        workers: See remove_black_pixels_of_image_path_v3().
+        chunksize: See remove_black_pixels_of_image_path_v3().
+        recursive: True to watch the subfolders too, including the new ones.
+        patterns: See remove_black_pixels_of_image_path_v3().
+        poll_interval: Seconds between two polls of the folder.
+        settle_time: Seconds the size and modification time of a new file have to stay the same before processing
+        it.
+        io_threads: See remove_black_pixels_of_image_path_v3().
+        max_queued_images: See remove_black_pixels_of_image_path_v3().
+        resampling: See remove_black_pixels_of_image_path_v3().
+        task_timeout: See remove_black_pixels_of_image_path_v3().
+        task_retries: See remove_black_pixels_of_image_path_v3().
+        memory_budget: See remove_black_pixels_of_image_path_v3().
+        metrics: See remove_black_pixels_of_image_path_v3().
+        stop_event: (Optional) A threading.Event that stops watching once the current group of files is processed.
 
+    Returns: failures, a list of tuples (file, error message) with the files that could not be processed.
+
+    """
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+    new_folder_name = create_nested_directory_from_path_v1(path=path)
+    process_kwargs = dict(resize_dimensions=resize_dimensions,
+                          keep_aspect_ratio=keep_aspect_ratio,
+                          force_dimensions=force_dimensions,
+                          detection_engine=detection_engine,
+                          detection_tolerance=detection_tolerance,
+                          resampling=resampling,
+                          memory_budget=memory_budget)
+    # The same manifest parameters as remove_black_pixels_of_image_path_v3(), so each one resumes the other
+    manifest_parameters = {key: value for key, value in process_kwargs.items()
+                           if not (key == "resampling" and value == DEFAULT_RESAMPLING)
+                           and not (key == "memory_budget" and value is None)}
+    watcher = FolderWatcher(path=path, extensions=IMAGE_EXTENSIONS, patterns=patterns, recursive=recursive,
+                            exclude_paths=(new_folder_name,), settle_time=settle_time)
+    output_sink = DirectorySink(folder=new_folder_name)
+    manifest = ProcessingManifest(folder=new_folder_name, parameters=manifest_parameters)
+    pool = WorkerPool(processes=workers, timeout=task_timeout, retries=task_retries) if workers != 1 else None
+    failures = []
+
+    def add_failure(file, error):
+        manifest.discard(file=file)
+        failures.append((file, error))
+        print(file + " -> " + error)
+
+    print("Watching " + path + " (Ctrl-C to stop)...")
+    try:
+        while stop_event is None or not stop_event.is_set():
+            try:
+                image_files = watcher.poll()
+            except OSError as e:
+                # E.g. the watched folder itself is not reachable for a while
+                print(time.strftime("%H:%M:%S") + " Could not poll " + path + ": " + str(e))
+                image_files = []
+            if image_files:
+                start = time.perf_counter()
+                skipped, failed = manifest.skipped, len(failures)
+                processed = 0
+                tasks = get_image_tasks(path=path, image_files=image_files, process_kwargs=process_kwargs,
+                                        output_sink=output_sink, manifest=manifest,
+                                        collect_metrics=metrics is not None, on_error=add_failure)
+                for file, output, error, file_metrics, payload in get_image_results(
+                        tasks=tasks, pool=pool, chunksize=chunksize, io_threads=io_threads,
+                        max_queued_images=max_queued_images):
+                    if file_metrics is not None:
+                        metrics.add(file_metrics)
+                    if error is None:
+                        output_sink.record(file=file, output=output, payload=payload)
+                        manifest.mark_processed(file=file, output=output)
+                        processed += 1
+                    else:
+                        add_failure(file, error)
+                print(time.strftime("%H:%M:%S") + " " + str(processed) + " files processed, " +
+                      str(len(failures) - failed) + " failed and " + str(manifest.skipped - skipped) +
+                      " already up to date in " + "{0:.2f}".format(time.perf_counter() - start) + " seconds. " +
+                      str(watcher.pending) + " files settling.")
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        if pool is not None:
+            pool.terminate()
+        output_sink.close()
+        manifest.close()
+        if metrics is not None:
+            metrics.finish()
+    return failures
+
+def merge_shard_outputs(path, shard_count, recursive=False, patterns=None, output_mode="files"):
+    """
+    Merge and verify the outputs of a batch split with the shard_index and shard_count of
+    remove_black_pixels_of_image_path_v3(), once every shard has finished.
+
+    The manifests of the shards are merged into the manifest of the folder, so a later run without shards resumes
+    from them, and with the "tar" output mode the indexes of the shards are merged into one SHARD_INDEX_NAME index
+    for OutputSinks.read_from_tar_shards(). Then every image of the folder is checked to have its output.
+
+    Args:
+        path: images path
+        shard_count: Number of shards the batch was split into.
+        recursive: See remove_black_pixels_of_image_path_v3().
+        patterns: See remove_black_pixels_of_image_path_v3().
+        output_mode: The output mode of the batch. See remove_black_pixels_of_image_path_v3().
+
+    Returns: missing, a list of tuples (file, shard_index) with the files whose output is missing, and the shard that
+    had to process them.
+
+    """
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError("'output_mode' has to be one of " + str(OUTPUT_MODES) + ".")
+    check_shard(None, shard_count)
+    new_folder_name = create_nested_directory_from_path_v1(path=path)
+    shard_names = [get_shard_name(shard_index, shard_count) for shard_index in range(shard_count)]
+
+    # Merge the manifests, appending their lines: the last line of a file in the manifest is the valid one
+    with open(new_folder_name + ProcessingManifest.FILE_NAME, "a", encoding="utf-8") as manifest_file:
+        for shard_name in shard_names:
+            shard_manifest_fullpath = new_folder_name + ".manifest." + shard_name + ".jsonl"
+            if os.path.exists(shard_manifest_fullpath):
+                with open(shard_manifest_fullpath, encoding="utf-8") as shard_manifest_file:
+                    for line in shard_manifest_file:
+                        if line.endswith("\n"):  # A last line cut by a crash is not copied
+                            manifest_file.write(line)
+
+    # The outputs written by each shard
+    if output_mode == "files":
+        outputs = None
+    elif output_mode == "tar":
+        outputs = set()
+        with open(new_folder_name + SHARD_INDEX_NAME, "w", newline="") as index_file:
+            writer = None
+            for shard_name in shard_names:
+                shard_index_fullpath = new_folder_name + shard_name + "_" + SHARD_INDEX_NAME
+                if not os.path.exists(shard_index_fullpath):
+                    continue
+                with open(shard_index_fullpath, newline="") as shard_index_file:
+                    reader = csv.DictReader(shard_index_file)
+                    if writer is None:
+                        writer = csv.DictWriter(index_file, fieldnames=reader.fieldnames)
+                        writer.writeheader()
+                    for row in reader:
+                        writer.writerow(row)
+                        outputs.add(row["file"])
+    else:
+        outputs = set()
+        for shard_name in shard_names:
+            shard_index_fullpath = new_folder_name + Path(path).name + "." + shard_name + "_index.csv"
+            if os.path.exists(shard_index_fullpath):
+                with open(shard_index_fullpath, newline="") as shard_index_file:
+                    outputs.update(row["file"] for row in csv.DictReader(shard_index_file))
+
+    missing = []
+    for file in scan_files(path=path, extensions=IMAGE_EXTENSIONS, patterns=patterns, recursive=recursive,
+                           exclude_paths=(new_folder_name,)):
+        if (file not in outputs) if outputs is not None else not os.path.exists(new_folder_name + file):
+            missing.append((file, get_shard_index(file, shard_count)))
+    if missing:
+        print(str(len(missing)) + " files have no output:")
+        for shard_index, shard_name in enumerate(shard_names):
+            shard_missing = sum(1 for _, file_shard_index in missing if file_shard_index == shard_index)
+            if shard_missing:
+                print(shard_name + " -> " + str(shard_missing) + " files")
+    else:
+        print("Every file has its output.")
+    return missing
+
+def analyze_image_file(fullpath, detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0):
+    """
+    Find the crop box and read the metadata of an image file, for a CropBoxIndex.CropBoxIndex. The size and mtime
+    are read before the image, so a file changed while it is analyzed is not up to date in the index.
+
+    Args:
+        fullpath: fullpath of image
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+        detection_tolerance: See get_crop_box_from_file().
+
+    Returns: A dict with the arguments of CropBoxIndex.add() except file.
+
+    """
+    stat = os.stat(fullpath)
+    with Image.open(fullpath) as img:
+        width, height = img.size
+        mode, image_format = img.mode, img.format
+    area = get_crop_box_from_file(fullpath=fullpath, detection_engine=detection_engine,
+                                  detection_tolerance=detection_tolerance)
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, width=width, height=height, mode=mode,
+                image_format=image_format, area=area)
+
+def _analyze_image_file_catching_errors(task):
+    """
+    Call analyze_image_file() with the task arguments and catch any error. Defined at module level to be picklable
+    by the process pool.
+
+    Args:
+        task: a tuple (file, fullpath, analyze_kwargs)
+
+    Returns: file, entry, error. entry is the dict returned by analyze_image_file(), or None if error is not None.
+
+    """
+    file, fullpath, analyze_kwargs = task
+    try:
+        return file, analyze_image_file(fullpath=fullpath, **analyze_kwargs), None
+    except Exception as e:
+        return file, None, type(e).__name__ + ": " + str(e)
+
+def analyze_black_pixels_of_image_path(path, detection_engine=DEFAULT_DETECTION_ENGINE, detection_tolerance=0,
+                                       workers=1, chunksize=1, recursive=False, patterns=None, count_total=True,
+                                       resume=True, task_timeout=None, task_retries=0):
+    """
+    First phase of a two phase run: find the crop box of every image of the folder, in parallel, and write it with
+    the image metadata to a CropBoxIndex.CropBoxIndex inside the same new folder remove_black_pixels_of_image_path_v3()
+    uses. Nothing else is written.
+    The second phase is remove_black_pixels_of_image_path_v3() with use_crop_box_index=True, which can be run any
+    number of times (e.g. with other resize settings or output modes) without searching the borders again.
+
+    Args:
+        path: images path
+        detection_engine: One of DETECTION_ENGINES, the way the black border is found.
+        detection_tolerance: See get_crop_box_from_file().
+        workers: Number of processes used to analyze the images. If 1, images are analyzed serially in the current
+        process. If None, the number of CPUs is used.
+        chunksize: Number of files sent to a worker process at once when workers != 1.
+        recursive: True to analyze the subfolders too.
+        patterns: (Optional) glob patterns, ignoring the case, the file names have to match.
+        count_total: See remove_black_pixels_of_image_path_v3().
+        resume: True to keep the entries of the files already analyzed whose size and mtime did not change, and only
+        analyze the others. If False, the index is written again from scratch, e.g. to use another detection_engine.
+        task_timeout: See remove_black_pixels_of_image_path_v3().
+        task_retries: See remove_black_pixels_of_image_path_v3().
+
+    Returns: failures, a list of tuples (file, error message) with the files that could not be analyzed.
+
+    """
+    if detection_engine not in DETECTION_ENGINES:
+        raise ValueError("'detection_engine' has to be one of " + str(DETECTION_ENGINES) + ".")
+    new_folder_name = create_nested_directory_from_path_v1(path=path)
+    print("Analyzing...")
+    scan_kwargs = dict(path=path, extensions=IMAGE_EXTENSIONS, patterns=patterns, recursive=recursive,
+                       exclude_paths=(new_folder_name,))
+    count_executor = ThreadPoolExecutor(max_workers=1) if count_total else None
+    count_future = count_executor.submit(count_files, **scan_kwargs) if count_total else None
+    analyze_kwargs = dict(detection_engine=detection_engine, detection_tolerance=detection_tolerance)
+    crop_box_index = CropBoxIndex(fullpath=new_folder_name + CropBoxIndex.FILE_NAME, reset=not resume)
+    progress = ProgressReporter()
+    skipped = 0
+    failures = []
+
+    def get_tasks():
+        nonlocal skipped
+        for file in scan_files(**scan_kwargs):
+            fullpath = path + os.sep + file
+            if resume and crop_box_index.is_up_to_date(file=file, fullpath=fullpath):
+                skipped += 1
+                progress.update(1)
+                continue
+            yield file, fullpath, analyze_kwargs
+
+    pool = None
+    if workers == 1:
+        results = map(_analyze_image_file_catching_errors, get_tasks())
+    else:
+        pool = WorkerPool(processes=workers, timeout=task_timeout, retries=task_retries)
+        results = (result if error is None else (task[0], None, error)
+                   for task, result, error in pool.imap(_analyze_image_file_catching_errors, get_tasks(),
+                                                        chunksize=chunksize, ordered=False))
+    try:
+        for file, entry, error in results:
+            if error is None:
+                crop_box_index.add(file=file, **entry)
+            else:
+                failures.append((file, error))
+            count_future = update_progress_total(progress, count_future)
+            progress.update(1)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        crop_box_index.close()
+        if count_executor is not None:
+            update_progress_total(progress, count_future)
+            count_executor.shutdown(wait=False, cancel_futures=True)
+        progress.close()
+    if skipped:
+        print(str(skipped) + " files already analyzed were skipped.")
+    if failures:
+        print(str(len(failures)) + " files could not be analyzed:")
+        for file, error in failures:
+            print(file + " -> " + error)
+    print("Finish!")
+    return failures
@@ -0,0 +1,214 @@
+import zlib
+import struct
+import threading
+from contextlib import contextmanager, nullcontext
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PIL mode of the PNG color types that can be read in strips, with 8 bits per channel or palette index
+PNG_STRIP_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+# Bytes read from the file and inflated at once
+PNG_READ_BYTES = 1024 ** 2
+# Image.MAX_IMAGE_PIXELS saved while some thread is inside unlimited_image_pixels(), and how many threads are
+_unlimited_image_pixels_lock = threading.Lock()
+_unlimited_image_pixels_users = 0
+_saved_max_image_pixels = None
+
+
+def get_decoded_bytes(size, mode):
+    """
+    Returns: The bytes a decoded PIL image of size (width, height) and mode uses.
+    """
+    return size[0] * size[1] * Image.getmodebands(mode)
+
+def get_budget_scale(size, mode, memory_budget):
+    """
+    Get the smallest integer reduction factor that makes a decoded image fit in memory_budget.
+
+    Args:
+        size: (width, height) of the full resolution image.
+        mode: PIL mode of the image.
+        memory_budget: Maximum bytes of the decoded image.
+
+    Returns: The reduction factor, 1 if the full resolution image fits.
+
+    """
+    scale = 1
+    while get_decoded_bytes((-(-size[0] // scale), -(-size[1] // scale)), mode) > memory_budget \
+            and scale < max(size):
+        scale += 1
+    return scale
+
+@contextmanager
+def unlimited_image_pixels():
+    """
+    Open images bigger than Image.MAX_IMAGE_PIXELS inside the with block, instead of raising DecompressionBombError.
+    Only used when a memory budget already keeps the decoded images small, so keep the block to the Image.open()
+    call. Image.MAX_IMAGE_PIXELS is global, so it is also lifted for other threads while the block runs. The blocks
+    of several threads can overlap: the limit is restored when the last one ends.
+    """
+    global _unlimited_image_pixels_users, _saved_max_image_pixels
+    with _unlimited_image_pixels_lock:
+        if _unlimited_image_pixels_users == 0:
+            _saved_max_image_pixels = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _unlimited_image_pixels_users += 1
+    try:
+        yield
+    finally:
+        with _unlimited_image_pixels_lock:
+            _unlimited_image_pixels_users -= 1
+            if _unlimited_image_pixels_users == 0:
+                Image.MAX_IMAGE_PIXELS = _saved_max_image_pixels
+
+def budget_image_pixels(memory_budget=None):
+    """
+    Context manager for the PIL calls that check Image.MAX_IMAGE_PIXELS (Image.open() and Image.crop()).
+
+    Args:
+        memory_budget: (Optional) If given, the budget, not Image.MAX_IMAGE_PIXELS, bounds the size images are
+        decoded to, so it is unlimited_image_pixels(). Otherwise it does nothing.
+    """
+    if memory_budget is None:
+        return nullcontext()
+    return unlimited_image_pixels()
+
+def open_image(fullpath, memory_budget=None):
+    """
+    Open (without loading) an image file, inside budget_image_pixels(memory_budget).
+
+    Returns: The PIL image.
+
+    """
+    with budget_image_pixels(memory_budget):
+        return Image.open(fullpath)
+
+def _iter_png_chunks(png_file):
+    """
+    Generator of the chunks of a PNG file, after its signature. The data of IDAT chunks is not read: their length is
+    yielded instead and the caller reads it before asking for the next chunk.
+    """
+    while True:
+        header = png_file.read(8)
+        if len(header) < 8:
+            raise ValueError("The PNG file is truncated.")
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IDAT":
+            yield chunk_type, length
+        else:
+            data = png_file.read(length)
+            yield chunk_type, data
+        png_file.seek(4, 1)  # CRC
+        if chunk_type == b"IEND":
+            return
+
+def read_png_header(fullpath):
+    """
+    Read the size and mode of a PNG file that can be read with iter_png_strips().
+
+    Args:
+        fullpath: fullpath of the PNG file.
+
+    Returns: width, height, mode.
+
+    """
+    with open(fullpath, "rb") as png_file:
+        if png_file.read(8) != PNG_SIGNATURE:
+            raise ValueError(fullpath + " is not a PNG file.")
+        chunk_type, data = next(_iter_png_chunks(png_file))
+    if chunk_type != b"IHDR":
+        raise ValueError("The PNG file has no IHDR chunk.")
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+    if bit_depth != 8 or color_type not in PNG_STRIP_MODES or interlace:
+        raise ValueError("Only non interlaced PNG files with 8 bits per channel or palette index can be read in "
+                         "strips.")
+    return width, height, PNG_STRIP_MODES[color_type]
+
+def read_png_palette(fullpath):
+    """
+    Read the palette of a PNG file, from the chunks before its image data.
+
+    Args:
+        fullpath: fullpath of the PNG file.
+
+    Returns: palette, transparency. The RGB bytes of the PLTE chunk and the alpha bytes of the tRNS chunk, or None
+    if the file has none.
+
+    """
+    palette, transparency = None, None
+    with open(fullpath, "rb") as png_file:
+        png_file.seek(len(PNG_SIGNATURE))
+        for chunk_type, data in _iter_png_chunks(png_file):
+            if chunk_type == b"IDAT":
+                break
+            if chunk_type == b"PLTE":
+                palette = data
+            elif chunk_type == b"tRNS":
+                transparency = data
+    return palette, transparency
+
+def iter_png_strips(fullpath, strip_rows):
+    """
+    Decode a PNG file a strip of rows at a time, so only one strip is in memory instead of the whole image.
+
+    The image data is inflated as it is read, and each strip is unfiltered by the PIL "zip" decoder, with the last
+    row of the previous strip prepended as an unfiltered row, because the PNG filters of a row depend on the row
+    above it. The strips are the same rows as decoding the whole image. The strips of palette images are P images
+    with the palette (and transparency) of the file.
+
+    Args:
+        fullpath: fullpath of the PNG file. See read_png_header() for the PNG files supported.
+        strip_rows: Number of rows of each strip. The last strip can have less.
+
+    Returns: Yield top, strip. The first row of each strip and the strip as a PIL image.
+
+    """
+    width, height, mode = read_png_header(fullpath)
+    palette, transparency = read_png_palette(fullpath) if mode == "P" else (None, None)
+    row_bytes = 1 + width * Image.getmodebands(mode)  # Filter type byte + pixels
+    strip_bytes = strip_rows * row_bytes
+    inflater = zlib.decompressobj()
+    buffer = bytearray()
+    previous_row = None
+    top = 0
+
+    def decode_strip(data):
+        nonlocal previous_row, top
+        rows = len(data) // row_bytes
+        if previous_row is not None:
+            data = b"\0" + previous_row + data
+        strip = Image.frombytes(mode, (width, rows + (previous_row is not None)), zlib.compress(data, 0), "zip",
+                                mode)
+        if previous_row is not None:
+            strip = strip.crop((0, 1, width, strip.height))
+        previous_row = strip.crop((0, strip.height - 1, width, strip.height)).tobytes()
+        if palette is not None:
+            strip.putpalette(palette)
+        if transparency is not None:
+            strip.info["transparency"] = transparency
+        strip_top = top
+        top += rows
+        return strip_top, strip
+
+    with open(fullpath, "rb") as png_file:
+        png_file.seek(len(PNG_SIGNATURE))
+        for chunk_type, length in _iter_png_chunks(png_file):
+            if chunk_type != b"IDAT":
+                continue
+            while length > 0:
+                data = png_file.read(min(length, PNG_READ_BYTES))
+                length -= len(data)
+                while data:
+                    # The inflated bytes are bounded, the compressed bytes left are inflated in the next loop
+                    buffer += inflater.decompress(data, strip_bytes)
+                    data = inflater.unconsumed_tail
+                    while len(buffer) >= strip_bytes and top + strip_rows <= height:
+                        yield decode_strip(bytes(buffer[:strip_bytes]))
+                        del buffer[:strip_bytes]
+    buffer += inflater.flush()
+    while top < height:
+        rows = min(strip_rows, height - top)
+        if len(buffer) < rows * row_bytes:
+            raise ValueError("The PNG file is truncated.")
+        yield decode_strip(bytes(buffer[:rows * row_bytes]))
+        del buffer[:rows * row_bytes]
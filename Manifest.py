@@ -0,0 +1,124 @@
+import os
+import json
+
+
+class ProcessingManifest:
+    """
+    A record, stored inside an output folder, of the source files already processed into it and how they were
+    processed. It lets a batch skip the files whose output is up to date.
+
+    The manifest is a JSON lines file where each processed file appends one line, so a batch that dies halfway keeps
+    everything processed until then. If a file appears more than once, its last line is the valid one.
+    """
+    FILE_NAME = ".manifest.jsonl"
+
+    def __init__(self, folder, parameters, file_name=None):
+        """
+        Load the manifest of folder, if it exists, and open it to append new entries.
+
+        Args:
+            folder: The output folder where the manifest is stored.
+            parameters: A dict with the parameters used to process the files. A file processed with other parameters
+            is not up to date.
+            file_name: (Optional) Name of the manifest file instead of FILE_NAME, e.g. one for each shard of a batch
+            split across machines, so they never write the same file.
+        """
+        self.fullpath = os.path.join(folder, file_name or self.FILE_NAME)
+        # Round trip through JSON so tuples compare equal to the lists loaded from the file
+        self.parameters = json.loads(json.dumps(parameters))
+        self.__entries = {}
+        self.__pending = {}
+        self.skipped = 0  # Files found up to date by should_process()
+        lines, cut_line = self.__load()
+        if lines > 2 * len(self.__entries) or cut_line:
+            # Also drops the line cut by a crash, so the new entries are not appended to it
+            self.__compact()
+        self.__file = open(self.fullpath, "a", encoding="utf-8")
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __load(self):
+        """
+        Read the entries of the manifest file, ignoring a last line cut by a crash.
+
+        Returns: lines, cut_line. The number of lines read, and True if the last one has no line break.
+
+        """
+        lines = 0
+        cut_line = False
+        if os.path.exists(self.fullpath):
+            with open(self.fullpath, encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    lines += 1
+                    cut_line = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.__entries[entry["file"]] = entry
+        return lines, cut_line
+
+    def __compact(self):
+        """
+        Rewrite the manifest file with only the valid line of each file.
+        """
+        temporal_fullpath = self.fullpath + ".tmp"
+        with open(temporal_fullpath, "w", encoding="utf-8") as manifest_file:
+            for entry in self.__entries.values():
+                manifest_file.write(json.dumps(entry) + "\n")
+        os.replace(temporal_fullpath, self.fullpath)
+
+    def should_process(self, file, fullpath):
+        """
+        Check if a source file is new or changed since it was processed, or if it was processed with other
+        parameters or its output is missing. If it has to be processed, its size and mtime are kept until
+        mark_processed() is called.
+
+        Args:
+            file: The source file path relative to the input folder. It is the key of the manifest.
+            fullpath: The fullpath of the source file.
+
+        Returns: True if the file has to be processed.
+
+        """
+        stat = os.stat(fullpath)
+        entry = self.__entries.get(file)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns \
+                and entry["parameters"] == self.parameters and os.path.exists(entry["output"]):
+            self.skipped += 1
+            return False
+        self.__pending[file] = (stat.st_size, stat.st_mtime_ns)
+        return True
+
+    def mark_processed(self, file, output):
+        """
+        Record that a file returned True by should_process() has been processed successfully.
+
+        Args:
+            file: The source file path relative to the input folder.
+            output: The path where the processed file was saved.
+        """
+        size, mtime_ns = self.__pending.pop(file)
+        entry = dict(file=file, size=size, mtime_ns=mtime_ns, parameters=self.parameters, output=output)
+        self.__entries[file] = entry
+        self.__file.write(json.dumps(entry) + "\n")
+        self.__file.flush()
+
+    def discard(self, file):
+        """
+        Forget a file returned True by should_process() that could not be processed.
+
+        Args:
+            file: The source file path relative to the input folder.
+        """
+        self.__pending.pop(file, None)
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,147 @@
+import csv
+import json
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# Stages of the processing of each image, in order
+STAGES = ("decode", "detect", "crop", "resize", "encode")
+# Values of each file aggregated by PipelineMetrics.get_summary(), besides the stage timings
+FILE_VALUES = ("total", "bytes_read", "bytes_written", "width", "height", "output_width", "output_height")
+PERCENTILES = (50, 90, 99)
+
+
+class FileMetrics:
+    """
+    Timings of each stage (see STAGES), bytes read and written and dimensions of the processing of one image file.
+    """
+
+    def __init__(self, file):
+        """
+        Args:
+            file: file path relative to the images path.
+        """
+        self.file = file
+        self.timings = dict.fromkeys(STAGES, 0.)
+        self.bytes_read = None
+        self.bytes_written = None
+        self.width = None
+        self.height = None
+        self.output_width = None
+        self.output_height = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that adds the time spent inside it to the stage name.
+
+        Args:
+            name: One of STAGES.
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def to_dict(self):
+        """
+        Returns: A flat dict with the file, the seconds of each stage and the total, and the other values.
+        """
+        file_metrics = dict(file=self.file)
+        file_metrics.update(self.timings)
+        file_metrics.update(total=sum(self.timings.values()), bytes_read=self.bytes_read,
+                            bytes_written=self.bytes_written, width=self.width, height=self.height,
+                            output_width=self.output_width, output_height=self.output_height)
+        return file_metrics
+
+def measure_stage(metrics, name):
+    """
+    Time a stage if metrics are being recorded.
+
+    Args:
+        metrics: A FileMetrics or None.
+        name: One of STAGES.
+
+    Returns: A context manager. It does nothing if metrics is None.
+
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(name)
+
+class PipelineMetrics:
+    """
+    The metrics of every file of a batch, aggregated into percentiles at the end of the run and exportable as CSV or
+    JSON.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.start_time = time.time()
+        self.end_time = None
+
+    def add(self, file_metrics):
+        """
+        Args:
+            file_metrics: A FileMetrics or the dict returned by FileMetrics.to_dict().
+        """
+        if isinstance(file_metrics, FileMetrics):
+            file_metrics = file_metrics.to_dict()
+        self.files.append(file_metrics)
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def get_summary(self):
+        """
+        Aggregate the metrics of every file.
+
+        Returns: A dict with the number of files, the wall time and, for each stage and value of FILE_VALUES, its
+        mean, sum, min, max and PERCENTILES.
+
+        """
+        end_time = self.end_time if self.end_time is not None else time.time()
+        wall_time = end_time - self.start_time
+        summary = dict(files=len(self.files), wall_time=wall_time,
+                       files_per_second=len(self.files) / wall_time if wall_time > 0 else None)
+        for name in STAGES + FILE_VALUES:
+            values = np.array([file_metrics[name] for file_metrics in self.files
+                               if file_metrics.get(name) is not None], dtype=np.float64)
+            if len(values) == 0:
+                continue
+            aggregated = dict(mean=float(values.mean()), sum=float(values.sum()), min=float(values.min()),
+                              max=float(values.max()))
+            for percentile in PERCENTILES:
+                aggregated["p" + str(percentile)] = float(np.percentile(values, percentile))
+            summary[name] = aggregated
+        return summary
+
+    def export_json(self, fullpath):
+        """
+        Write the summary and the metrics of each file to a JSON file.
+        """
+        with open(fullpath, "w") as json_file:
+            json.dump(dict(summary=self.get_summary(), files=self.files), json_file, indent=2)
+
+    def export_csv(self, fullpath):
+        """
+        Write the metrics of each file to a CSV file, one row per file.
+        """
+        fieldnames = ("file",) + STAGES + FILE_VALUES
+        with open(fullpath, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(self.files)
+
+    def print_summary(self):
+        """
+        Print the percentiles of each stage in milliseconds.
+        """
+        summary = self.get_summary()
+        print("Processed", summary["files"], "files in", "{0:.3f}".format(summary["wall_time"]), "seconds")
+        for name in STAGES + ("total",):
+            if name in summary:
+                print("{0:>8}: ".format(name) + " ".join("{0}={1:.2f}ms".format(key, summary[name][key] * 1000)
+                                                          for key in ("mean",) + tuple("p" + str(percentile)
+                                                                                      for percentile in PERCENTILES)))
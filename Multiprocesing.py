@@ -1,10 +1,272 @@
+import os
+import time
+import signal
+import multiprocessing
+from collections import deque
 from multiprocessing import Process
+from multiprocessing.connection import wait
+
+DEFAULT_POLL_INTERVAL = 0.1
 
 
 def print_func(continent='Asia', index=0):
     while True:
         print('The name of continent is : ', continent, " with index: " + str(index) + "\n")
 
+def _worker_loop(task_queue, connection, initializer=None, initargs=()):
+    """
+    Loop of each process of WorkerPool. It takes chunks of tasks from task_queue until it gets None, and sends to
+    connection a ("start", task_id) message when it starts each task and a ("done", task_id, result, error) message
+    when it finishes it.
+    """
+    # Ctrl-C is only handled by the main process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        chunk = task_queue.get()
+        if chunk is None:
+            break
+        function, tasks = chunk
+        for task_id, item in tasks:
+            connection.send(("start", task_id))
+            try:
+                message = ("done", task_id, function(item), None)
+            except Exception as e:
+                message = ("done", task_id, None, type(e).__name__ + ": " + str(e))
+            try:
+                connection.send(message)
+            except Exception as e:
+                # E.g. the result can not be pickled
+                connection.send(("done", task_id, None, type(e).__name__ + ": " + str(e)))
+    connection.close()
+
+class WorkerPool:
+    """
+    A fixed number of worker processes that stay alive between calls to imap(), with:
+        - chunked submission: tasks are sent to the workers in chunks of chunksize.
+        - backpressure: at most max_queued tasks are submitted and not yet returned, so a huge (or endless) iterable
+        of tasks is consumed as the results are used, with bounded memory.
+        - ordered or unordered results.
+        - per task timeout: the worker running a task for more than timeout seconds is killed and replaced.
+        - retries: a task that raises an error, times out or kills its worker is tried again up to retries times.
+        - clean Ctrl-C shutdown: the workers ignore SIGINT, and the main process terminates them when imap() is
+        interrupted.
+
+    Each worker sends its messages through its own pipe, so killing one worker can not break the results of the
+    others.
+
+    Use it in this way:
+
+        with WorkerPool(processes=4, timeout=60, retries=1) as pool:
+            for item, result, error in pool.imap(function, items, chunksize=8, ordered=False):
+                ...
+    """
+
+    def __init__(self, processes=None, max_queued=None, timeout=None, retries=0, initializer=None, initargs=(),
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        Start the worker processes.
+
+        Args:
+            processes: Number of worker processes. If None, the number of CPUs is used.
+            max_queued: Maximum number of tasks submitted whose result has not been returned yet by imap(). By
+            default, 4 times processes times the chunksize of imap().
+            timeout: (Optional) Maximum seconds a task can run.
+            retries: Number of times a failed task is tried again.
+            initializer: (Optional) function called at the start of each worker process with initargs.
+            initargs: Arguments of initializer.
+            poll_interval: Seconds between two checks of the timeouts and the dead workers.
+        """
+        self.processes = processes or os.cpu_count() or 1
+        if self.processes < 1:
+            raise ValueError("'processes' has to be > 0.")
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.retries = retries
+        self.initializer = initializer
+        self.initargs = initargs
+        self.poll_interval = poll_interval
+        self.__task_queue = multiprocessing.Queue()
+        # For each worker connection: a dict with its "process", its "task" (task_id, start time) or None, and the
+        # task_ids of its last "chunk"
+        self.__workers = {}
+        self.__closed = False
+        for _ in range(self.processes):
+            self.__start_worker()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def __start_worker(self):
+        receive_connection, send_connection = multiprocessing.Pipe(duplex=False)
+        process = Process(target=_worker_loop, args=(self.__task_queue, send_connection, self.initializer,
+                                                     self.initargs), daemon=True)
+        process.start()
+        send_connection.close()
+        self.__workers[receive_connection] = dict(process=process, task=None, chunk=())
+
+    def __stop_worker(self, connection):
+        worker = self.__workers.pop(connection)
+        worker["process"].terminate()
+        worker["process"].join()
+        connection.close()
+        return worker
+
+    def imap(self, function, iterable, chunksize=1, ordered=True):
+        """
+        Apply function to each item of iterable in the worker processes.
+
+        Args:
+            function: function of one argument. It has to be picklable, e.g. defined at module level.
+            iterable: iterable of items. It is consumed as the results are returned.
+            chunksize: Number of tasks sent to a worker at once. Bigger chunks send less messages, but the tasks of a
+            chunk are done by one worker one after another.
+            ordered: True to return the results in the order of iterable, or False to return them as they finish.
+
+        Returns: Yield item, result, error for each item. error is None if the task was successful, or the error
+        message after the last retry, and then result is None.
+
+        """
+        if self.__closed:
+            raise ValueError("The pool is closed.")
+        if chunksize < 1:
+            raise ValueError("'chunksize' has to be > 0.")
+        max_queued = self.max_queued or 4 * self.processes * chunksize
+        items = enumerate(iterable)
+        tasks = {}  # Tasks submitted and not finished: task_id -> dict(item, attempts, chunk)
+        to_submit = deque()  # task_ids to submit again
+        finished = {}  # task_id -> (item, result, error) of the finished tasks not returned yet
+        next_task_id = 0  # Next task_id to return when ordered
+        exhausted = False
+        try:
+            while True:
+                # Submit new chunks while the tasks not returned yet fit in max_queued
+                # (the tasks to submit again are already counted)
+                while to_submit or (not exhausted and len(tasks) + len(finished) < max_queued):
+                    chunk = []
+                    while to_submit and len(chunk) < chunksize:
+                        chunk.append(to_submit.popleft())
+                    while not exhausted and len(chunk) < chunksize and len(tasks) + len(finished) < max_queued:
+                        try:
+                            task_id, item = next(items)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        tasks[task_id] = dict(item=item, attempts=0, chunk=None)
+                        chunk.append(task_id)
+                    if not chunk:
+                        break
+                    for task_id in chunk:
+                        tasks[task_id]["chunk"] = chunk
+                    self.__task_queue.put((function, [(task_id, tasks[task_id]["item"]) for task_id in chunk]))
+
+                if ordered:
+                    while next_task_id in finished:
+                        yield finished.pop(next_task_id)
+                        next_task_id += 1
+                else:
+                    while finished:
+                        yield finished.pop(next(iter(finished)))
+                if exhausted and not tasks and not to_submit and not finished:
+                    break
+
+                for connection in wait(list(self.__workers), timeout=self.poll_interval):
+                    try:
+                        message = connection.recv()
+                    except (EOFError, OSError):
+                        continue  # The worker died. It is replaced by __check_workers().
+                    self.__handle_message(self.__workers[connection], message, tasks, to_submit, finished)
+
+                self.__check_workers(tasks, to_submit, finished)
+        finally:
+            if tasks or to_submit:
+                # imap() was interrupted (e.g. Ctrl-C or the caller stopped iterating): stop the tasks left
+                self.terminate()
+
+    def __handle_message(self, worker, message, tasks, to_submit, finished):
+        if message[0] == "start":
+            worker["task"] = (message[1], time.monotonic())
+            if message[1] in tasks:
+                worker["chunk"] = tasks[message[1]]["chunk"]
+            return
+        _, task_id, result, error = message
+        worker["task"] = None
+        if task_id in tasks:
+            self.__finish_task(task_id, result, error, tasks, to_submit, finished)
+
+    def __finish_task(self, task_id, result, error, tasks, to_submit, finished):
+        """
+        Move a task to finished, or to to_submit if it failed and it has retries left.
+        """
+        if error is not None and tasks[task_id]["attempts"] < self.retries:
+            tasks[task_id]["attempts"] += 1
+            to_submit.append(task_id)
+        else:
+            finished[task_id] = (tasks.pop(task_id)["item"], result, error)
+
+    def __check_workers(self, tasks, to_submit, finished):
+        """
+        Replace the workers that died or whose task timed out, and try again or finish their tasks.
+        """
+        now = time.monotonic()
+        for connection, worker in list(self.__workers.items()):
+            if worker["task"] is not None and self.timeout is not None and now - worker["task"][1] > self.timeout:
+                error = "TimeoutError: the task took more than " + str(self.timeout) + " seconds"
+            elif not worker["process"].is_alive():
+                # The messages sent before dying are read first, to know which task it was running
+                try:
+                    while connection.poll():
+                        self.__handle_message(worker, connection.recv(), tasks, to_submit, finished)
+                except (EOFError, OSError):
+                    pass
+                error = "WorkerError: the worker process exited with code " + str(worker["process"].exitcode)
+            else:
+                continue
+            self.__stop_worker(connection)
+            self.__start_worker()
+            task_id = worker["task"][0] if worker["task"] is not None else None
+            # The tasks of its chunk that were not finished are submitted again
+            for other_task_id in worker["chunk"]:
+                if other_task_id != task_id and other_task_id in tasks and other_task_id not in to_submit:
+                    to_submit.append(other_task_id)
+            if task_id in tasks:
+                self.__finish_task(task_id, None, error, tasks, to_submit, finished)
+
+    def close(self):
+        """
+        Stop the workers once they finish the tasks already submitted.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        for _ in self.__workers:
+            self.__task_queue.put(None)
+        for connection, worker in list(self.__workers.items()):
+            worker["process"].join()
+            connection.close()
+        self.__workers.clear()
+        self.__task_queue.close()
+
+    def terminate(self):
+        """
+        Stop the workers immediately, without finishing their tasks.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        for connection in list(self.__workers):
+            self.__stop_worker(connection)
+        # The tasks left in the queue are discarded
+        self.__task_queue.cancel_join_thread()
+        self.__task_queue.close()
+
 
 if __name__ == "__main__":  # confirms that the code is under main function
     names = ['America', 'Europe', 'Africa']
@@ -24,4 +286,4 @@ if __name__ == "__main__":  # confirms that the code is under main function
 
     # complete the processes
     for proc in procs:
-        proc.join()
\ No newline at end of file
+        proc.join()
@@ -0,0 +1,354 @@
+import os
+import io
+import csv
+import time
+import tarfile
+import numpy as np
+from PIL import Image
+
+# Ways remove_black_pixels_of_image_path_v3() can write its results
+OUTPUT_MODES = ("files", "npy", "tar")
+DEFAULT_SHARD_MAX_BYTES = 1024 ** 3
+SHARD_INDEX_NAME = "shards_index.csv"
+# PIL modes each format can save, the others are converted by get_savable_image()
+JPEG_MODES = ("L", "RGB", "CMYK")
+
+
+def get_image_format(name, default="JPEG"):
+    """
+    Returns: The PIL format of the extension of a file name, e.g. "PNG" for "frame.png", or default if the extension
+    is unknown.
+    """
+    return Image.registered_extensions().get(os.path.splitext(name)[1].lower(), default)
+
+def get_savable_image(image, image_format):
+    """
+    Convert an image only if its mode can not be saved in image_format: JPEG has no alpha channel nor palette, so
+    those images are saved as RGB, and single channel images as L. The other formats save the image as it is.
+
+    Returns: image, or the converted copy.
+
+    """
+    if image_format != "JPEG" or image.mode in JPEG_MODES:
+        return image
+    return image.convert("L" if image.mode in ("1", "LA", "I", "I;16", "F") else "RGB")
+
+
+class DirectorySink:
+    """
+    Save each image as its own file inside a folder, mirroring the input tree.
+
+    A sink is used in three steps: prepare() is called in the main process for each file and returns the output the
+    file will be written to, write() is called where the image is processed (maybe a worker process) and returns
+    (bytes_written, payload), and record() is called back in the main process with the payload once the file has
+    been processed successfully. Sinks are pickled to be sent to the worker processes.
+    """
+
+    def __init__(self, folder, image_format=None):
+        """
+        Args:
+            folder: Output folder, ending with os.sep.
+            image_format: PIL format of the saved images. If None, each image is saved in the format of its file
+            extension (see get_image_format()), so e.g. PNG images keep their mode and are not saved as JPEG.
+        """
+        self.folder = folder
+        self.image_format = image_format
+        self.__created_folders = {""}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_DirectorySink__created_folders"] = {""}  # Only used by prepare() in the main process
+        return state
+
+    def prepare(self, file):
+        """
+        Create, the first time, the subfolder of the output folder where file will be saved.
+
+        Args:
+            file: file path relative to the images path.
+
+        Returns: new_fullpath, the fullpath where the image of file will be saved.
+
+        """
+        folder = os.path.dirname(file)
+        if folder not in self.__created_folders:
+            os.makedirs(self.folder + folder, exist_ok=True)
+            self.__created_folders.add(folder)
+        return self.folder + file
+
+    def write(self, output, image):
+        """
+        Args:
+            output: the new_fullpath returned by prepare().
+            image: PIL image to save.
+
+        Returns: bytes_written, payload. The payload is always None.
+
+        """
+        image_format = self.image_format or get_image_format(output)
+        get_savable_image(image, image_format).save(output, image_format)
+        return os.path.getsize(output), None
+
+    def record(self, file, output, payload):
+        pass
+
+    def close(self):
+        pass
+
+class NpyMemmapSink:
+    """
+    Write every image, all with the same shape, as one row of a single preallocated (N, height, width, 3) uint8 .npy
+    file, opened as a memory map by each process that writes to it. A sidecar CSV index maps each row to its source
+    file, so the dataset can be loaded without copies with np.load(fullpath, mmap_mode="r").
+
+    Rows of files that could not be processed stay black and are not in the index.
+    """
+
+    def __init__(self, fullpath, count, size):
+        """
+        Create the .npy file with all its rows.
+
+        Args:
+            fullpath: fullpath of the .npy file. The index is saved as fullpath without extension + "_index.csv".
+            count: Number of rows, the maximum number of images.
+            size: (width, height) every image must have.
+        """
+        self.fullpath = fullpath
+        self.index_fullpath = os.path.splitext(fullpath)[0] + "_index.csv"
+        self.shape = (count, size[1], size[0], 3)
+        dataset = np.lib.format.open_memmap(fullpath, mode="w+", dtype=np.uint8, shape=self.shape)
+        del dataset
+        self.__next_row = 0
+        self.__index = {}
+        self.__dataset = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Each process opens its own memory map, and the index only lives in the main process
+        state["_NpyMemmapSink__dataset"] = None
+        state["_NpyMemmapSink__index"] = {}
+        return state
+
+    def prepare(self, file):
+        """
+        Returns: row, the row of the dataset assigned to file, or None if there are no rows left.
+        """
+        if self.__next_row >= self.shape[0]:
+            return None
+        row = self.__next_row
+        self.__next_row += 1
+        return row
+
+    def write(self, output, image):
+        """
+        Args:
+            output: the row returned by prepare().
+            image: PIL image with the size of the dataset.
+
+        Returns: bytes_written, payload. The payload is always None.
+
+        """
+        if output is None:
+            raise ValueError("No row left in " + self.fullpath + ". More files were found than when it was created.")
+        if image.size != (self.shape[2], self.shape[1]):
+            raise ValueError("Image size " + str(image.size) + " is not the dataset size " +
+                             str((self.shape[2], self.shape[1])) + ". Use resize_dimensions and force_dimensions.")
+        if self.__dataset is None:
+            self.__dataset = np.load(self.fullpath, mmap_mode="r+")
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        self.__dataset[output] = np.asarray(image)
+        return self.__dataset[output].nbytes, None
+
+    def record(self, file, output, payload):
+        self.__index[output] = file
+
+    def close(self):
+        """
+        Flush the dataset and write the index, sorted by row.
+        """
+        if self.__dataset is not None:
+            self.__dataset.flush()
+            self.__dataset = None
+        with open(self.index_fullpath, "w", newline="") as index_file:
+            writer = csv.writer(index_file)
+            writer.writerow(("row", "file"))
+            for row in sorted(self.__index):
+                writer.writerow((row, self.__index[row]))
+
+def load_npy_dataset(fullpath):
+    """
+    Load a dataset written by NpyMemmapSink without copying it to memory.
+
+    Args:
+        fullpath: fullpath of the .npy file.
+
+    Returns: dataset, rows. The memory mapped (N, height, width, 3) array and a dict {row: source file} with the valid
+    rows.
+
+    """
+    dataset = np.load(fullpath, mmap_mode="r")
+    with open(os.path.splitext(fullpath)[0] + "_index.csv", newline="") as index_file:
+        rows = {int(row["row"]): row["file"] for row in csv.DictReader(index_file)}
+    return dataset, rows
+
+class TarShardSink:
+    """
+    Write the images into a sequence of uncompressed tar files (shards) of at most max_shard_bytes each, instead of
+    one file per image. Images are encoded where they are processed and only the main process appends them, in
+    order, to the current shard. A CSV index (SHARD_INDEX_NAME) with the shard, member name, data offset and size of
+    each image is appended as they are written, so any image can be read without scanning the shards.
+    """
+
+    def __init__(self, folder, max_shard_bytes=DEFAULT_SHARD_MAX_BYTES, image_format=None, prefix="shard",
+                 index_name=SHARD_INDEX_NAME):
+        """
+        Args:
+            folder: Folder where the shards and the index are written.
+            max_shard_bytes: Maximum size of a shard. A new shard is started when the next image does not fit, unless
+            the shard is empty.
+            image_format: PIL format of the images. If None, each image keeps the extension of its file and is encoded
+            in its format (see get_image_format()).
+            prefix: Name of the shards before their number, e.g. "shard-000000.tar".
+            index_name: Name of the CSV index.
+        """
+        self.folder = folder
+        self.max_shard_bytes = max_shard_bytes
+        self.image_format = image_format
+        self.prefix = prefix
+        self.index_name = index_name
+        self.extension = "." + image_format.lower().replace("jpeg", "jpg") if image_format else None
+        self.__shard_number = -1
+        self.__shard = None
+        self.__index_file = None
+        self.__index_writer = None
+        self.__remove_previous_shards()
+
+    def __remove_previous_shards(self):
+        """
+        Remove the shards and the index written by a previous run with the same prefix, which would otherwise be
+        read together with the new ones, e.g. by iter_tar_shards().
+        """
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            if is_shard_name(name, self.prefix) or name == self.index_name:
+                os.remove(os.path.join(self.folder, name))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The shards and the index are only written by the main process
+        state["_TarShardSink__shard"] = None
+        state["_TarShardSink__index_file"] = None
+        state["_TarShardSink__index_writer"] = None
+        return state
+
+    def prepare(self, file):
+        """
+        Returns: member_name, the name of the image inside the shard: file with "/" separators and the image format
+        extension, if image_format is given.
+        """
+        if self.extension is None:
+            return file.replace(os.sep, "/")
+        return os.path.splitext(file)[0].replace(os.sep, "/") + self.extension
+
+    def write(self, output, image):
+        """
+        Encode the image. It is appended to a shard by record().
+
+        Args:
+            output: the member name returned by prepare().
+            image: PIL image to encode.
+
+        Returns: bytes_written, payload. The payload is the encoded image.
+
+        """
+        encoded_image = io.BytesIO()
+        image_format = self.image_format or get_image_format(output)
+        get_savable_image(image, image_format).save(encoded_image, image_format)
+        payload = encoded_image.getvalue()
+        return len(payload), payload
+
+    def __get_shard_name(self):
+        return self.prefix + "-{0:06d}.tar".format(self.__shard_number)
+
+    def __open_next_shard(self):
+        if self.__shard is not None:
+            self.__shard.close()
+        self.__shard_number += 1
+        self.__shard = tarfile.open(os.path.join(self.folder, self.__get_shard_name()), "w",
+                                    format=tarfile.PAX_FORMAT)
+
+    def record(self, file, output, payload):
+        """
+        Append the encoded image to the current shard, starting a new shard if it does not fit.
+        """
+        if self.__index_writer is None:
+            self.__index_file = open(os.path.join(self.folder, self.index_name), "w", newline="")
+            self.__index_writer = csv.writer(self.__index_file)
+            self.__index_writer.writerow(("shard", "member", "offset", "size", "file"))
+        # Header block + data padded to 512 bytes
+        member_bytes = tarfile.BLOCKSIZE + -(-len(payload) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        if self.__shard is None or (self.__shard.offset > 0 and
+                                    self.__shard.offset + member_bytes > self.max_shard_bytes):
+            self.__open_next_shard()
+        tarinfo = tarfile.TarInfo(name=output)
+        tarinfo.size = len(payload)
+        tarinfo.mtime = int(time.time())
+        self.__shard.addfile(tarinfo, io.BytesIO(payload))
+        offset = self.__shard.offset - -(-len(payload) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        self.__index_writer.writerow((self.__get_shard_name(), output, offset, len(payload), file))
+
+    def close(self):
+        if self.__shard is not None:
+            self.__shard.close()
+            self.__shard = None
+        if self.__index_file is not None:
+            self.__index_file.close()
+            self.__index_file = None
+            self.__index_writer = None
+
+def is_shard_name(name, prefix="shard"):
+    """
+    Returns: True if name is the name of a shard written by TarShardSink with prefix, e.g. "shard-000000.tar".
+    """
+    number = name[len(prefix) + 1:-len(".tar")]
+    return name.startswith(prefix + "-") and name.endswith(".tar") and len(number) >= 6 and number.isdigit()
+
+def iter_tar_shards(folder, prefix="shard"):
+    """
+    Iterate over the images of the shards written by TarShardSink, reading each shard sequentially.
+
+    Args:
+        folder: Folder of the shards.
+        prefix: Name of the shards before their number.
+
+    Returns: Yield member_name, data. The name and the encoded bytes of each image.
+
+    """
+    shard_names = sorted(name for name in os.listdir(folder) if is_shard_name(name, prefix))
+    for shard_name in shard_names:
+        with tarfile.open(os.path.join(folder, shard_name), "r|") as shard:
+            for tarinfo in shard:
+                if tarinfo.isfile():
+                    yield tarinfo.name, shard.extractfile(tarinfo).read()
+
+def read_from_tar_shards(folder, member_name, index_name=SHARD_INDEX_NAME):
+    """
+    Read one image of the shards written by TarShardSink with the index, without scanning the shards.
+
+    Args:
+        folder: Folder of the shards.
+        member_name: Name of the image inside the shards.
+        index_name: Name of the CSV index.
+
+    Returns: The encoded bytes of the image.
+
+    """
+    with open(os.path.join(folder, index_name), newline="") as index_file:
+        for row in csv.DictReader(index_file):
+            if row["member"] == member_name:
+                with open(os.path.join(folder, row["shard"]), "rb") as shard:
+                    shard.seek(int(row["offset"]))
+                    return shard.read(int(row["size"]))
+    raise KeyError(member_name)
@@ -1,3 +1,7 @@
+import sys
+import time
+import multiprocessing
+
 
 def show_percent_by_total(total, count_number):
     same_line = False if total == count_number else True
@@ -22,4 +26,109 @@ def pt(title=None, text=None, same_line=False):
     if same_line:
         print(str(title) + str(text), end="\r")
     else:
-        print(str(title) + " \n " + str(text))
\ No newline at end of file
+        print(str(title) + " \n " + str(text))
+
+
+def format_seconds(seconds):
+    """
+    Format seconds as H:MM:SS.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+
+class ProgressReporter:
+    """
+    A progress line with the count, percent, items/sec, elapsed time and ETA, that is rendered at most once every
+    min_interval seconds (or every "every" items) instead of once per item.
+    If the stream is a terminal, the line is rewritten in place with "\\r". Otherwise (logs, pipes) a full line is
+    written every log_interval seconds.
+
+    The count and the render time are kept in shared memory protected by a lock, so the reporter can be updated from
+    several processes if it is inherited by them (e.g. passed to a multiprocessing.Pool initializer).
+    """
+
+    def __init__(self, total=None, title="Progress", min_interval=0.5, every=None, log_interval=10.0, stream=None):
+        """
+        Args:
+            total: (Optional) total number of items, to show the percent and the ETA.
+            title: Text at the start of the line.
+            min_interval: Minimum seconds between two renders in a terminal.
+            every: (Optional) Render also every time the count is a multiple of this number.
+            log_interval: Minimum seconds between two lines when the stream is not a terminal.
+            stream: Where the progress is written. sys.stdout by default.
+        """
+        self.total = total
+        self.title = title
+        self.every = every
+        self.stream = stream if stream is not None else sys.stdout
+        self.is_terminal = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.interval = min_interval if self.is_terminal else log_interval
+        self.start_time = time.time()
+        self.__lock = multiprocessing.Lock()
+        self.__count = multiprocessing.Value("q", 0, lock=False)
+        self.__last_render = multiprocessing.Value("d", 0.0, lock=False)
+        self.__last_rendered_count = multiprocessing.Value("q", -1, lock=False)
+
+    @property
+    def count(self):
+        return self.__count.value
+
+    def update(self, count=1):
+        """
+        Add count items to the progress and render it if it is time to do it.
+
+        Args:
+            count: Number of new items done.
+        """
+        if not count:
+            # Nothing new: at the total it would render the same line again
+            return
+        with self.__lock:
+            self.__count.value += count
+            now = time.time()
+            current = self.__count.value
+            if now - self.__last_render.value >= self.interval or current == self.total \
+                    or (self.every and current % self.every == 0):
+                self.__last_render.value = now
+                self.__render(current, now, final=False)
+
+    def close(self):
+        """
+        Render the final progress, if it was not rendered yet, and finish the line.
+        """
+        with self.__lock:
+            if self.is_terminal or self.__count.value != self.__last_rendered_count.value:
+                self.__render(self.__count.value, time.time(), final=True)
+
+    def get_text(self, count, now):
+        """
+        Build the progress text.
+
+        Args:
+            count: Number of items done.
+            now: Current time.
+
+        Returns: The progress text.
+
+        """
+        elapsed = now - self.start_time
+        rate = count / elapsed if elapsed > 0 else 0.
+        text = self.title + ": " + str(count)
+        if self.total:
+            text += "/" + str(self.total) + " ({0:.3f}%)".format(count * 100 / self.total)
+        text += " | {0:.1f} items/s | elapsed ".format(rate) + format_seconds(elapsed)
+        if self.total and rate > 0:
+            text += " | ETA " + format_seconds(max(self.total - count, 0) / rate)
+        return text
+
+    def __render(self, count, now, final):
+        self.__last_rendered_count.value = count
+        text = self.get_text(count, now)
+        if self.is_terminal and not final:
+            self.stream.write("\r" + text)
+        elif self.is_terminal:
+            self.stream.write("\r" + text + "\n")
+        else:
+            self.stream.write(text + "\n")
+        self.stream.flush()
@@ -1,6 +1,20 @@
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk
 from tkinter import scrolledtext
+from PIL import ImageTk
+from Prints import format_seconds
+from DirectoryScanner import scan_files
+from ImageModifications import IMAGE_EXTENSIONS, DEFAULT_DETECTION_TOLERANCE, get_crop_preview
+
+# Milliseconds between two reads of the messages of a BackgroundJob by the UI
+JOB_POLL_INTERVAL_MS = 100
+DEFAULT_PREVIEW_CACHE_BYTES = 64 * 1024 ** 2
 
 class MouseOverButton(tk.Button):
     def __init__(self, master, **kw):
@@ -15,17 +29,345 @@ class MouseOverButton(tk.Button):
     def on_leave(self, e):
         self['background'] = self.defaultBackground
 
+class BackgroundJob:
+    """
+    Run a long function (e.g. ImageModifications.remove_black_pixels_of_image_path_v3) in a worker thread, so the Tk
+    main loop keeps responding. The function is called as function(progress_callback=..., stop_event=..., **kwargs):
+    it reports its progress calling progress_callback(count, total) and stops when stop_event is set.
+
+    The worker thread never touches the widgets: it puts its messages in a queue that the Tk thread reads with
+    get_messages(), called periodically with root.after().
+    """
+
+    def __init__(self, function, **kwargs):
+        """
+        Args:
+            function: The function to run.
+            kwargs: Other keyword arguments of function.
+        """
+        self.function = function
+        self.kwargs = kwargs
+        self.messages = queue.Queue()
+        self.stop_event = threading.Event()
+        self.start_time = None
+        self.__thread = None
+
+    @property
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self):
+        """
+        Start the function in a new daemon thread. It does nothing if the job is already running.
+        """
+        if self.is_running:
+            return
+        self.stop_event.clear()
+        self.start_time = time.time()
+        self.__thread = threading.Thread(target=self.__run, name="BackgroundJob", daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            result = self.function(progress_callback=self.__report, stop_event=self.stop_event, **self.kwargs)
+        except Exception as e:
+            self.messages.put(("error", type(e).__name__ + ": " + str(e)))
+        else:
+            self.messages.put(("stopped" if self.stop_event.is_set() else "done", result))
+
+    def __report(self, count, total=None):
+        self.messages.put(("progress", count, total))
+
+    def stop(self):
+        """
+        Ask the function to stop. It finishes its current item first.
+        """
+        self.stop_event.set()
+
+    def get_messages(self):
+        """
+        Returns: The list of messages received since the last call, without waiting. Only the last "progress"
+        message is kept, so the UI is updated once per call however fast the progress is.
+        Each message is a tuple ("progress", count, total), ("done", result), ("stopped", result) or
+        ("error", error message).
+        """
+        messages = []
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "progress" and messages and messages[-1][0] == "progress":
+                messages[-1] = message
+            else:
+                messages.append(message)
+        return messages
+
+    def get_throughput_text(self, count, total=None):
+        """
+        Returns: A text with the count, items/s and ETA of the job.
+        """
+        elapsed = time.time() - self.start_time
+        rate = count / elapsed if elapsed > 0 else 0.
+        text = str(count) + ("/" + str(total) if total else "") + " | {0:.1f} items/s".format(rate)
+        if total and rate > 0:
+            text += " | ETA " + format_seconds(max(total - count, 0) / rate)
+        return text
+
+class ImageLRUCache:
+    """
+    A cache of tuples of PIL images that drops the least recently used entries when the images use more than
+    max_bytes. It is not thread safe: it is only used from the Tk thread.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_PREVIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.__entries = OrderedDict()  # key -> (value, bytes)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        """
+        Returns: The value of key, marked as the most recently used, or None if it is not cached.
+        """
+        if key not in self.__entries:
+            return None
+        self.__entries.move_to_end(key)
+        return self.__entries[key][0]
+
+    def put(self, key, value, images):
+        """
+        Args:
+            key: Key of the value, e.g. the image file.
+            value: The value to cache.
+            images: The PIL images of value, to count the bytes it uses.
+        """
+        if key in self.__entries:
+            self.bytes -= self.__entries.pop(key)[1]
+        size = sum(image.width * image.height * len(image.getbands()) for image in images)
+        self.__entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self.__entries) > 1:
+            _, (_, dropped_size) = self.__entries.popitem(last=False)
+            self.bytes -= dropped_size
+
+class CropPreviewWindow:
+    """
+    A window that pages through the images of a folder showing, for each one, its thumbnail and the thumbnail of the
+    image cropped by its black border (see ImageModifications.get_crop_preview()), side by side with the crop box.
+
+    The folder is scanned by a BackgroundJob, so the window opens at once even for huge or network folders, and the
+    pages are filled as the files are found. The thumbnails are created by a pool of threads, for the current page
+    and the pages before and after it, and kept in an ImageLRUCache, so going to the next page is instant. The threads
+    only find files and create PIL images: they are shown by the Tk thread, which reads them from queues with after().
+    """
+
+    def __init__(self, master, path, recursive=False, page_size=4, thumbnail_size=(200, 200), cache=None, threads=2,
+                 detection_tolerance=DEFAULT_DETECTION_TOLERANCE):
+        """
+        Args:
+            master: The parent Tk window.
+            path: images path.
+            recursive: True to show the images of the subfolders too.
+            page_size: Number of images of each page.
+            thumbnail_size: Maximum (width, height) of the thumbnails.
+            cache: (Optional) An ImageLRUCache, e.g. shared by several windows so reopening one is instant.
+            threads: Number of threads creating the thumbnails.
+            detection_tolerance: See ImageModifications.get_crop_preview().
+        """
+        self.path = path
+        self.files = []  # Sorted, filled as the scan finds them
+        self.page_size = page_size
+        self.thumbnail_size = thumbnail_size
+        self.detection_tolerance = detection_tolerance
+        self.cache = cache if cache is not None else ImageLRUCache()
+        self.page = 0
+        self.pages = 1
+        self.__executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="preview")
+        self.__previews = queue.Queue()
+        self.__pending = set()
+        self.__closed = False
+        self.__scanned_files = queue.Queue()
+        self.__scan_status = "scanning..."
+        self.__scan_job = BackgroundJob(self.__scan_files, path=path, recursive=recursive)
+
+        self.top = tk.Toplevel(master)
+        self.top.title("Crop preview - " + path)
+        self.top.config(bg="#ffffff")
+        self.top.protocol("WM_DELETE_WINDOW", self.close)
+        self.__rows = []
+        for row in range(page_size):
+            original_label = tk.Label(self.top, bg="#ffffff")
+            original_label.grid(row=row, column=0, padx=5, pady=5)
+            cropped_label = tk.Label(self.top, bg="#ffffff")
+            cropped_label.grid(row=row, column=1, padx=5, pady=5)
+            text_label = tk.Label(self.top, font=("Segoe UI", "8"), bg="#ffffff", anchor=tk.W, justify=tk.LEFT)
+            text_label.grid(row=row, column=2, padx=5, sticky=tk.W)
+            self.__rows.append((original_label, cropped_label, text_label))
+        frame_pages = tk.Frame(self.top, bg="#ffffff")
+        frame_pages.grid(row=page_size, column=0, columnspan=3, pady=8)
+        MouseOverButton(frame_pages, font=("Segoe UI", "8"), text="<", width=4, bg="#e3e1e1",
+                        command=lambda: self.show_page(self.page - 1)).grid(row=0, column=0)
+        self.__page_label = tk.Label(frame_pages, font=("Segoe UI", "8"), bg="#ffffff")
+        self.__page_label.grid(row=0, column=1, padx=10)
+        MouseOverButton(frame_pages, font=("Segoe UI", "8"), text=">", width=4, bg="#e3e1e1",
+                        command=lambda: self.show_page(self.page + 1)).grid(row=0, column=2)
+        self.top.bind("<Left>", lambda event: self.show_page(self.page - 1))
+        self.top.bind("<Right>", lambda event: self.show_page(self.page + 1))
+        self.top.bind("<MouseWheel>", lambda event: self.show_page(self.page + (1 if event.delta < 0 else -1)))
+
+        self.__scan_job.start()
+        self.show_page(0)
+        self.top.after(JOB_POLL_INTERVAL_MS, self.__poll)
+
+    def __scan_files(self, path, recursive, progress_callback, stop_event):
+        """
+        Function of the scan BackgroundJob: put each image file found in a queue, read by __add_scanned_files().
+
+        Returns: The number of files found.
+
+        """
+        count = 0
+        for file in scan_files(path=path, extensions=IMAGE_EXTENSIONS, recursive=recursive):
+            if stop_event.is_set():
+                break
+            self.__scanned_files.put(file)
+            count += 1
+        return count
+
+    def __add_scanned_files(self):
+        """
+        Add the files found by the scan since the last call, and show the current page again if they change it.
+        """
+        files = []
+        while True:
+            try:
+                files.append(self.__scanned_files.get_nowait())
+            except queue.Empty:
+                break
+        messages = self.__scan_job.get_messages()
+        for message in messages:
+            if message[0] == "done":
+                self.__scan_status = None
+            elif message[0] == "error":
+                self.__scan_status = "scan error: " + message[1]
+        if not files and not messages:
+            return
+        page_files = self.__get_page_files(self.page)
+        # The files found are mostly sorted already, so sorting them again is fast
+        self.files.extend(files)
+        self.files.sort()
+        self.pages = max(-(-len(self.files) // self.page_size), 1)
+        if self.__get_page_files(self.page) != page_files:
+            self.show_page(self.page)
+        else:
+            self.__show_page_label()
+            self.__request(self.__get_page_files(self.page + 1) + self.__get_page_files(self.page - 1))
+
+    def __get_page_files(self, page):
+        return self.files[page * self.page_size:(page + 1) * self.page_size] if 0 <= page < self.pages else []
+
+    def __request(self, files):
+        for file in files:
+            if file not in self.cache and file not in self.__pending:
+                self.__pending.add(file)
+                self.__executor.submit(self.__create_preview, file)
+
+    def __create_preview(self, file):
+        try:
+            preview = get_crop_preview(fullpath=self.path + os.sep + file, thumbnail_size=self.thumbnail_size,
+                                       detection_tolerance=self.detection_tolerance)
+        except Exception as e:
+            preview = type(e).__name__ + ": " + str(e)
+        self.__previews.put((file, preview))
+
+    def show_page(self, page):
+        """
+        Show a page, with the thumbnails already cached, and create the missing ones and those of the pages around.
+        """
+        if not 0 <= page < self.pages:
+            return
+        self.page = page
+        self.__show_page_label()
+        files = self.__get_page_files(page)
+        for index, row in enumerate(self.__rows):
+            self.__show_row(row, files[index] if index < len(files) else None)
+        self.__request(files)
+        self.__request(self.__get_page_files(page + 1) + self.__get_page_files(page - 1))
+
+    def __show_page_label(self):
+        self.__page_label.config(text="Page " + str(self.page + 1) + "/" + str(self.pages) + " (" +
+                                 str(len(self.files)) + " images" +
+                                 (", " + self.__scan_status if self.__scan_status else "") + ")")
+
+    def __show_row(self, row, file):
+        original_label, cropped_label, text_label = row
+        preview = self.cache.get(file) if file is not None else None
+        if preview is None:
+            for label in (original_label, cropped_label):
+                label.config(image="")
+                label.image = None
+            text_label.config(text="" if file is None else file + "\nLoading...")
+        elif isinstance(preview, str):
+            text_label.config(text=file + "\n" + preview)
+        else:
+            thumbnail, cropped_thumbnail, area = preview
+            for label, image in ((original_label, thumbnail), (cropped_label, cropped_thumbnail)):
+                photo = ImageTk.PhotoImage(image)
+                label.config(image=photo)
+                label.image = photo  # To keep a reference to prevent from getting it garbage-collected.
+            text_label.config(text=file + "\n" + "x".join(map(str, thumbnail.size)) + " thumbnail\nCrop box: " +
+                                   (str(area) if area is not None else "no border found"))
+
+    def __poll(self):
+        if self.__closed:
+            return
+        self.__add_scanned_files()
+        files = self.__get_page_files(self.page)
+        while True:
+            try:
+                file, preview = self.__previews.get_nowait()
+            except queue.Empty:
+                break
+            self.__pending.discard(file)
+            self.cache.put(file, preview, () if isinstance(preview, str) else preview[:2])
+            if file in files:
+                self.__show_row(self.__rows[files.index(file)], file)
+        self.top.after(JOB_POLL_INTERVAL_MS, self.__poll)
+
+    def close(self):
+        """
+        Close the window, and stop the scan and cancel the thumbnails not created yet. The cache is kept.
+        """
+        self.__closed = True
+        self.__scan_job.stop()
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.top.destroy()
+
 class ConsciencesFWIU:
     """
     A class that can start an IU process to write, from buttons, words into python console.
+
+    If a job (a BackgroundJob) is given, a "Run" button starts it, the "Stop" button stops it and its progress and
+    throughput are shown below the buttons, while the window keeps responding.
+    If a preview_path is given, a "Preview" button opens a CropPreviewWindow of its images, to check the crop boxes
+    before running the job.
     """
     __owner = "ConsciencesAI"
     __creation_date = "28/09/2019"
 
-    def __init__(self, resolution, full_options=True, load_configuration=False):
+    def __init__(self, resolution, full_options=True, load_configuration=False, job=None, preview_path=None):
         self.__check_resolution(resolution)
         self.full_options = full_options
         self.load_configuration = load_configuration
+        self.job = job
+        self.preview_path = preview_path
+        self.preview_cache = ImageLRUCache()  # Shared by the preview windows
 
     def __check_resolution(self, resolution):
         """
@@ -115,6 +457,14 @@ class ConsciencesFWIU:
             btn_help.grid(column=1, padx=2, pady=4)
             btn_help.image = photo_help  # To keep a reference to prevent from getting it garbage-collected.
 
+            if self.preview_path is not None:
+                def preview_button():
+                    CropPreviewWindow(root, self.preview_path, cache=self.preview_cache)
+
+                btn_preview = MouseOverButton(frame_top, font=("Segoe UI", "8"), text="Preview", bg="#e3e1e1",
+                                              command=preview_button)
+                btn_preview.grid(row=btn_help.grid_info()["row"], column=2, padx=2, pady=4)
+
             frame_top.columnconfigure(0, weight=1)
 
         def middle_frame():
@@ -318,7 +668,11 @@ class ConsciencesFWIU:
                 input_code.insert(tk.END, "\nSAVE")
 
             def stop_button():
-                input_code.insert(tk.END, "\nSTOP")
+                if self.job is not None and self.job.is_running:
+                    self.job.stop()
+                    job_label.config(text="Stopping...")
+                else:
+                    input_code.insert(tk.END, "\nSTOP")
 
             btn_save = MouseOverButton(frame_buttons, font=("Segoe UI", "8"), text="Save", width=7, bg="#e3e1e1",
                                        command=save_button)
@@ -327,13 +681,75 @@ class ConsciencesFWIU:
                                        command=stop_button)
             btn_stop.grid(row=0, column=2, padx=10, pady=8)
 
+            if self.job is None:
+                return None
+
+            def run_button():
+                btn_run.config(state="disable")
+                job_progress.config(mode="indeterminate", value=0)
+                job_label.config(text="Starting...")
+                self.job.start()
+                root.after(JOB_POLL_INTERVAL_MS, poll_job)
+
+            btn_run = MouseOverButton(frame_buttons, font=("Segoe UI", "8"), text="Run", width=7, bg="#e3e1e1",
+                                      command=run_button)
+            btn_run.grid(row=0, column=1, padx=1, pady=8)
+            btn_save.grid(row=0, column=2)
+            btn_stop.grid(row=0, column=3)
+            return btn_run
+
+        def job_frame():
+            """
+            Create the frame below the buttons with the progress bar and the throughput of the job.
+
+            Returns: job_progress, job_label. The progress bar and the label.
+
+            """
+            frame_job = tk.Frame(root, bg="#f5f2f2")
+            frame_job.grid(sticky=tk.W + tk.E, padx=10, pady=(0, 8))
+            job_progress = ttk.Progressbar(frame_job, orient="horizontal", mode="determinate")
+            job_progress.grid(row=0, column=0, sticky=tk.W + tk.E)
+            job_label = tk.Label(frame_job, font=("Segoe UI", "8"), text="", bg="#f5f2f2", anchor=tk.W)
+            job_label.grid(row=1, column=0, sticky=tk.W + tk.E)
+
+            frame_job.columnconfigure(0, weight=1)  # To extend the progress bar.
+
+            return job_progress, job_label
+
+        def poll_job():
+            """
+            Show the messages of the job and poll it again while it is running. Called by the Tk main loop with
+            after(), so the widgets are only changed from the Tk thread.
+            """
+            finished = False
+            for message in self.job.get_messages():
+                if message[0] == "progress":
+                    _, count, total = message
+                    if total:
+                        job_progress.config(mode="determinate", maximum=total, value=count)
+                    else:
+                        job_progress.step()
+                    job_label.config(text=self.job.get_throughput_text(count, total))
+                else:
+                    finished = True
+                    if message[0] == "error":
+                        job_label.config(text="Error: " + message[1])
+                    else:
+                        job_label.config(text=message[0].capitalize() + ". " + job_label.cget("text"))
+            if finished or not self.job.is_running and self.job.messages.empty():
+                btn_run.config(state="normal")
+            else:
+                root.after(JOB_POLL_INTERVAL_MS, poll_job)
+
         root = root_window()
         top_frame()
         code_label_frame = middle_frame()
         options_frame, text_code_frame, wait_code_frame = frames_in_middle_frame()
         input_code = middle_frame_buttons() # Add new interactive widgets inside this function.
         frame_buttons = botton_frame()
-        botton_frame_buttons()
+        btn_run = botton_frame_buttons()
+        if self.job is not None:
+            job_progress, job_label = job_frame()
         root.mainloop()
 
 if __name__=="__main__":
@@ -6,27 +6,175 @@ Use this file in this way in command line:
 python "fullpath_of_this_file" -i "path_of_image_path"
 """
 
-import sys, os, argparse
+import sys, os, argparse, cProfile
+from functools import partial
 
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append('../../')
 
-from ImageModifications import remove_black_pixels_of_image_path_v3
+from ImageModifications import remove_black_pixels_of_image_path_v3, analyze_black_pixels_of_image_path, \
+    merge_shard_outputs, watch_black_pixels_of_image_path
+from Metrics import PipelineMetrics
 
 if __name__ == "__main__":
 
     ap = argparse.ArgumentParser()
     ap.add_argument("-i", "--path_images", required=False,
                     help="Path of images")
+    ap.add_argument("-w", "--workers", type=int, default=1,
+                    help="Number of processes used to process the images. 0 to use all the CPUs")
+    ap.add_argument("-c", "--chunksize", type=int, default=1,
+                    help="Number of images sent to each process at once")
+    ap.add_argument("--task_timeout", type=float, default=None,
+                    help="With several workers, maximum seconds to process one image. Images that take longer are "
+                         "reported as failures")
+    ap.add_argument("--io_threads", type=int, default=0,
+                    help="With one worker, number of threads reading the next images ahead and writing the results "
+                         "behind while the images are processed. Useful with slow or network storage")
+    ap.add_argument("--resampling", choices=("quality", "balanced", "fast", "fastest"), default="quality",
+                    help="Quality/speed of the resize. The fast presets reduce the images by integer factors and "
+                         "decode JPEG files at a reduced scale before resizing")
+    ap.add_argument("-r", "--recursive", action="store_true",
+                    help="Process the images of the subfolders too")
+    ap.add_argument("--patterns", nargs="+", default=None,
+                    help="Only process the images whose file names match one of these glob patterns, ignoring the "
+                         "case, e.g. \"frame_*\" \"*_left.*\"")
+    ap.add_argument("--no_count", action="store_true",
+                    help="Do not count the images in the background to show the progress percent and ETA. Avoids an "
+                         "extra scan of huge or network folders")
+    ap.add_argument("-n", "--no_resume", action="store_true",
+                    help="Process again every image, even those already processed in a previous run")
+    ap.add_argument("-s", "--sequence_mode", choices=("folder", "prefix"), default=None,
+                    help="Find the black border once for each sequence of video frames (each folder or each file "
+                         "name prefix) instead of once for each image")
+    ap.add_argument("-p", "--profile", default=None,
+                    help="Path prefix to export the timings of each stage of each image as <prefix>.csv and "
+                         "<prefix>.json, with their percentiles")
+    ap.add_argument("--cprofile", action="store_true",
+                    help="With --profile, also dump a cProfile file <prefix>.prof of the main process")
+    ap.add_argument("-o", "--output_mode", choices=("files", "npy", "tar"), default="files",
+                    help="files: save each image as a file in the format of its extension. npy: write every image "
+                         "into one memory mapped .npy array with an index of the source files. tar: append the images "
+                         "to size capped tar shards with an index")
+    ap.add_argument("--shard_max_mb", type=int, default=1024,
+                    help="Maximum size in MB of each tar shard with --output_mode tar")
+    ap.add_argument("-t", "--detection_tolerance", type=int, default=0,
+                    help="Maximum error in pixels allowed to find the black border in a reduced image. 0 to find it "
+                         "in the full resolution image. When processing, it is only used if the box lets JPEG files be "
+                         "decoded at a reduced scale (a --resampling preset with draft), otherwise the full resolution "
+                         "image is decoded anyway")
+    ap.add_argument("--analyze", action="store_true",
+                    help="Only find the crop box of each image and write it with the image size and mode to "
+                         "crop_boxes.csv inside the output folder, without writing any image")
+    ap.add_argument("--use_index", action="store_true",
+                    help="Crop, resize and write the images of the crop_boxes.csv written by --analyze with their "
+                         "crop boxes, without searching the black borders again")
+    ap.add_argument("--shard_index", "--shard-index", type=int, default=None,
+                    help="Only process the files of this shard, from 0 to --shard_count - 1. Run one process for "
+                         "each shard, e.g. on each machine sharing the storage")
+    ap.add_argument("--shard_count", "--shard-count", type=int, default=1,
+                    help="Number of shards the files are split into by a hash of their path")
+    ap.add_argument("--merge_shards", action="store_true",
+                    help="Once every shard has finished, merge their manifests and indexes and check that every "
+                         "file of the --shard_count shards has its output")
+    ap.add_argument("--memory_budget_mb", type=int, default=None,
+                    help="Maximum MB of each decoded image. Bigger images (e.g. huge scans) are decoded reduced, a "
+                         "strip at a time for PNG files, to keep the memory bounded")
+    ap.add_argument("--watch", action="store_true",
+                    help="Keep running and process the new images as they arrive to the folder, with the worker "
+                         "processes kept alive, until Ctrl-C")
+    ap.add_argument("--poll_interval", type=float, default=2.0,
+                    help="With --watch, seconds between two checks of the folder")
+    ap.add_argument("--settle_time", type=float, default=5.0,
+                    help="With --watch, seconds a new file has to stay the same size before it is processed")
 
     args = vars(ap.parse_args())
     path_ = args["path_images"]
+    workers = args["workers"] or None
 
     height, width = 720, 1280
     resize_dimensions = (width, height)
 
-    remove_black_pixels_of_image_path_v3(path=path_,
+    profile = args["profile"]
+    metrics = PipelineMetrics() if profile else None
+
+    if args["merge_shards"]:
+        missing = merge_shard_outputs(path=path_,
+                                      shard_count=args["shard_count"],
+                                      recursive=args["recursive"],
+                                      patterns=args["patterns"],
+                                      output_mode=args["output_mode"])
+        sys.exit(1 if missing else 0)
+
+    if args["analyze"]:
+        analyze_black_pixels_of_image_path(path=path_,
+                                           detection_tolerance=args["detection_tolerance"],
+                                           workers=workers,
+                                           chunksize=args["chunksize"],
+                                           recursive=args["recursive"],
+                                           patterns=args["patterns"],
+                                           count_total=not args["no_count"],
+                                           resume=not args["no_resume"],
+                                           task_timeout=args["task_timeout"])
+        sys.exit()
+
+    memory_budget = args["memory_budget_mb"] * 1024 ** 2 if args["memory_budget_mb"] else None
+
+    if args["watch"]:
+        watch_black_pixels_of_image_path(path=path_,
                                          resize_dimensions=resize_dimensions,
                                          keep_aspect_ratio=False,
-                                         force_dimensions=True)
\ No newline at end of file
+                                         force_dimensions=True,
+                                         detection_tolerance=args["detection_tolerance"],
+                                         workers=workers,
+                                         chunksize=args["chunksize"],
+                                         recursive=args["recursive"],
+                                         patterns=args["patterns"],
+                                         poll_interval=args["poll_interval"],
+                                         settle_time=args["settle_time"],
+                                         io_threads=args["io_threads"],
+                                         resampling=args["resampling"],
+                                         task_timeout=args["task_timeout"],
+                                         memory_budget=memory_budget,
+                                         metrics=metrics)
+        if profile:
+            metrics.print_summary()
+            metrics.export_csv(profile + ".csv")
+            metrics.export_json(profile + ".json")
+        sys.exit()
+
+    run = partial(remove_black_pixels_of_image_path_v3, path=path_,
+                  resize_dimensions=resize_dimensions,
+                  keep_aspect_ratio=False,
+                  force_dimensions=True,
+                  detection_tolerance=args["detection_tolerance"],
+                  recursive=args["recursive"],
+                  patterns=args["patterns"],
+                  count_total=not args["no_count"],
+                  resume=not args["no_resume"],
+                  sequence_mode=args["sequence_mode"],
+                  workers=workers,
+                  chunksize=args["chunksize"],
+                  io_threads=args["io_threads"],
+                  task_timeout=args["task_timeout"],
+                  resampling=args["resampling"],
+                  metrics=metrics,
+                  output_mode=args["output_mode"],
+                  shard_max_bytes=args["shard_max_mb"] * 1024 ** 2,
+                  use_crop_box_index=args["use_index"],
+                  shard_index=args["shard_index"],
+                  shard_count=args["shard_count"],
+                  memory_budget=memory_budget)
+
+    if profile and args["cprofile"]:
+        profiler = cProfile.Profile()
+        profiler.runcall(run)
+        profiler.dump_stats(profile + ".prof")
+    else:
+        run()
+
+    if profile:
+        metrics.print_summary()
+        metrics.export_csv(profile + ".csv")
+        metrics.export_json(profile + ".json")
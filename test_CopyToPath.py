@@ -0,0 +1,34 @@
+import io
+import os
+from contextlib import redirect_stdout
+
+from CopyToPath import create_path_for_filepath
+
+
+def dry_run(path, filepath, **kwargs):
+    """
+    Returns: result, output. What create_path_for_filepath() returns and prints with dry_run.
+    """
+    with redirect_stdout(io.StringIO()) as output:
+        result = create_path_for_filepath(path=path, filepath=filepath, dry_run=True, **kwargs)
+    return result, output.getvalue()
+
+def test_dry_run_reports_the_planned_action_without_changing_anything(tmp_path):
+    source = str(tmp_path / "source.txt")
+    with open(source, "w") as source_file:
+        source_file.write("content")
+    path = str(tmp_path / "copies" / "nested")
+    destination = path + os.sep + "source.txt"
+
+    assert dry_run(path, source) == (True, "copied: " + source + " -> " + destination + "\n")
+    assert dry_run(path, source, hardlink=True) == (True, "linked: " + source + " -> " + destination + "\n")
+    missing = str(tmp_path / "missing.txt")
+    assert dry_run(path, missing) == (False, "missing: " + missing + " -> " + path + os.sep + "missing.txt\n")
+    assert not os.path.exists(tmp_path / "copies")
+
+    assert create_path_for_filepath(path=path, filepath=source)
+    assert dry_run(path, source, skip_unchanged="size_mtime") == \
+        (True, "skipped: " + source + " -> " + destination + "\n")
+    with open(source, "w") as source_file:
+        source_file.write("new content")
+    assert dry_run(path, source, skip_unchanged="size_mtime")[1].startswith("copied: ")
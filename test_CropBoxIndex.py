@@ -0,0 +1,87 @@
+import io
+import os
+from contextlib import redirect_stdout
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import ImageModifications
+from CropBoxIndex import CropBoxIndex
+from ImageModifications import analyze_black_pixels_of_image_path, remove_black_pixels_of_image_path_v3, \
+    create_nested_directory_from_path_v1
+
+# Crop box (left, top, right, bottom) of each test image
+AREAS = {"a.png": (8, 6, 56, 42), "b.png": (0, 10, 64, 38), os.path.join("sub", "c.png"): (3, 0, 61, 48)}
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    """
+    Returns: A folder with the PNG images of AREAS, of 64x48 pixels with a black border around their area.
+    """
+    folder = str(tmp_path / "images")
+    rng = np.random.default_rng(0)
+    for file, (left, top, right, bottom) in AREAS.items():
+        os.makedirs(os.path.join(folder, os.path.dirname(file)), exist_ok=True)
+        image_array = np.zeros((48, 64, 3), dtype=np.uint8)
+        image_array[top:bottom, left:right] = rng.integers(1, 256, size=(bottom - top, right - left, 3))
+        Image.fromarray(image_array).save(os.path.join(folder, file))
+    return folder
+
+def test_analyze_and_apply_round_trip(image_folder, monkeypatch):
+    with redirect_stdout(io.StringIO()):
+        assert analyze_black_pixels_of_image_path(path=image_folder, recursive=True) == []
+    new_folder_name = create_nested_directory_from_path_v1(path=image_folder)
+    with CropBoxIndex(fullpath=new_folder_name + CropBoxIndex.FILE_NAME) as crop_box_index:
+        assert sorted(crop_box_index) == sorted(AREAS)
+        for file, area in AREAS.items():
+            entry = crop_box_index.get(file)
+            assert entry["area"] == area
+            assert (entry["width"], entry["height"], entry["mode"], entry["format"]) == (64, 48, "RGB", "PNG")
+    assert [file for file in os.listdir(new_folder_name) if not file.startswith(".")] == [CropBoxIndex.FILE_NAME]
+
+    # The boxes are taken from the index: searching them again would not crop anything
+    def fail(*args, **kwargs):
+        raise AssertionError("The black border was searched again.")
+
+    monkeypatch.setattr(ImageModifications, "get_crop_box_from_image", fail)
+    with redirect_stdout(io.StringIO()):
+        assert remove_black_pixels_of_image_path_v3(path=image_folder, use_crop_box_index=True) == []
+    for file, area in AREAS.items():
+        expected = Image.open(os.path.join(image_folder, file)).crop(area)
+        np.testing.assert_array_equal(np.asarray(Image.open(new_folder_name + file)), np.asarray(expected))
+
+def test_changed_files_are_not_applied_with_a_stale_box(image_folder):
+    with redirect_stdout(io.StringIO()):
+        analyze_black_pixels_of_image_path(path=image_folder, recursive=True)
+        Image.new("RGB", (64, 48), (255, 255, 255)).save(os.path.join(image_folder, "a.png"))
+        failures = remove_black_pixels_of_image_path_v3(path=image_folder, use_crop_box_index=True)
+    assert [file for file, _ in failures] == ["a.png"]
+    new_folder_name = create_nested_directory_from_path_v1(path=image_folder)
+    assert not os.path.exists(new_folder_name + "a.png")
+    assert os.path.exists(new_folder_name + "b.png")
+
+def test_resumed_analysis_after_a_cut_row(image_folder):
+    new_folder_name = create_nested_directory_from_path_v1(path=image_folder)
+    with redirect_stdout(io.StringIO()):
+        analyze_black_pixels_of_image_path(path=image_folder, recursive=True)
+    # A crash while writing the last row, before the index was compacted
+    with open(new_folder_name + CropBoxIndex.FILE_NAME, encoding="utf-8") as index_file:
+        lines = index_file.read().splitlines()
+    cut_file = lines[-1].split(",")[0]
+    with open(new_folder_name + CropBoxIndex.FILE_NAME, "w", newline="", encoding="utf-8") as index_file:
+        index_file.write("\r\n".join(lines[:-1]) + "\r\n" + lines[-1][:len(lines[-1]) // 2])
+    crop_box_index = CropBoxIndex(fullpath=new_folder_name + CropBoxIndex.FILE_NAME)
+    assert sorted(crop_box_index) == sorted(set(AREAS) - {cut_file})
+
+    # Only the file of the cut row is analyzed again, and its new row is not lost even without compacting
+    crop_box_index.add(file=cut_file, size=0, mtime_ns=0, width=64, height=48, mode="RGB", image_format="PNG",
+                       area=AREAS[cut_file])
+    assert CropBoxIndex(fullpath=new_folder_name + CropBoxIndex.FILE_NAME).get(cut_file)["area"] == AREAS[cut_file]
+    crop_box_index.close()
+    with redirect_stdout(io.StringIO()) as output:
+        analyze_black_pixels_of_image_path(path=image_folder, recursive=True)
+    assert "2 files already analyzed were skipped." in output.getvalue()
+    with CropBoxIndex(fullpath=new_folder_name + CropBoxIndex.FILE_NAME) as crop_box_index:
+        assert {file: crop_box_index.get(file)["area"] for file in crop_box_index} == AREAS
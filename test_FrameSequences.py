@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from FrameSequences import SequenceCropBoxCache, get_sequence_key
+
+
+@pytest.mark.parametrize("file, key", [
+    ("video1/frame_000123.jpg", os.path.join("video1", "frame")),
+    ("video1/frame000123.jpg", os.path.join("video1", "frame")),
+    ("video1/cam_a_000123.jpg", os.path.join("video1", "cam_a")),
+    ("v/cam1_000123.jpg", os.path.join("v", "cam1")),
+    ("v/shot10_0001.png", os.path.join("v", "shot10")),
+    ("v/video_2-0005.jpg", os.path.join("v", "video_2")),
+])
+def test_prefix_sequence_key_only_removes_the_frame_number(file, key):
+    assert get_sequence_key(file, group_by="prefix") == key
+
+@pytest.mark.parametrize("first, second", [
+    ("v/cam1_000123.jpg", "v/cam2_000123.jpg"),
+    ("v/shot10_0001.jpg", "v/shot11_0001.jpg"),
+    ("v/video_2_0007.jpg", "v/video_3_0007.jpg"),
+])
+def test_distinct_sources_stay_in_separate_sequences(first, second):
+    assert get_sequence_key(first, group_by="prefix") != get_sequence_key(second, group_by="prefix")
+
+def test_distinct_cameras_get_their_own_crop_box():
+    # Each camera has its own border: sharing a sequence would crop every frame with the median of both
+    areas = {"cam1": (10, 10, 90, 90), "cam2": (30, 0, 70, 100)}
+    cache = SequenceCropBoxCache(detect_function=lambda fullpath: areas[os.path.basename(fullpath)[:4]],
+                                 sample_size=3, group_by="prefix")
+    for frame in range(6):
+        for camera, area in areas.items():
+            file = "v/" + camera + "_{0:06d}.jpg".format(frame)
+            assert cache.get_area(file=file, fullpath=file) == area
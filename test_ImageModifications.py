@@ -0,0 +1,127 @@
+import io
+import os
+import sys
+import json
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from DirectoryScanner import get_shard_index, get_shard_name
+from ImageModifications import get_crop_box_from_image_array, get_pixel_not_black_from_array, \
+    get_pixel_not_black_from_array_vectorized, remove_black_pixels_of_image_path_v3, \
+    create_nested_directory_from_path_v1, merge_shard_outputs
+from Manifest import ProcessingManifest
+
+
+def get_bordered_image_array(rng, height, width, border, channels=3):
+    """
+    Returns: A random image array with a black border of (top, right, bottom, left) pixels. Some pixels of its
+    content are black too, so the engines have to skip them in the middle lines.
+    """
+    top, right, bottom, left = border
+    shape = (height, width, channels) if channels else (height, width)
+    image_array = np.zeros(shape, dtype=np.uint8)
+    content_shape = (height - top - bottom, width - left - right) + shape[2:]
+    content = rng.integers(0, 256, size=content_shape, dtype=np.uint8)
+    content[rng.random(content_shape[:2]) < 0.05] = 0
+    image_array[top:height - bottom, left:width - right] = content
+    return image_array
+
+@pytest.mark.parametrize("channels", [3, 4, 0])
+def test_scanline_and_vectorized_engines_find_the_same_boxes(channels):
+    rng = np.random.default_rng(channels)
+    for _ in range(50):
+        height, width = rng.integers(2, 120, size=2)
+        border = (rng.integers(0, height // 2), rng.integers(0, width // 2), rng.integers(0, height // 2),
+                  rng.integers(0, width // 2))
+        image_array = get_bordered_image_array(rng, height, width, border, channels)
+        assert get_crop_box_from_image_array(image_array, "scanline") == \
+            get_crop_box_from_image_array(image_array, "vectorized")
+
+def test_engines_on_all_black_images():
+    for shape in ((40, 60, 3), (40, 60)):
+        image_array = np.zeros(shape, dtype=np.uint8)
+        assert get_crop_box_from_image_array(image_array, "scanline") is None
+        assert get_crop_box_from_image_array(image_array, "vectorized") is None
+
+def test_engines_on_images_without_border():
+    image_array = np.full((40, 60, 3), 200, dtype=np.uint8)
+    assert get_crop_box_from_image_array(image_array, "scanline") == (0, 0, 60, 40)
+    assert get_crop_box_from_image_array(image_array, "vectorized") == (0, 0, 60, 40)
+
+def test_engines_on_grayscale_images():
+    rng = np.random.default_rng(0)
+    image_array = get_bordered_image_array(rng, 90, 160, (10, 20, 5, 15), channels=0)
+    image_array[image_array.shape[0] // 2, 15] = 0  # Not the first non black pixel of the middle row any more
+    expected = get_crop_box_from_image_array(np.dstack([image_array] * 3), "scanline")
+    assert get_crop_box_from_image_array(image_array, "scanline") == expected
+    assert get_crop_box_from_image_array(image_array, "vectorized") == expected
+
+def test_pixel_search_of_both_engines():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        line = rng.integers(0, 3, size=(rng.integers(1, 30), 3), dtype=np.uint8)
+        assert get_pixel_not_black_from_array(line) == get_pixel_not_black_from_array_vectorized(line)
+
+def test_invalid_detection_engine_is_rejected_before_processing(tmp_path):
+    with pytest.raises(ValueError):
+        remove_black_pixels_of_image_path_v3(str(tmp_path), detection_engine="vectorised")
+    assert list(tmp_path.iterdir()) == []
+
+def create_image_folder(folder, count=24):
+    """
+    Create count small JPEG images with a black border, half of them in a subfolder.
+
+    Returns: The relative paths of the images.
+
+    """
+    files = []
+    for index in range(count):
+        file = os.path.join("sub", "frame_{0:03d}.jpg".format(index)) if index % 2 else \
+            "frame_{0:03d}.jpg".format(index)
+        os.makedirs(os.path.join(folder, os.path.dirname(file)), exist_ok=True)
+        image_array = np.zeros((48, 64, 3), dtype=np.uint8)
+        image_array[6:42, 8:56] = 40 + index
+        Image.fromarray(image_array).save(os.path.join(folder, file))
+        files.append(file)
+    return files
+
+def read_manifest_files(fullpath):
+    with open(fullpath, encoding="utf-8") as manifest_file:
+        return [json.loads(line)["file"] for line in manifest_file]
+
+def test_shards_processed_by_several_processes_are_disjoint_and_merged(tmp_path):
+    shard_count = 3
+    folder = str(tmp_path / "images")
+    files = create_image_folder(folder)
+    main_fullpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    processes = [subprocess.Popen([sys.executable, main_fullpath, "-i", folder, "-r", "--shard_index",
+                                   str(shard_index), "--shard_count", str(shard_count)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                 for shard_index in range(shard_count)]
+    for process in processes:
+        assert process.wait(timeout=120) == 0, process.stderr.read()
+        process.stderr.close()
+
+    new_folder_name = create_nested_directory_from_path_v1(path=folder)
+    shard_files = [read_manifest_files(new_folder_name + ".manifest." + get_shard_name(shard_index, shard_count) +
+                                       ".jsonl")
+                   for shard_index in range(shard_count)]
+    assert all(shard_files)
+    assert sum(len(files_) for files_ in shard_files) == len(files)
+    assert set().union(*shard_files) == set(files)
+    for shard_index, files_ in enumerate(shard_files):
+        assert all(get_shard_index(file, shard_count) == shard_index for file in files_)
+
+    with redirect_stdout(io.StringIO()):
+        assert merge_shard_outputs(path=folder, shard_count=shard_count, recursive=True) == []
+    assert sorted(read_manifest_files(new_folder_name + ProcessingManifest.FILE_NAME)) == sorted(files)
+
+    # An output lost after the merge is reported with its shard
+    os.remove(new_folder_name + files[0])
+    with redirect_stdout(io.StringIO()):
+        missing = merge_shard_outputs(path=folder, shard_count=shard_count, recursive=True)
+    assert missing == [(files[0], get_shard_index(files[0], shard_count))]
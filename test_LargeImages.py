@@ -0,0 +1,125 @@
+import zlib
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ImageModifications import decode_image_file, crop_and_resize_image, get_crop_box_from_image
+from LargeImages import PNG_SIGNATURE, get_decoded_bytes, iter_png_strips
+
+# Starting row, starting column, row step and column step of the 7 passes of an Adam7 interlaced PNG
+ADAM7_PASSES = ((0, 0, 8, 8), (0, 4, 8, 8), (4, 0, 8, 4), (0, 2, 4, 4), (2, 0, 4, 2), (0, 1, 2, 2), (1, 0, 2, 1))
+
+
+def get_test_image(mode, size=(53, 37), seed=0):
+    """
+    Returns: A PIL image of random pixels, so the PNG encoder uses every filter, in mode L, LA, RGB, RGBA or P (with
+    transparency if mode is "PA").
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    if mode in ("P", "PA"):
+        img = Image.fromarray(rng.integers(0, 256, size=(height, width), dtype=np.uint8), "P")
+        img.putpalette(rng.integers(0, 256, size=256 * 3, dtype=np.uint8).tobytes())
+        if mode == "PA":
+            img.info["transparency"] = bytes(rng.integers(0, 256, size=256, dtype=np.uint8))
+        return img
+    bands = Image.getmodebands(mode)
+    return Image.fromarray(rng.integers(0, 256, size=(height, width, bands), dtype=np.uint8).squeeze(), mode)
+
+def get_bordered_test_image(mode, size=(240, 160), border=(21, 33, 14, 9)):
+    """
+    Returns: A PIL image with a smooth content inside a black border of (left, top, right, bottom) pixels, in mode
+    L, RGB, RGBA or P (with 16 colors, so a 4 bit PNG file, if mode is "P16").
+    """
+    width, height = size
+    left, top, right, bottom = border
+    image_array = np.zeros((height, width, 3), dtype=np.uint8)
+    rows, columns = np.mgrid[top:height - bottom, left:width - right]
+    image_array[top:height - bottom, left:width - right] = np.dstack([50 + rows, 50 + columns // 2,
+                                                                       np.full_like(rows, 120)])
+    img = Image.fromarray(image_array)
+    if mode in ("P", "P16"):
+        return img.quantize(16 if mode == "P16" else 64)
+    return img.convert(mode)
+
+def save_interlaced_png(img, fullpath):
+    """
+    Save an L, RGB or RGBA image as an Adam7 interlaced PNG file, which Pillow can read but not write.
+    """
+    color_types = {"L": 0, "RGB": 2, "RGBA": 6}
+    image_array = np.asarray(img).reshape(img.height, img.width, -1)
+    data = b""
+    for top, left, row_step, column_step in ADAM7_PASSES:
+        pass_array = image_array[top::row_step, left::column_step]
+        if pass_array.size:
+            data += b"".join(b"\0" + row.tobytes() for row in pass_array)
+
+    def chunk(chunk_type, chunk_data):
+        return struct.pack(">I", len(chunk_data)) + chunk_type + chunk_data + \
+            struct.pack(">I", zlib.crc32(chunk_type + chunk_data))
+
+    with open(fullpath, "wb") as png_file:
+        png_file.write(PNG_SIGNATURE)
+        png_file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", img.width, img.height, 8, color_types[img.mode], 0,
+                                                  0, 1)))
+        png_file.write(chunk(b"IDAT", zlib.compress(data)))
+        png_file.write(chunk(b"IEND", b""))
+
+@pytest.mark.parametrize("strip_rows", [1, 2, 5, 16, 37, 100])
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA", "P", "PA"])
+def test_png_strips_are_the_rows_of_the_whole_image(tmp_path, mode, strip_rows):
+    fullpath = str(tmp_path / "image.png")
+    get_test_image(mode).save(fullpath)
+    expected = Image.open(fullpath)
+    tops, strips = zip(*iter_png_strips(fullpath=fullpath, strip_rows=strip_rows))
+    assert list(tops) == list(range(0, expected.height, strip_rows))
+    assert all(strip.mode == expected.mode for strip in strips)
+    np.testing.assert_array_equal(np.concatenate([np.asarray(strip) for strip in strips]), np.asarray(expected))
+    if expected.mode == "P":
+        assert strips[-1].getpalette() == expected.getpalette()
+        assert strips[-1].info.get("transparency") == expected.info.get("transparency")
+        # The colors, not only the indexes
+        np.testing.assert_array_equal(np.concatenate([np.asarray(strip.convert("RGBA")) for strip in strips]),
+                                      np.asarray(expected.convert("RGBA")))
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+def test_interlaced_png_is_not_read_in_strips(tmp_path, mode):
+    fullpath = str(tmp_path / "image.png")
+    img = get_test_image(mode)
+    save_interlaced_png(img, fullpath)
+    np.testing.assert_array_equal(np.asarray(Image.open(fullpath)), np.asarray(img))
+    with pytest.raises(ValueError):
+        next(iter_png_strips(fullpath=fullpath, strip_rows=8))
+
+@pytest.mark.parametrize("mode, interlaced", [("L", False), ("RGB", False), ("RGBA", False), ("P", False),
+                                              ("P16", False), ("RGB", True)])
+def test_memory_budget_gives_the_crop_of_a_full_decode(tmp_path, mode, interlaced):
+    fullpath = str(tmp_path / "image.png")
+    img = get_bordered_test_image(mode)
+    if interlaced:
+        save_interlaced_png(img, fullpath)
+    else:
+        img.save(fullpath)
+    resize_dimensions = (60, 40)
+
+    full_img, area = decode_image_file(fullpath)
+    assert area is None
+    full_area = get_crop_box_from_image(full_img)
+    assert full_area == (21, 33, 240 - 14, 160 - 9)
+    _, expected = crop_and_resize_image(full_img, resize_dimensions=resize_dimensions, force_dimensions=True,
+                                        area=full_area)
+
+    # Decoded reduced by 2, the 4 bit and interlaced PNG files without strips
+    memory_budget = get_decoded_bytes(full_img.size, full_img.mode) // 3
+    reduced_img, reduced_area = decode_image_file(fullpath, memory_budget=memory_budget)
+    assert reduced_img.size == (120, 80)
+    assert tuple(round(side * 2) for side in reduced_area) == full_area
+    _, image_cropped = crop_and_resize_image(reduced_img, resize_dimensions=resize_dimensions,
+                                             force_dimensions=True, area=reduced_area, memory_budget=memory_budget)
+    assert image_cropped.size == expected.size
+    # Only the resampling of both decodings differs
+    difference = np.abs(np.asarray(image_cropped.convert("RGB"), dtype=int) -
+                        np.asarray(expected.convert("RGB"), dtype=int))
+    assert difference.mean() < 2
@@ -0,0 +1,77 @@
+import io
+import os
+import json
+from contextlib import redirect_stdout
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ImageModifications import remove_black_pixels_of_image_path_v3, create_nested_directory_from_path_v1
+from Manifest import ProcessingManifest
+
+FILES = ["a.png", "b.png", "c.png", "d.png"]
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    """
+    Returns: A folder with the PNG images of FILES, with a black border.
+    """
+    folder = str(tmp_path / "images")
+    os.makedirs(folder)
+    for index, file in enumerate(FILES):
+        image_array = np.zeros((48, 64, 3), dtype=np.uint8)
+        image_array[6:42, 8:56] = 40 + index
+        Image.fromarray(image_array).save(os.path.join(folder, file))
+    return folder
+
+def process(path, **kwargs):
+    """
+    Returns: failures, skipped. The result of remove_black_pixels_of_image_path_v3() and the number of files it
+    skipped as up to date.
+    """
+    with redirect_stdout(io.StringIO()) as output:
+        failures = remove_black_pixels_of_image_path_v3(path=path, count_total=False, **kwargs)
+    for line in output.getvalue().splitlines():
+        if line.endswith(" files already up to date were skipped."):
+            return failures, int(line.split()[0])
+    # Without resume there is no manifest
+    assert not kwargs.get("resume", True)
+    return failures, 0
+
+def get_manifest_lines(folder):
+    with open(os.path.join(folder, ProcessingManifest.FILE_NAME), encoding="utf-8") as manifest_file:
+        return manifest_file.read().splitlines()
+
+def test_resume_skips_the_files_up_to_date(image_folder):
+    assert process(image_folder) == ([], 0)
+    new_folder_name = create_nested_directory_from_path_v1(path=image_folder)
+    assert sorted(json.loads(line)["file"] for line in get_manifest_lines(new_folder_name)) == FILES
+    assert process(image_folder) == ([], len(FILES))
+
+    # A changed source, a removed output and other parameters are processed again
+    Image.new("RGB", (64, 48), (255, 255, 255)).save(os.path.join(image_folder, "a.png"))
+    os.remove(new_folder_name + "b.png")
+    assert process(image_folder) == ([], len(FILES) - 2)
+    assert Image.open(new_folder_name + "a.png").size == (64, 48)
+    assert os.path.exists(new_folder_name + "b.png")
+    assert process(image_folder, resize_dimensions=(32, 24)) == ([], 0)
+    assert process(image_folder, resize_dimensions=(32, 24)) == ([], len(FILES))
+    assert process(image_folder, resume=False) == ([], 0)
+
+def test_resume_after_a_truncated_last_line(image_folder):
+    process(image_folder)
+    new_folder_name = create_nested_directory_from_path_v1(path=image_folder)
+    # A crash while writing the last entry
+    lines = get_manifest_lines(new_folder_name)
+    cut_file = json.loads(lines[-1])["file"]
+    with open(new_folder_name + ProcessingManifest.FILE_NAME, "w", encoding="utf-8") as manifest_file:
+        manifest_file.write("\n".join(lines[:-1]) + "\n" + lines[-1][:len(lines[-1]) // 2])
+
+    # Only the file of the cut line is processed again, and its new entry is kept
+    assert process(image_folder) == ([], len(FILES) - 1)
+    entries = [json.loads(line) for line in get_manifest_lines(new_folder_name)]
+    assert sorted(entry["file"] for entry in entries) == FILES
+    assert entries[-1]["file"] == cut_file
+    assert process(image_folder) == ([], len(FILES))
@@ -0,0 +1,15 @@
+import io
+
+from Prints import ProgressReporter
+
+
+def test_progress_is_rendered_once_when_nothing_new_is_done():
+    stream = io.StringIO()
+    progress = ProgressReporter(total=3, stream=stream)
+    progress.update(2)
+    progress.update(1)
+    # E.g. the files skipped by the manifest, when none was skipped
+    progress.update(0)
+    progress.close()
+    lines = stream.getvalue().splitlines()
+    assert [line for line in lines if line.startswith("Progress: 3/3 (100.000%)")] == lines[-1:]